@@ -1,28 +1,31 @@
 """That is the script called by the papers cli command
 """
 import os
-import copy
 import sys
 from pathlib import Path
 import logging
 import argparse
 import subprocess as sp
 import shutil
+import json
 import itertools
 import fnmatch   # unix-like match
 
 import papers
 from papers import logger
-from papers.extract import extract_pdf_doi, isvaliddoi, extract_pdf_metadata
+from papers.extract import extract_pdf_doi, isvaliddoi
 from papers.extract import fetch_bibtex_by_doi, fetch_bibtex_by_fulltext_crossref, fetch_bibtex_by_fulltext_scholar
+from papers.pipeline import extract_pdfs_metadata
+from papers import extractcache
 from papers.encoding import parse_file, format_file, family_names, format_entries, standard_name, format_entry, parse_keywords, format_key
 from papers.config import (bcolors, Config, search_config, CONFIG_FILE, CONFIG_FILE_LOCAL,
                            DATA_DIR, CONFIG_FILE_LEGACY, CONFIG_FILE_LEGACY_XDG)
-from papers.duplicate import list_duplicates, list_uniques, edit_entries, title_id
-from papers.entries import get_entry_val, entry_content_equal
+from papers.duplicate import list_duplicates, list_uniques, edit_entries, title_id, duplicate_blocks
+from papers.entries import get_entry_val, entry_content_equal, entry_from_dict
+from papers.journal import Journal
 from papers.bib import (Biblio, FUZZY_RATIO, DEFAULT_SIMILARITY, entry_filecheck,
                         backupfile as backupfile_func, isvalidkey, DuplicateKeyError, clean_filesdir,
-                        are_duplicates, download_url, get_biblio)
+                        are_duplicates, download_url, get_biblio, stream_biblio)
 from papers.install import resolve_install, apply_install, InputAsker, DefaultAsker
 from papers.utils import view_pdf, open_folder, PapersExit
 from papers.backup import (silent_backup_bib, restore_from_backupdir,
@@ -59,9 +62,10 @@ def check_legacy_config(configfile):
     return configfile
 
 
-def savebib(biblio, config):
+def savebib(biblio, config, journal=None):
     """
-    Given a Biblio object and its configuration, save them to disk.  If you're using the git bib tracker, will trigger a git commit there.
+    Given a Biblio object and its configuration, save them to disk.  If you're using the git bib tracker, will trigger a git commit there
+    (with the changes recorded in journal, if any, in the commit message).
     """
     if papers.config.DRYRUN:
         logger.info(f'DRYRUN: NOT saving {config.bibtex}')
@@ -70,7 +74,7 @@ def savebib(biblio, config):
     if biblio is not None:
         biblio.save(config.bibtex)
     if config.file and config.git:
-        silent_backup_bib(biblio, config)
+        silent_backup_bib(biblio, config, journal=journal)
     else:
         logger.debug(f'do not backup bib: {config.file}, {config.git}')
     # if config.git:
@@ -204,22 +208,23 @@ def check_install(parser, o, config, bibtex_must_exist=True):
     return True
 
 
-def _print_biblio_diff(biblio_init, biblio, touched_entries, show_existing=False):
+def _print_biblio_diff(journal, biblio, touched_entries, show_existing=False):
     """Emit Added/Modified/Removed (and optionally Existing) lines for
-    entries that differ between the pre-command snapshot and the
-    post-command state.
+    entries that differ between the state recorded in the journal when
+    the command started and the post-command state.
 
     `touched_entries` scopes the Modified/Existing check to entries the
     command actually considered (matches addcmd's original semantics).
     """
-    old_set = set(get_entry_val(e, 'ID', '') for e in biblio_init.entries)
-    old_entries_by_key = {get_entry_val(e, 'ID', ''): e for e in biblio_init.db.entries}
+    entries_before = journal.entries_before()
+    old_set = set(get_entry_val(e, 'ID', '') for e in entries_before)
+    old_entries_by_key = {get_entry_val(e, 'ID', ''): e for e in entries_before}
     new_set = set(get_entry_val(e, 'ID', '') for e in biblio.entries)
     new_entries_by_key = {get_entry_val(e, 'ID', ''): e for e in biblio.db.entries}
     modified_set = set(get_entry_val(e, 'ID', '') for e in touched_entries).intersection(set.intersection(old_set, new_set))
 
     for ID in sorted(old_set - new_set):
-        print(format_entry(biblio_init, old_entries_by_key[ID], prefix="Removed"))
+        print(format_entry(journal.biblio, old_entries_by_key[ID], prefix="Removed"))
 
     for ID in sorted(new_set - old_set):
         print(format_entry(biblio, new_entries_by_key[ID], prefix="Added"))
@@ -242,7 +247,7 @@ def addcmd(parser, o, config):
     set_keyformat_config_from_cmd(o, config)
 
     biblio = get_biblio(config)
-    biblio_init = copy.deepcopy(biblio)
+    journal = Journal(biblio)
 
     entries = []
 
@@ -278,6 +283,9 @@ def addcmd(parser, o, config):
 
     kw = {'on_conflict':o.mode, 'check_duplicate':not o.no_check_duplicate,
             'mergefiles':not o.no_merge_files, 'update_key':o.update_key, 'metadata':metadata}
+    if kw['check_duplicate']:
+        # built once for all files, and kept up to date by each insert
+        kw['duplicate_index'] = biblio.duplicate_index()
 
     if len(o.file) == 0 and o.doi and not o.no_query_doi:
         entries.extend( biblio.fetch_doi(o.doi, attachments=o.attachment, rename=o.rename, copy=o.copy, **kw) )
@@ -303,7 +311,7 @@ def addcmd(parser, o, config):
                     entries.extend( biblio.scan_dir(file, rename=o.rename, copy=o.copy,
                                 search_doi=not o.no_query_doi,
                                 search_fulltext=not o.no_query_fulltext,
-                                **kw) )
+                                timeout=o.timeout, **kw) )
                 else:
                     raise ValueError(file+' is a directory, requires --recursive to explore')
 
@@ -331,8 +339,8 @@ def addcmd(parser, o, config):
         entries = [e for e in biblio.entries if biblio.key(e) in unique_keys]
 
     if o.edit:
-        entry_keys = [biblio.key(e) for e in entries]
-        otherentries = [e for e in biblio.entries if biblio.key(e) not in entry_keys]
+        entry_keys = {biblio.key(e) for e in entries}
+        edited = [e for e in biblio.entries if biblio.key(e) in entry_keys]
 
         try:
             entries = edit_entries(entries)
@@ -340,14 +348,13 @@ def addcmd(parser, o, config):
             logger.error(str(error))
             return
 
-        entries = [{k:v for k,v in e.items() if v != ""} for e in entries]
-        biblio.db.entries = sorted(otherentries + entries, key=lambda e: biblio.key(e))
+        entries = [entry_from_dict({k:v for k,v in e.items() if v != ""}) for e in entries]
+        biblio.replace_many(edited, entries)
 
-    savebib(biblio, config)
+    savebib(biblio, config, journal=journal)
 
     # compare entries to inform user
-    # this is not very efficient but I have yet to hear a complaint about speed
-    _print_biblio_diff(biblio_init, biblio, entries, show_existing=True)
+    _print_biblio_diff(journal, biblio, entries, show_existing=True)
 
     if o.open:
         for e in entries:
@@ -378,7 +385,13 @@ def checkcmd(parser, o, config):
         mode = o.mode
         if o.force and mode == 'i':
             mode = 's'  # --force means non-interactive: leave unresolved duplicates alone
-        biblio.check_duplicates(mode=mode)
+        report = []
+        before = len(biblio.entries)
+        biblio.check_duplicates(mode=mode, report=report)
+        if o.report:
+            with open(o.report, 'w') as f:
+                json.dump({'entries_before': before, 'entries_after': len(biblio.entries), 'groups': report}, f, indent=2)
+            logger.info(f'{len(report)} merged group(s) reported in {o.report}')
 
     savebib(biblio, config)
 
@@ -491,6 +504,28 @@ def gitcmd(parser, o, config):
         print(f"Error message: {error}")
         parser.error('papers failed to execute git command -- you should check your system git install.')
 
+def cachecmd(parser, o):
+    if o.action == 'clear':
+        removed = extractcache.prune(0)
+        print(f'removed {removed} PDF files from {extractcache.cache_file()}')
+        return
+    if o.action == 'prune':
+        removed = extractcache.prune(None if o.max_size is None else int(o.max_size * 2**20))
+        print(f'removed {removed} least recently used PDF files from {extractcache.cache_file()}')
+
+    stats = extractcache.stats()
+    print('{file}: {files} PDF files, {size:.1f} MB (max {max_size:.0f} MB)'.format(
+        size=stats['bytes'] / 2**20, max_size=stats['max_bytes'] / 2**20, **stats))
+    for settings, count in sorted(stats['settings'].items()):
+        maxpages, minwords, image = settings.split(':')
+        print(f"  {count} read with maxpages={maxpages} minwords={minwords}" + (" (OCR)" if image == '1' else ""))
+    cachedir = os.path.dirname(stats['file'])
+    others = [name for name in sorted(os.listdir(cachedir)) if name.endswith('.json')
+              and name != os.path.basename(stats['file'])] if os.path.isdir(cachedir) else []
+    for name in others:
+        print(f'{os.path.join(cachedir, name)}: {os.path.getsize(os.path.join(cachedir, name)) / 2**20:.1f} MB')
+
+
 def doicmd(parser, o):
     print(extract_pdf_doi(o.pdf, image=o.image))
 
@@ -536,17 +571,35 @@ def extractcmd(parser, o):
     if not files:
         logger.warning('no PDF file found')
         return
-    for file in files:
+    results = extract_pdfs_metadata(files, jobs=papers.config.JOBS, timeout=o.timeout,
+                                    search_doi=not o.fulltext, search_fulltext=True, scholar=o.scholar,
+                                    minwords=o.word_count, max_query_words=o.word_count, image=o.image)
+    for file, bibtex, error in results:
         if len(files) > 1:
             print(f'% {file}')
-        try:
-            print(extract_pdf_metadata(file, search_doi=not o.fulltext, search_fulltext=True, scholar=o.scholar, minwords=o.word_count, max_query_words=o.word_count, image=o.image))
-        except Exception as error:
-            if len(files) == 1:
-                raise
+        if error is None:
+            print(bibtex)
+        elif len(files) == 1:
+            raise error
+        else:
             logger.error(f'{file} :: {error}')
 
 
+def mergecmd(parser, o):
+    first, second = o.bibtex
+    for bibtex in o.bibtex:
+        if not os.path.exists(bibtex):
+            parser.error(f'{bibtex} does not exist')
+    biblio = Biblio.load(first, '', similarity=o.similarity)
+    # file paths relative to the output file
+    outdir = os.path.dirname(os.path.abspath(o.output))
+    if Path(biblio.relative_to).resolve() != Path(outdir).resolve():
+        biblio.update_file_path(outdir)
+    counts = biblio.merge_bibtex_file(second, on_conflict=o.mode, mergefiles=not o.no_merge_files)
+    print('{added} added, {duplicates} exact duplicates, {conflicts} conflicts, {renamed} keys renamed'.format(**counts))
+    biblio.save(o.output)
+
+
 def _fullsearch_string(e):
     return " ".join([v for k,v in sorted(e.items(), key=lambda kv:kv[0]) if v is not None])
 
@@ -583,9 +636,23 @@ def listcmd(parser, o, config):
         return False
 
 
-    biblio = get_biblio(config)
-    biblio_init = copy.deepcopy(biblio)
-    entries = biblio.db.entries
+    def _highlight_invalid_doi(e):
+        if 'doi' in e and not isvaliddoi(e['doi']):
+            e['doi'] = bcolors.FAIL + e['doi'] + bcolors.ENDC
+        return e
+
+    # read-only listing: filter and print the entries as the file is parsed
+    readonly = not (o.add_keywords or o.add_files or o.edit or o.fetch or o.rename or o.delete)
+    streaming = readonly and not (o.duplicates_key or o.duplicates_doi or o.duplicates_tit or o.duplicates)
+
+    if streaming or (readonly and o.compact):
+        # with --key, only the matching entries need parsing (if the key index is up-to-date)
+        biblio, entries = stream_biblio(config, key_filter=(lambda k: _longmatch(k, o.key)) if o.key else None,
+                                        compact=o.compact)
+    else:
+        biblio = get_biblio(config)
+        journal = Journal(biblio)
+        entries = biblio.db.entries
 
     if o.fuzzy:
         from rapidfuzz import fuzz
@@ -593,41 +660,41 @@ def listcmd(parser, o, config):
 
     if o.review_required:
         if o.invert:
-            entries = [e for e in entries if not _requiresreview(e)]
+            entries = (e for e in entries if not _requiresreview(e))
         else:
-            entries = [e for e in entries if _requiresreview(e)]
-            for e in entries:
-                if 'doi' in e and not isvaliddoi(e['doi']):
-                    e['doi'] = bcolors.FAIL + e['doi'] + bcolors.ENDC
+            entries = (_highlight_invalid_doi(e) for e in entries if _requiresreview(e))
     if o.has_file:
-        entries = [e for e in entries if get_entry_val(e, 'file', '')]
+        entries = (e for e in entries if get_entry_val(e, 'file', ''))
     if o.no_file:
-        entries = [e for e in entries if not get_entry_val(e, 'file', '')]
+        entries = (e for e in entries if not get_entry_val(e, 'file', ''))
     if o.broken_file:
-        entries = [e for e in entries if get_entry_val(e, 'file', '') and any([not os.path.exists(f) for f in parse_file(e['file'], relative_to=biblio.relative_to)])]
+        entries = (e for e in entries if get_entry_val(e, 'file', '') and any([not os.path.exists(f) for f in parse_file(e['file'], relative_to=biblio.relative_to)]))
 
 
     if o.doi:
-        entries = [e for e in entries if 'doi' in e and _longmatch(e['doi'], o.doi)]
+        entries = (e for e in entries if 'doi' in e and _longmatch(e['doi'], o.doi))
     if o.key:
-        entries = [e for e in entries if _longmatch(get_entry_val(e, 'ID', ''), o.key)]
+        entries = (e for e in entries if _longmatch(get_entry_val(e, 'ID', ''), o.key))
     if o.year:
-        entries = [e for e in entries if 'year' in e and _longmatch(e['year'], o.year)]
+        entries = (e for e in entries if 'year' in e and _longmatch(e['year'], o.year))
     if o.first_author:
         first_author = lambda field : family_names(field)[0]
-        entries = [e for e in entries if 'author' in e and _longmatch(first_author(e['author']), o.first_author)]
+        entries = (e for e in entries if 'author' in e and _longmatch(first_author(e['author']), o.first_author))
     if o.author:
         author = lambda field : ' '.join(family_names(field))
-        entries = [e for e in entries if 'author' in e and _longmatch(author(e['author']), o.author)]
+        entries = (e for e in entries if 'author' in e and _longmatch(author(e['author']), o.author))
     if o.title:
-        entries = [e for e in entries if 'title' in e and _longmatch(e['title'], o.title)]
+        entries = (e for e in entries if 'title' in e and _longmatch(e['title'], o.title))
     if o.abstract:
-        entries = [e for e in entries if 'abstract' in e and _longmatch(e['abstract'], o.abstract)]
+        entries = (e for e in entries if 'abstract' in e and _longmatch(e['abstract'], o.abstract))
     if o.keywords:
-        entries = [e for e in entries if 'keywords' in e and _longmatch(e['keywords'], o.keywords)]
+        entries = (e for e in entries if 'keywords' in e and _longmatch(e['keywords'], o.keywords))
     if o.fullsearch:
-        o.strict = False
-        entries = [e for e in entries if _longmatch(_fullsearch_string(e), o.fullsearch)]
+        # always substring matching (the filters above are evaluated lazily: leave o.strict alone)
+        entries = (e for e in entries if _match(_fullsearch_string(e), o.fullsearch, fuzzy=o.fuzzy, substring=True))
+
+    if not streaming:
+        entries = list(entries)
 
     _check_duplicates = lambda uniques, groups: uniques if o.invert else list(itertools.chain(*groups))
 
@@ -646,7 +713,8 @@ def listcmd(parser, o, config):
         # (otherwise we'd have used the command-line option o.similarity, or possibly DEFAULT_SIMILARITY)
         # Might need to revise later (the question mark is from a review after a long time without use)
         eq = lambda a, b: get_entry_val(a, 'ID', '') == get_entry_val(b, 'ID', '') or are_duplicates(a, b, similarity="PARTIAL", fuzzy_ratio=o.fuzzy_ratio)
-        entries = list_dup(entries, eq=eq)
+        blocks = lambda e: duplicate_blocks(e) + [('ID', get_entry_val(e, 'ID', ''))]
+        entries = list_dup(entries, eq=eq, blocks=blocks)
 
     if o.add_keywords:
         for e in entries:
@@ -655,7 +723,7 @@ def listcmd(parser, o, config):
                 if w not in keywords:
                     keywords.append(w)
             e['keywords'] = ", ".join(keywords)
-        savebib(biblio, config)
+        savebib(biblio, config, journal=journal)
 
     elif o.add_files:
         if len(entries) != 1:
@@ -679,33 +747,32 @@ def listcmd(parser, o, config):
         biblio.set_files(e, files)
         if o.rename:
             biblio.rename_entry_files(e, copy=o.copy)
-        savebib(biblio, config)
+        savebib(biblio, config, journal=journal)
 
     elif o.edit:
-        otherentries = [e for e in biblio.db.entries if e not in entries]
         try:
+            edited = entries
             entries = edit_entries(entries)
-            biblio.entries = otherentries + entries
+            biblio.replace_many(edited, entries)
         except Exception as error:
             logger.error(str(error))
             return
 
-        savebib(biblio, config)
+        savebib(biblio, config, journal=journal)
 
     elif o.fetch:
         for e in entries:
             biblio.fix_entry(e, fix_doi=True, fix_key=True, fetch_all=True, interactive=True)
-        savebib(biblio, config)
+        savebib(biblio, config, journal=journal)
 
     elif o.rename:
         for e in entries:
             biblio.rename_entry_files(e, copy=o.copy)
-        savebib(biblio, config)
+        savebib(biblio, config, journal=journal)
 
     elif o.delete:
-        for e in entries:
-            biblio.db.remove(e)
-        savebib(biblio, config)
+        biblio.remove_many(entries)
+        savebib(biblio, config, journal=journal)
 
     elif o.open:
         for e in entries:
@@ -714,38 +781,51 @@ def listcmd(parser, o, config):
     elif o.field:
         # entries = [{k:e[k] for k in e if k in o.field+['ID','ENTRYTYPE']} for e in entries]
         for e in entries:
-            print(format_key(e, no_key=o.no_key),*[get_entry_val(e, k, "") for k in o.field])
+            print(format_key(e, no_key=o.no_key),*[get_entry_val(e, k, "") for k in o.field], flush=True)
     elif o.key_only:
         for e in entries:
-            print(get_entry_val(e, 'ID', ''))
+            print(get_entry_val(e, 'ID', ''), flush=True)
     elif o.one_liner:
         for e in entries:
-            print(format_entry(biblio, e, no_key=o.no_key))
+            print(format_entry(biblio, e, no_key=o.no_key), flush=True)
 
     else:
-        print(format_entries(entries))
+        # same output as format_entries(entries), one entry at a time
+        for i, e in enumerate(entries):
+            print(("\n" if i else "") + format_entries([e]), end="", flush=True)
+        print()
 
     # report any entry mutations (--add-files, --add-keywords, --edit, --fetch,
     # --rename, --delete) using the same Added/Modified/Removed convention as addcmd
-    _print_biblio_diff(biblio_init, biblio, entries)
+    if not readonly:
+        _print_biblio_diff(journal, biblio, entries)
 
 
 def opencmd(parser, o, config):
+    # an existing file is opened directly with the system viewer; anything
+    # else is looked up as an entry key in the bibliography
+    keys = [key.lower() for key in o.key if not os.path.isfile(key)]
     biblio = None
     entries_by_key = {}
+    if keys:
+        try:
+            biblio, entries = stream_biblio(config, key_filter=lambda k: k.lower() in keys)
+        except ValueError:
+            key = next(key for key in o.key if not os.path.isfile(key))
+            raise PapersExit(f"'{key}' is not an existing file, and no bibliography is configured to look it up as a key")
+        # stop reading the library once all keys are found
+        for e in entries:
+            k = biblio.key(e)
+            if k in keys and k not in entries_by_key:
+                entries_by_key[k] = e
+                if len(entries_by_key) == len(set(keys)):
+                    break
+
     for key in o.key:
-        # an existing file is opened directly with the system viewer; anything
-        # else is looked up as an entry key in the bibliography
         if os.path.isfile(key):
             logger.info(f"opening {key} ...")
             view_pdf(key)
             continue
-        if biblio is None:
-            try:
-                biblio = get_biblio(config)
-            except ValueError:
-                raise PapersExit(f"'{key}' is not an existing file, and no bibliography is configured to look it up as a key")
-            entries_by_key = {biblio.key(e): e for e in biblio.entries}
         e = entries_by_key.get(key.lower())
         if e is None:
             logger.error(f'no entry found with key: {key}')
@@ -787,6 +867,8 @@ def get_parser(config=None):
         help=f'bibtex database (default: {config.bibtex}')
     grp.add_argument('--dry-run', action='store_true',
         help='no PDF renaming/copying, no bibtex writing on disk (for testing)')
+    grp.add_argument('-j', '--jobs', type=int, default=None,
+        help='worker processes to parse large bibtex files and read PDF files (default: 1, 0: one per CPU)')
     grp.add_argument('--relative-paths', action="store_false", dest="absolute_paths", default=None)
     grp.add_argument('--absolute-paths', action="store_true", default=None)
     grp.add_argument('--no-git', action='store_false', dest='git', default=None, help="""Do not commit the currrent action, whatever happens""")
@@ -898,6 +980,8 @@ def get_parser(config=None):
         of .pdf files (bibtex files are ignored in this mode')
     grp.add_argument('--ignore-errors', action='store_true',
         help='ignore errors when adding multiple files')
+    grp.add_argument('--timeout', type=float, default=None,
+        help='skip a PDF file that takes more than that many seconds to read (default: no limit)')
 
     grp = addp.add_argument_group('metadata')
     grp.add_argument('--doi', help='provide DOI -- skip parsing PDF')
@@ -950,6 +1034,7 @@ def get_parser(config=None):
     grp = checkp.add_argument_group('merge/conflict')
     grp.add_argument('--duplicates',action='store_true', help='solve duplicates')
     grp.add_argument('-m', '--mode', default='i', choices=list('ims'), help='''(i)interactive mode by default, otherwise (m)erge or (s)kip failed''')
+    grp.add_argument('--report', help='write the groups merged with -m m to this file (JSON)')
     # grp.add_argument('--ignore', action='store_true', help='ignore unresolved conflicts')
     # checkp.add_argument('--merge-keys', nargs='+', help='only merge remove / merge duplicates')
     # checkp.add_argument('--duplicates',action='store_true', help='remove / merge duplicates')
@@ -1007,6 +1092,7 @@ def get_parser(config=None):
     listp.add_argument('--similarity', choices=['EXACT','GOOD','FAIR','PARTIAL','FUZZY'], default=DEFAULT_SIMILARITY, help='duplicate testing (default:%(default)s)')
     listp.add_argument('--invert', action='store_true')
     listp.add_argument('--any', action='store_true', help='when several keywords: any of them')
+    listp.add_argument('--compact', action='store_true', help='hold the entries in a compact read-only form (less memory for duplicate searches in large libraries; ignored with actions)')
 
     grp = listp.add_argument_group('search')
     grp.add_argument('-a','--author', nargs='+', help='any of the authors')
@@ -1076,6 +1162,27 @@ def get_parser(config=None):
     extractp.add_argument('--fulltext', action='store_true', help='fulltext only (otherwise DOI-based)')
     extractp.add_argument('--scholar', action='store_true', help='use google scholar instead of default crossref for fulltext search')
     extractp.add_argument('--image', action='store_true', help='convert to image and use tesseract instead of pdftotext')
+    extractp.add_argument('-j', '--jobs', type=int, default=None,
+        help='worker processes to read the PDF files (default: 1, 0: one per CPU)')
+    extractp.add_argument('--timeout', type=float, default=None,
+        help='give up on a PDF file after that many seconds (default: no limit)')
+
+    # merge
+    # =====
+    mergep = subparsers.add_parser('merge', description='merge two bibtex files into a new one, in one pass (faster than papers add for large files)',
+        parents=[loggingp])
+    mergep.add_argument('bibtex', nargs=2, help='the two bibtex files: keys and values of the first one win')
+    mergep.add_argument('-o', '--output', required=True, help='merged bibtex file')
+    mergep.add_argument('--similarity', choices=['EXACT','GOOD','FAIR','PARTIAL','FUZZY'], default=DEFAULT_SIMILARITY, help='duplicate testing (default:%(default)s)')
+    mergep.add_argument('--no-merge-files', action='store_true',
+        help='distinct "file" field considered a conflict, all other things being equal')
+    mergep.add_argument('-m', '--mode', default='u', choices=['u', 'U', 'o', 's', 'r', 'i', 'a'],
+        help='''if duplicates are found, the default is to (u)pdate the entry of the first file with its
+        missing fields, otherwise (U)pdate with the second file's values, (o)verwrite completely, (s)kip
+        the second file's entry, (a)ppend anyway, (r)aise, or start an (i)nteractive dialogue for each.
+        ''')
+    mergep.add_argument('-j', '--jobs', type=int, default=None,
+        help='worker processes to parse large bibtex files (default: 1, 0: one per CPU)')
 
     # *** Pure OS related file checks ***
 
@@ -1097,6 +1204,14 @@ def get_parser(config=None):
     gitp = subparsers.add_parser('git', description='git subcommand')
     gitp.add_argument('gitargs', nargs=argparse.REMAINDER)
 
+    # extraction cache
+    # ================
+    cachep = subparsers.add_parser('cache', description='cache of the text and DOI extracted from PDF files', parents=[loggingp])
+    cachep.add_argument('action', nargs='?', choices=['stats', 'prune', 'clear'], default='stats',
+        help='show statistics (default), evict the least recently used files beyond --max-size, or empty the cache')
+    cachep.add_argument('--max-size', type=float, metavar='MB', default=None,
+        help=f'size limit for prune (default: {extractcache.CACHE_MAX_BYTES // 2**20} MB)')
+
     # backup
     # ======
     backupp = subparsers.add_parser('backup', description='manage backup directories', parents=[loggingp])
@@ -1121,6 +1236,7 @@ def handle_logging(o):
 
 def main(args=None):
     papers.config.DRYRUN = False  # reset in case main() if called directly
+    papers.config.JOBS = 1
     if args is not None:
         # used in the commit message
         sys.argv = sys.argv[:1] + args
@@ -1165,6 +1281,9 @@ def main(args=None):
     if hasattr(o,'dry_run'):
         papers.config.DRYRUN = o.dry_run
 
+    if getattr(o, 'jobs', None) is not None:
+        papers.config.JOBS = o.jobs
+
     try:
         subp = subparsers.choices[o.cmd]
     except KeyError:
@@ -1210,12 +1329,16 @@ def main(args=None):
         gitcmd(subp, o, config)
     elif o.cmd == 'backup':
         backupcmd(subp, o, config)
+    elif o.cmd == 'cache':
+        cachecmd(subp, o)
     elif o.cmd == 'doi':
         doicmd(subp, o)
     elif o.cmd == 'fetch':
         fetchcmd(subp, o)
     elif o.cmd == 'extract':
         extractcmd(subp, o)
+    elif o.cmd == 'merge':
+        mergecmd(subp, o)
     else:
         parser.print_help()
         raise PapersExit()
@@ -1231,6 +1354,11 @@ def main_clean_exit(args=None):
         if error.args:
             logger.error(str(error))
         sys.exit(1)
+    except BrokenPipeError:
+        # output piped to a command that exited early, e.g. `papers list | head`:
+        # silence the error Python would emit when flushing stdout at exit
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        sys.exit(1)
 
 if __name__ == "__main__":
     # we use try/except here to use a clean exit instead of trace
@@ -38,7 +38,6 @@ operation that finds a manifest belonging to another library moves the
 current library to a fresh directory instead of mixing histories, whereas an
 explicit ``papers install`` claims the directory for its bibtex.
 """
-import copy
 import hashlib
 import json
 import logging
@@ -52,7 +51,8 @@ from pathlib import Path
 
 from papers import logger, __version__
 from papers.entries import get_entry_val
-from papers.utils import checksum, move, PapersExit
+from papers.utils import move, PapersExit
+from papers.checksums import same_content
 
 MANIFEST_NAME = "manifest.json"
 # version of the backup directory layout, recorded in the manifest
@@ -239,8 +239,11 @@ def list_backup_dirs(config=None):
     return [backup_info(d, config=config) for d in dirs]
 
 
-def backup_bib(biblio, config, message=None):
+def backup_bib(biblio, config, message=None, journal=None):
+    """Commit the bibtex file (and with --git-lfs the files) to the backup repository.
+    The changes recorded in journal, if any, are listed in the commit message."""
     from papers.bib import clean_filesdir
+    from papers.journal import Journal
 
     if not config.git:
         raise PapersExit('cannot backup without --git enabled')
@@ -272,22 +275,30 @@ def backup_bib(biblio, config, message=None):
     if config.backup_files:
         logger.info('backup bibliography with files')
         config.backupfile_clean.unlink(missing_ok=True)
-        biblio = copy.deepcopy(biblio)
-        backupfilesdir = backupdir/"files"
-        backupfilesdir.mkdir(exist_ok=True)
-        biblio.filesdir = str(backupfilesdir)
-        biblio.rename_entries_files(copy=True, relative_to=backupdir, hardlink=True)
-        biblio.save(config.backupfile_clean)
-        run_git(config.gitdir, ["add", config.backupfile_clean.name])
-
-        # Remove unlinked files
-        clean_filesdir(biblio, interactive=False, ignore_files=[config.backupfile, config.backupfile_clean])
-        run_git(config.gitdir, ["add", "files"])
+        # the library is modified for the clean copy, then brought back as it was
+        backup_journal = Journal(biblio)
+        try:
+            backupfilesdir = backupdir/"files"
+            backupfilesdir.mkdir(exist_ok=True)
+            biblio.filesdir = str(backupfilesdir)
+            biblio.rename_entries_files(copy=True, relative_to=backupdir, hardlink=True)
+            # a copy: no snapshot or key index, and the next save of the library stays incremental
+            biblio.save(config.backupfile_clean, cache=False)
+            run_git(config.gitdir, ["add", config.backupfile_clean.name])
+
+            # Remove unlinked files
+            clean_filesdir(biblio, interactive=False, ignore_files=[config.backupfile, config.backupfile_clean])
+            run_git(config.gitdir, ["add", "files"])
+        finally:
+            backup_journal.undo()
 
     else:
         logger.info('backup bibliography only (without files)')
 
     message = message or 'papers ' + ' '.join(sys.argv[1:])
+    summary = journal.summary() if journal is not None else ''
+    if summary:
+        message += '\n\n' + summary
     run_git(config.gitdir, ["commit", "-m", message], check=False)
     # work on "main" branch for comitting (out of history branch)
     run_git(config.gitdir, ["checkout", "-B", "main"])
@@ -373,7 +384,7 @@ def _restore_from_backupdir(config, restore_files=False):
             if os.path.exists(f):
 
                 # same file: nothing to do
-                if os.path.samefile(f, f_clean) or checksum(f_clean) == checksum(f):
+                if same_content(f, f_clean):
                     new_files.append(f)
 
                 else:
@@ -480,7 +491,11 @@ def git_undo(config, restore_files=False, steps=1):
     res = run_git(config.gitdir, ["rev-parse", "--verify", "--quiet", f"{cur}~{steps}"], check=False)
     if res.returncode != 0:
         raise PapersExit("nothing to undo")
-    _append_restore_commit(config, res.stdout.strip(), kind="undo")
+    target = res.stdout.strip()
+    # the messages of the undone states list their changes (see backup_bib)
+    undone = run_git(config.gitdir, ["log", "--first-parent", "--pretty=%B", f"{target}..{cur}"], check=False).stdout
+    logger.info(f"undo:\n{undone.strip()}")
+    _append_restore_commit(config, target, kind="undo")
     restore_from_backupdir(config, restore_files=restore_files)
 
 
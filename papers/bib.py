@@ -1,4 +1,5 @@
 import os
+import itertools
 from pathlib import Path
 import shutil
 import tempfile
@@ -6,6 +7,7 @@ import requests
 from unidecode import unidecode as unicode_to_ascii
 import bibtexparser
 from bibtexparser import Library
+from bibtexparser.model import Entry
 
 from papers.entries import (
     get_entry_val,
@@ -13,10 +15,18 @@ from papers.entries import (
     update_entry,
     entry_copy,
     entry_content_equal,
+    entry_fingerprint,
     parse_string,
+    as_parsed,
+    iter_entries,
     format_library,
+    write_library,
     entry_from_dict,
     library_from_entries,
+    format_block,
+    block_state,
+    sort_blocks,
+    CompactEntry,
 )
 from papers.encoding import (
     latex_to_unicode_library,
@@ -28,24 +38,27 @@ from papers import logger
 
 from papers.extract import extract_pdf_doi, isvaliddoi, parse_doi
 from papers.extract import extract_pdf_metadata
+from papers.pipeline import extract_pdfs_metadata
 from papers.extract import fetch_bibtex_by_fulltext_crossref, fetch_bibtex_by_doi
 
 from papers.encoding import parse_file, format_file, standard_name, family_names, format_entries, update_file_path, format_entry
 from papers.latexenc import unicode_to_latex, latex_to_unicode
 
 from papers.filename import NAMEFORMAT, KEYFORMAT
-from papers.utils import bcolors, checksum, move as _move
+from papers.utils import bcolors, move as _move
+from papers.checksums import file_checksum
 import papers.config
+from papers.snapshot import load_library, write_snapshot, content_hash
+from papers.keyindex import write_index, read_index, read_indexed_entries
 
 from papers.duplicate import (
     conflict_resolution_on_insert,
     entry_diff,
     merge_files,
     check_duplicates,
+    duplicate_blocks,
     entry_id,
-    _build_duplicate_index,
-    _get_duplicate_candidates,
-    _add_to_duplicate_index,
+    DuplicateIndex,
 )
 
 # URL DOWNLOAD
@@ -128,6 +141,17 @@ def download_url(url, expect_pdf=False, dest_dir=None):
 # KEY GENERATION
 # ==============
 
+ABC = 'abcdefghijklmnopqrstuvwxyz'
+
+
+def _abc_suffixes(first=0):
+    """'b', 'c', ... 'z' (from letter index first on), then 'aa', 'ab', ... 'zz', 'aaa'..."""
+    yield from ABC[first:]
+    for n in itertools.count(2):
+        for letters in itertools.product(ABC, repeat=n):
+            yield ''.join(letters)
+
+
 def append_abc(key, keys=[]):
     """
     >>> append_abc('Author2000')
@@ -136,23 +160,55 @@ def append_abc(key, keys=[]):
     'Author2000c'
     >>> append_abc('Author2000', ['Author2000', 'Author2000b'])
     'Author2000c'
-    """
-    letters = list('abcdefghijklmnopqrstuvwxyz')
+    >>> append_abc('Author2000z')
+    'Author2000aa'
 
-    if key[-1] in letters:
-        i = letters.index(key[-1])
-        letters = letters[i+1:]
+    keys only needs to support `in`: a set (or a KeyIndex) avoids scanning all keys for each suffix
+    """
+    if key[-1] in ABC:
+        first = ABC.index(key[-1]) + 1
         key = key[:-1]
     else:
-        letters = letters[1:] # start at b
+        first = 1 # start at b
+
+    for suffix in _abc_suffixes(first):
+        if key+suffix not in keys:
+            return key+suffix
+
+
+class KeyIndex:
+    """Entries of a library by case-folded key (Biblio.key), for O(1) key conflict checks.
+    Supports `key in index` (case-insensitive), e.g. for append_abc."""
+
+    def __init__(self, entries=()):
+        self._entries = {}
+        for e in entries:
+            self.add(e)
+
+    def add(self, entry):
+        self._entries.setdefault(get_entry_val(entry, 'ID', '').lower(), []).append(entry)
+
+    def discard(self, entry, key=None):
+        """Remove entry, indexed under key (default: its current key). Return False if it was not found."""
+        folded = (get_entry_val(entry, 'ID', '') if key is None else key).lower()
+        entries = self._entries.get(folded, [])
+        for i, e in enumerate(entries):
+            if e is entry:
+                del entries[i]
+                if not entries:
+                    del self._entries[folded]
+                return True
+        return False
 
-    for l in letters:
-        Key = (key+l)
-        if Key not in keys:
-            key = Key
-            break
-    assert Key not in keys, 'not enough letters in the alphabets to solve key conflict? or maybe something went wrong...'
-    return Key
+    def get(self, key):
+        "entries with that key (case-insensitive)"
+        return list(self._entries.get(key.lower(), []))
+
+    def __contains__(self, key):
+        return key.lower() in self._entries
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._entries.values())
 
 
 # DUPLICATE DEFINITION (entry_id, author_id, title_id live in papers.duplicate)
@@ -209,16 +265,18 @@ def compare_entries(e1, e2, fuzzy=False):
 
     return score
 
+
+SIMILARITY_LEVELS = dict(
+    EXACT = EXACT_DUPLICATES,
+    GOOD = GOOD_DUPLICATES,
+    FAIR = FAIR_DUPLICATES,
+    PARTIAL = PARTIAL_DUPLICATES,
+    FUZZY = FUZZY_DUPLICATES,
+    )
+
 def are_duplicates(e1, e2, similarity=DEFAULT_SIMILARITY, fuzzy_ratio=FUZZY_RATIO):
-    level = dict(
-        EXACT = EXACT_DUPLICATES,
-        GOOD = GOOD_DUPLICATES,
-        FAIR = FAIR_DUPLICATES,
-        PARTIAL = PARTIAL_DUPLICATES,
-        FUZZY = FUZZY_DUPLICATES,
-        )
     try:
-        target = level[similarity]
+        target = SIMILARITY_LEVELS[similarity]
     except KeyError:
         raise ValueError('similarity must be one of EXACT, GOOD, FAIR, PARTIAL, FUZZY')
 
@@ -227,6 +285,115 @@ def are_duplicates(e1, e2, similarity=DEFAULT_SIMILARITY, fuzzy_ratio=FUZZY_RATI
     return score >= target
 
 
+# BATCH SCORING: compare_entries for many pairs at once
+# =====================================================
+
+# below this number of entries, check_duplicates calls are_duplicates on each pair
+BATCH_MIN_SIZE = 200
+
+
+def _score_keys(e):
+    "(fingerprint, doi_lower, authortitle, doi) as compared by compare_entries"
+    doi, at = entry_id(e)
+    return entry_fingerprint(e), doi, at, get_entry_val(e, 'doi', '')
+
+
+def _pair_score(e1, k1, e2, k2):
+    "compare_entries, for entries that share their DOI, author+title or id (keys from _score_keys)"
+    if e1 is e2 or (k1[0] == k2[0] and entry_content_equal(e1, e2)):
+        return EXACT_DUPLICATES
+    if k1[1:3] == k2[1:3]:
+        return GOOD_DUPLICATES
+    if k1[3] and k1[3] == k2[3]:
+        return FAIR_DUPLICATES
+    return PARTIAL_DUPLICATES
+
+
+def _keyed_pairs(keys1, keys2):
+    """{(i, j): score} for the pairs that share the DOI, the author+title or the id: those scored
+    PARTIAL_DUPLICATES or more (all other pairs are not duplicates, unless fuzzy)"""
+    groups = {}
+    for j, (_, doi, at, _) in enumerate(keys2):
+        for k in (('doi', doi) if doi else None, ('authortitle', at) if at else None, ('id', doi, at)):
+            if k is not None:
+                groups.setdefault(k, []).append(j)
+    pairs = set()
+    for i, (_, doi, at, _) in enumerate(keys1):
+        for k in (('doi', doi) if doi else None, ('authortitle', at) if at else None, ('id', doi, at)):
+            for j in groups.get(k, ()) if k is not None else ():
+                pairs.add((i, j))
+    return pairs
+
+
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+def compare_entries_batch(entries, others=None, fuzzy=False, workers=-1):
+    """compare_entries(e1, e2, fuzzy) for each e1 in entries (rows) and e2 in others (columns,
+    default: entries), as a list of lists. Entry ids are computed once per entry, and the fuzzy
+    scores by rapidfuzz for all pairs at once: process.cdist on workers threads (-1: all CPUs) if
+    numpy is installed, process.extract row by row otherwise.
+    """
+    others = entries if others is None else others
+    keys1 = [_score_keys(e) for e in entries]
+    keys2 = keys1 if others is entries else [_score_keys(e) for e in others]
+    if fuzzy:
+        from rapidfuzz import process
+        from rapidfuzz.fuzz import token_set_ratio
+        tags1 = [k[2] for k in keys1]
+        tags2 = [k[2] for k in keys2]
+        np = _numpy()
+        if np is not None:
+            rows = process.cdist(tags1, tags2, scorer=token_set_ratio, dtype=np.float64, workers=workers).tolist()
+        else:
+            rows = []
+            for tag in tags1:
+                row = [0.0]*len(tags2)
+                for _, score, j in process.extract(tag, tags2, scorer=token_set_ratio, limit=None):
+                    row[j] = score
+                rows.append(row)
+    else:
+        rows = [[0]*len(others) for _ in entries]
+    for i, j in _keyed_pairs(keys1, keys2):
+        rows[i][j] = _pair_score(entries[i], keys1[i], others[j], keys2[j])
+    return rows
+
+
+def duplicate_pairs(entries, similarity=DEFAULT_SIMILARITY, workers=-1, chunk_size=1000):
+    """Positions (j, i), j < i, of the entries for which are_duplicates(entries[j], entries[i], similarity),
+    sorted, for search_duplicates(..., pairs=...). Scored as in compare_entries_batch, without
+    building the full matrix: FUZZY pairs come from rapidfuzz in chunks of chunk_size rows."""
+    try:
+        target = SIMILARITY_LEVELS[similarity]
+    except KeyError:
+        raise ValueError('similarity must be one of EXACT, GOOD, FAIR, PARTIAL, FUZZY')
+    entries = list(entries)
+    keys = [_score_keys(e) for e in entries]
+    pairs = {(j, i) for i, j in _keyed_pairs(keys, keys)
+             if j < i and _pair_score(entries[j], keys[j], entries[i], keys[i]) >= target}
+    if target == FUZZY_DUPLICATES:
+        # other pairs: token_set_ratio of author+title (a score of 100 at most)
+        from rapidfuzz import process
+        from rapidfuzz.fuzz import token_set_ratio
+        tags = [k[2] for k in keys]
+        np = _numpy()
+        for start in range(0, len(tags), chunk_size):
+            if np is not None:
+                scores = process.cdist(tags[start:start+chunk_size], tags[:start+chunk_size], scorer=token_set_ratio,
+                                       score_cutoff=target, dtype=np.uint8, workers=workers)
+                found = zip(*np.nonzero(scores >= target))
+            else:
+                found = ((i-start, j) for i in range(start, min(start+chunk_size, len(tags)))
+                         for _, _, j in process.extract(tags[i], tags[:i], scorer=token_set_ratio, score_cutoff=target, limit=None))
+            pairs.update((int(j), start+int(i)) for i, j in found if j < start+i)
+    return sorted(pairs)
+
+
 def hidden_bibtex(direc):
     " save metadata for a bundle of files "
     dirname = os.path.basename(direc)
@@ -281,6 +448,106 @@ class Biblio:
         self.keyformat = keyformat
         self.similarity = similarity
         self.relative_to = os.path.sep if relative_to is None else relative_to
+        # blocks as last loaded or saved, to track changes: _saved_layout holds
+        # (state, start, end) for each of _saved_blocks, where start:end locates
+        # the block text in the file identified by _saved_file = (path, sha256)
+        self._saved_blocks = []
+        self._saved_layout = []
+        self._saved_index = {}  # id(block) -> index in _saved_blocks
+        self._saved_file = None
+        # entries by case-folded key, see _keys()
+        self._key_index = None
+        self._key_index_state = None
+        # DuplicateIndex of the entries (see duplicate_index()), kept up to date like the key index
+        self._duplicate_index = None
+        self._duplicate_index_state = None
+
+    def _track(self, bibtex=None, content=None, layout=None):
+        """Record the current blocks as unchanged. layout is a list of
+        (state, start, end) parallel to the blocks, as written by save."""
+        blocks = self.db.blocks
+        if layout is None or len(layout) != len(blocks):
+            layout = [(block_state(b), None, None) for b in blocks]
+        self._saved_blocks = list(blocks)
+        self._saved_layout = layout
+        self._saved_index = {id(b): i for i, b in enumerate(blocks)}
+        if bibtex is not None:
+            self._saved_file = (os.path.abspath(bibtex), content_hash(content))
+        else:
+            self._saved_file = None
+
+    def changes(self):
+        """Return the lists of entries (added, removed, modified) since load or last save.
+        A change of key counts as a modification.
+        """
+        added, modified = [], []
+        for e in self.entries:
+            i = self._saved_lookup(e)
+            if i is None:
+                added.append(e)
+            elif self._saved_layout[i][0] != block_state(e):
+                modified.append(e)
+        current = {id(b) for b in self.db.blocks}
+        removed = [b for b in self._saved_blocks if id(b) not in current and isinstance(b, Entry)]
+        return added, removed, modified
+
+    def _keys(self):
+        """KeyIndex of the entries. Kept up to date by the methods that add, remove or re-key
+        entries (insert_entry, set_key, entries = ...), and rebuilt if the library was changed
+        otherwise (db replaced, blocks added or removed). Keys changed in place on entries of
+        the library should go through set_key."""
+        state = (self.db, len(self.db.blocks))
+        if self._key_index is None or self._key_index_state[0] is not self.db or self._key_index_state[1] != state[1]:
+            self._key_index = KeyIndex(self.db.entries)
+        self._key_index_state = state
+        return self._key_index
+
+    def _duplicate_index_synced(self):
+        "the duplicate index, if it was in sync with the library since its last change (see duplicate_index)"
+        state = self._duplicate_index_state
+        if self._duplicate_index is not None and state is not None \
+                and state[0] is self.db and state[1] == len(self.db.blocks):
+            return self._duplicate_index
+
+    def _add_entry(self, entry):
+        keys = self._keys()
+        index = self._duplicate_index_synced()
+        self.db.add(entry)
+        keys.add(entry)
+        self._key_index_state = (self.db, len(self.db.blocks))
+        if index is not None:
+            index.add(entry)
+            self._duplicate_index_state = self._key_index_state
+
+    def _remove_entry(self, entry):
+        keys = self._keys()
+        index = self._duplicate_index_synced()
+        self.db.remove(entry)
+        if keys.discard(entry):
+            self._key_index_state = (self.db, len(self.db.blocks))
+        else:
+            self._key_index = None  # key changed in place: rebuild
+        if index is not None:
+            index.remove(entry)
+            self._duplicate_index_state = (self.db, len(self.db.blocks))
+
+    def set_key(self, entry, key):
+        """Change the key of entry, keeping the key index up to date if entry is in the library"""
+        keys = self._keys()
+        old_key = get_entry_val(entry, 'ID', '')
+        set_entry_key(entry, key)
+        if keys.discard(entry, old_key):
+            keys.add(entry)
+
+    def entries_with_key(self, key):
+        "entries whose key matches key, case-insensitively"
+        return [e for e in self._keys().get(key) if self.key(e) == key.lower()]
+
+    def _saved_lookup(self, block):
+        "index of the block in _saved_blocks, or None"
+        i = self._saved_index.get(id(block))
+        if i is not None and self._saved_blocks[i] is block:
+            return i
 
     def move(self, file, newfile, copy=False, hardlink=False):
         return _move(file, newfile, copy=copy, dryrun=papers.config.DRYRUN, hardlink=hardlink)
@@ -292,16 +559,52 @@ class Biblio:
     @entries.setter
     def entries(self, entries):
         assert isinstance(entries, list)
-        # Public API: remove all entries then add new list (keeps _entries_by_key in sync)
-        for e in list(self.db.entries):
-            self.db.remove(e)
-        for e in entries:
-            self.db.add(e)
+        # Public API: replace all entries at once (Library.remove looks each block up in the list):
+        # a new library with the other blocks, then the entries (raises on duplicate keys)
+        self.db = Library([b for b in self.db.blocks if not isinstance(b, Entry)] + entries)
+        self._key_index = None
+
+    # Bulk changes: Library.remove looks each block up in the whole list, and the entries setter
+    # moves the other blocks (@string, comments...) first. These build the new library once, with the
+    # other blocks in place. The key index is rebuilt on next use: entries of a bulk change (merged
+    # duplicates...) may have been re-keyed in place.
+
+    def _rebuild(self, blocks):
+        self.db = Library(blocks)  # raises ValueError on duplicate keys, before anything is changed
+        self._key_index = None
+
+    def _positions(self, entries):
+        "positions of entries (identity) in the library blocks, ValueError if one is missing"
+        ids = {id(e) for e in entries}
+        positions = [i for i, b in enumerate(self.db.blocks) if id(b) in ids]
+        if len(positions) != len(ids):
+            raise ValueError('Entry not in library.')
+        return positions
+
+    def remove_many(self, entries):
+        """Remove entries, compared by identity (ValueError if one is not in the library)"""
+        entries = list(entries)
+        positions = set(self._positions(entries))
+        self._rebuild([b for i, b in enumerate(self.db.blocks) if i not in positions])
+
+    def replace_many(self, entries, new_entries):
+        """Replace entries (compared by identity) with new_entries, which take the place of the first
+        of them (at the end of the library if entries is empty). Entries in both stay in the library."""
+        new_entries = list(new_entries)
+        positions = self._positions(entries)
+        first = positions[0] if positions else len(self.db.blocks)
+        positions = set(positions)
+        blocks = [b for i, b in enumerate(self.db.blocks[:first]) if i not in positions]
+        blocks += new_entries
+        blocks += [b for i, b in enumerate(self.db.blocks[first:], first) if i not in positions]
+        self._rebuild(blocks)
 
     @classmethod
     def loads(cls, bibtex, filesdir):
         db = parse_string(bibtex)
-        return cls(db, filesdir)
+        biblio = cls(db, filesdir)
+        biblio._track()
+        return biblio
 
     def dumps(self):
         return format_library(self.db)
@@ -309,7 +612,13 @@ class Biblio:
     @classmethod
     def load(cls, bibtex, filesdir, relative_to=None, **kw):
         bibtexs = open(bibtex).read()
-        loaded_bib = cls(parse_string(bibtexs), filesdir, relative_to=relative_to if relative_to is not None else os.path.dirname(bibtex), **kw)
+        # reuse the parsed library from a previous run if the file is unchanged
+        snapshot = load_library(bibtex, bibtexs, jobs=papers.config.JOBS)
+        loaded_bib = cls(snapshot['library'], filesdir, relative_to=relative_to if relative_to is not None else os.path.dirname(bibtex), **kw)
+        loaded_bib._track(bibtex, bibtexs, snapshot.get('layout'))
+        loaded_bib._duplicate_index = snapshot.get('duplicate_index')
+        if loaded_bib._duplicate_index is not None:
+            loaded_bib._duplicate_index_state = (loaded_bib.db, len(loaded_bib.db.blocks))
         return loaded_bib
 
     # make sure the path is right
@@ -338,9 +647,14 @@ class Biblio:
 
 
     def sort(self):
-        """Re-order library by block type and entry key (public API: SortBlocksByTypeAndKeyMiddleware)."""
-        from bibtexparser.middlewares import SortBlocksByTypeAndKeyMiddleware
-        self.db = SortBlocksByTypeAndKeyMiddleware().transform(library=self.db)
+        """Re-order library by block type and entry key (same order as SortBlocksByTypeAndKeyMiddleware).
+        The blocks are not copied, so that references to entries remain valid."""
+        self._keys()  # in sync with the entries, which are the same after sorting
+        index = self._duplicate_index_synced()
+        self.db = Library(blocks=sort_blocks(self.db.blocks), fail_on_duplicate_key=False)
+        self._key_index_state = (self.db, len(self.db.blocks))
+        if index is not None:
+            self._duplicate_index_state = self._key_index_state
 
     def insert_entry(self, entry, update_key=False, check_duplicate=False, rename=False, copy=False, metadata={}, **checkopt):
         """
@@ -362,12 +676,8 @@ class Biblio:
         else:
             logger.debug('check duplicates : FALSE')
 
-        # Key duplicate check: lookup by key (public API), case-insensitive to match entries_dict keys
-        key_lower = self.key(entry)
-        existing_same_key = next(
-            (e for k, e in self.db.entries_dict.items() if k.lower() == key_lower),
-            None,
-        )
+        # Key duplicate check, case-insensitive
+        existing_same_key = next(iter(self.entries_with_key(get_entry_val(entry, 'ID', ''))), None)
         if existing_same_key is not None:
             logger.info('key duplicate: '+self.key(existing_same_key))
 
@@ -386,27 +696,51 @@ class Biblio:
         else:
             logger.info('new entry: '+self.key(entry))
 
-        self.db.add(entry)
+        self._add_entry(entry)
 
         if rename: self.rename_entry_files(entry, copy=copy)
 
         return [ entry ]
 
+    def duplicate_index(self, sync=False):
+        """DuplicateIndex of the entries for insert_entry_check, to pass to a series of inserts (see add_bibtex).
+        Once built, it is kept with the library snapshot on save, so that the next runs load it instead of
+        indexing the whole library again.
+
+        Entries added or removed through insert_entry and insert_entry_check update it as they go. It is
+        brought up to date with the changes since load or save (see changes()) only when the library was
+        changed otherwise (db replaced, blocks added or removed, bulk changes), or with sync=True: entries
+        of the library modified in place are re-indexed then, as save does before writing the snapshot.
+        """
+        fuzzy = self.similarity == 'FUZZY'
+        index = self._duplicate_index
+        if index is not None and index.fuzzy == fuzzy:
+            if not sync and self._duplicate_index_synced() is not None:
+                return index
+            added, removed, modified = self.changes()
+            index.update(added + modified, removed)
+            if len(index) == len(self.entries):
+                self._duplicate_index_state = (self.db, len(self.db.blocks))
+                return index
+            logger.debug('duplicate index out of sync with the library: rebuild')
+        index = self._duplicate_index = DuplicateIndex(self.entries, fuzzy=fuzzy)
+        self._duplicate_index_state = (self.db, len(self.db.blocks))
+        return index
+
     def insert_entry_check(self, entry, update_key=False, mergefiles=True, on_conflict='i', rename=False, copy=False, duplicate_index=None):
-        # FUZZY can match on token_set_ratio(authortitle) without same doi/authortitle, so index would miss some duplicates
-        if self.similarity == 'FUZZY':
-            candidates = self.entries
-        elif duplicate_index is not None:
-            by_doi, by_authortitle = duplicate_index
-            candidates = _get_duplicate_candidates(entry, by_doi, by_authortitle)
-        else:
-            by_doi, by_authortitle = _build_duplicate_index(self.entries)
-            candidates = _get_duplicate_candidates(entry, by_doi, by_authortitle)
+        # duplicate_index (see duplicate_index()) is updated with the inserted entries
+        if duplicate_index is None or duplicate_index is self._duplicate_index:
+            duplicate_index = self.duplicate_index()
+        candidates = duplicate_index.candidates(entry)
         duplicates = [e for e in candidates if self.eq(e, entry)]
 
         if not duplicates:
             logger.debug('not a duplicate')
-            return self.insert_entry(entry, update_key, rename=rename, copy=copy)
+            entries = self.insert_entry(entry, update_key, rename=rename, copy=copy)
+            if duplicate_index is not self._duplicate_index:
+                for e in entries:
+                    duplicate_index.add(e)
+            return entries
 
 
         else:
@@ -458,25 +792,28 @@ class Biblio:
             candidate_key_after = get_entry_val(candidate, 'ID', '') if resolved and resolved[0] is candidate else None
             if hasattr(candidate, 'key'):
                 candidate.key = candidate_key_before
-            self.db.remove(candidate)
+            self._remove_entry(candidate)
             if candidate_key_after is not None and hasattr(candidate, 'key'):
                 candidate.key = candidate_key_after
             entries = []
             for e in resolved:
                 entries.extend( self.insert_entry(e, update_key, rename=rename, copy=copy) )
+            if duplicate_index is not self._duplicate_index:
+                duplicate_index.remove(candidate)
+                for e in entries:
+                    duplicate_index.add(e)
             return entries
 
 
     def generate_key(self, entry):
-        " generate a unique key not yet present in the record "
-        keys = {self.key(e) for e in self.db.entries}
+        " generate a unique key not yet present in the record (the entry's own key does not count) "
         key = self.keyformat(entry)
-        if keys and key in keys: # and not isinstance(keys, set):
-            key = append_abc(key, keys)
+        if any(e is not entry for e in self.entries_with_key(key)):
+            key = append_abc(key, self._keys())
         return key
 
     def append_abc_to_key(self, entry):
-        return append_abc(get_entry_val(entry, 'ID', ''), keys={self.key(e) for e in self.entries})
+        return append_abc(get_entry_val(entry, 'ID', ''), keys=self._keys())
 
 
     def set_files(self, entry, files, relative_to=None):
@@ -489,16 +826,13 @@ class Biblio:
         return parse_file(get_entry_val(entry, 'file', ''), relative_to=relative_to or self.relative_to)
 
     def add_bibtex(self, bibtex, relative_to=None, attachments=None, convert_to_unicode=False, **kw):
-        bib = parse_string(bibtex)
+        bib = parse_string(bibtex, jobs=papers.config.JOBS)
         if convert_to_unicode:
             bib = latex_to_unicode_library(bib)
         entries = []
         # Build index once so duplicate check is O(candidates) not O(library size) per entry
-        check_dup = kw.get('check_duplicate', True)
-        if check_dup and bib.entries:
-            duplicate_index = _build_duplicate_index(self.entries)
-        else:
-            duplicate_index = None
+        if kw.get('check_duplicate') and bib.entries and kw.get('duplicate_index') is None:
+            kw['duplicate_index'] = self.duplicate_index()
         for e in bib.entries:
             files = []
             if "file" in e:
@@ -509,14 +843,7 @@ class Biblio:
             if files:
                 self.set_files(e, files)
 
-            run_kw = dict(kw)
-            if duplicate_index is not None:
-                run_kw['duplicate_index'] = duplicate_index
-            added = self.insert_entry(e, **run_kw)
-            entries.extend(added)
-            if duplicate_index is not None:
-                for new_e in added:
-                    _add_to_duplicate_index(new_e, duplicate_index[0], duplicate_index[1])
+            entries.extend(self.insert_entry(e, **kw))
         return entries
 
 
@@ -525,19 +852,116 @@ class Biblio:
         return self.add_bibtex(bibtex, relative_to=os.path.dirname(file), **kw)
 
 
+    def merge_entries(self, entries, relative_to=None, on_conflict='i', mergefiles=True):
+        """Merge entries (e.g. of another bibtex file) into the library in one go, for `papers merge`.
+
+        As add_bibtex with check_duplicate, but the library is rebuilt once at the end instead of on
+        each insert: each entry is joined with its duplicate candidates (same DOI or author+title, see
+        DuplicateIndex), exact duplicates (whatever their key) only bring their files, and other duplicates are resolved
+        with conflict_resolution_on_insert(mode=on_conflict). A new entry whose key is taken
+        (case-insensitive) gets a suffix (see append_abc): the keys of the library do not change.
+
+        relative_to : directory the file paths of the entries are relative to
+
+        Return the number of entries 'added', exact 'duplicates', 'conflicts' resolved and keys 'renamed'.
+        """
+        index = self.duplicate_index()
+        merged = list(self.entries)
+        position = {id(e): i for i, e in enumerate(merged)}
+        original = set(position)  # the library entries stay referenced until the end: ids are unique
+        counts = {'added': 0, 'duplicates': 0, 'conflicts': 0, 'renamed': 0}
+
+        for entry in entries:
+            if "file" in entry:
+                self.set_files(entry, self.get_files(entry, relative_to))
+
+            candidates = index.candidates(entry)
+            # exact duplicates first: no need to score them
+            same = ('ID', 'file') if mergefiles else ('ID',)
+            candidate = next((e for e in candidates if entry_content_equal(entry, e, skip_keys=same)), None)
+            if candidate is not None:
+                if mergefiles and ("file" in candidate or "file" in entry):
+                    file = merge_files([candidate, entry], relative_to=self.relative_to)
+                    if file and get_entry_val(candidate, 'file', '') != file:
+                        candidate['file'] = file
+                counts['duplicates'] += 1
+                continue
+
+            duplicates = [e for e in candidates if self.eq(e, entry)]
+            if not duplicates:
+                position[id(entry)] = len(merged)
+                merged.append(entry)
+                index.add(entry)
+                counts['added'] += 1
+                continue
+
+            if len(duplicates) > 1:
+                duplicates.sort(key=lambda e: compare_entries(entry, e), reverse=True)
+            candidate = duplicates[0]
+
+            if mergefiles and ("file" in candidate or "file" in entry):
+                file = merge_files([candidate, entry], relative_to=self.relative_to)
+                for e in (candidate, entry):
+                    if file and get_entry_val(e, 'file', '') != file:
+                        e['file'] = file
+
+            counts['conflicts'] += 1
+            resolved = conflict_resolution_on_insert(candidate, entry, mode=on_conflict)
+            if not any(e is candidate for e in resolved):
+                index.remove(candidate)
+            slot = position.pop(id(candidate))
+            merged[slot] = None
+            for e in resolved:
+                if merged[slot] is None:
+                    merged[slot] = e
+                else:
+                    slot = len(merged)
+                    merged.append(e)
+                position[id(e)] = slot
+                index.add(e)
+
+        merged = [e for e in merged if e is not None]
+        keys = KeyIndex(e for e in merged if id(e) in original)
+        for e in merged:
+            if id(e) in original:
+                continue
+            key = get_entry_val(e, 'ID', '')
+            if key in keys:
+                newkey = append_abc(key, keys)
+                logger.info('key duplicate: {} => {}'.format(key, newkey))
+                set_entry_key(e, newkey)
+                counts['renamed'] += 1
+            keys.add(e)
+
+        kept = {id(e) for e in merged}
+        self.replace_many([e for e in self.entries if id(e) not in kept], [e for e in merged if id(e) not in original])
+        if index is self._duplicate_index:
+            self._duplicate_index_state = (self.db, len(self.db.blocks))  # updated along the merge
+        logger.info('merged: {added} added, {duplicates} exact duplicates, {conflicts} conflicts, {renamed} keys renamed'.format(**counts))
+        return counts
+
+
+    def merge_bibtex_file(self, file, **kw):
+        bib = parse_string(open(file).read(), jobs=papers.config.JOBS)
+        return self.merge_entries(bib.entries, relative_to=os.path.dirname(file), **kw)
+
+
     def fetch_doi(self, doi, **kw):
         bibtex = fetch_bibtex_by_doi(doi)
         kw["update_key"] = True  # fetched key is always updated
         return self.add_bibtex(bibtex, **kw)
 
 
-    def add_pdf(self, pdf, attachments=None, search_doi=True, search_fulltext=True, scholar=False, doi=None, **kw):
+    def add_pdf(self, pdf, attachments=None, search_doi=True, search_fulltext=True, scholar=False, doi=None, bibtex=None, **kw):
+        """Add a PDF file with its metadata, extracted from the file unless `doi` or `bibtex` is provided"""
 
         if str(pdf).startswith("http"):
             pdf = download_url(pdf, expect_pdf=True)
             kw['rename'] = True  # always rename downloaded files
 
-        if doi:
+        if bibtex:
+            pass
+        elif doi:
             bibtex = fetch_bibtex_by_doi(doi)
         else:
             bibtex = extract_pdf_metadata(pdf, search_doi, search_fulltext, scholar=scholar)
@@ -561,8 +985,21 @@ class Biblio:
         return self.insert_entry(entry, **kw)
 
 
-    def scan_dir_iter(self, direc, search_doi=True, search_fulltext=True, **kw):
+    def scan_dir_iter(self, direc, search_doi=True, search_fulltext=True, jobs=None, timeout=None, **kw):
+        """Add the PDF and bibtex files found in a directory tree
 
+        The metadata of the PDF files are extracted by `jobs` worker processes (default
+        papers.config.JOBS) and inserted in the order of the directory walk, see papers.pipeline.
+        A PDF that takes more than `timeout` seconds is skipped with a warning, like any
+        other file that cannot be added.
+        """
+        if kw.get('check_duplicate') and kw.get('duplicate_index') is None:
+            kw['duplicate_index'] = self.duplicate_index()
+        if jobs is None:
+            jobs = papers.config.JOBS
+
+        # walk first, so that files renamed into the scanned tree are not scanned again
+        items = []
         top = os.path.abspath(direc)
         for root, direcs, files in os.walk(direc):
             dirname = os.path.basename(root)
@@ -573,26 +1010,41 @@ class Biblio:
 
             # maybe a special entry directory?
             if os.path.exists(hidden_bibtex(root)):
-                logger.debug('read from hidden bibtex')
-                try:
-                    entry = read_entry_dir(root, relative_to=self.relative_to)
-                    yield from self.insert_entry(entry, **kw)
-                except Exception as error:
-                    logger.warning(root+'::'+str(error))
+                items.append(('entrydir', root))
                 continue
 
             for file in files:
                 if file.startswith('.'):
                     continue
-                path = os.path.join(root, file)
+                if file.lower().endswith('.pdf'):
+                    items.append(('pdf', os.path.join(root, file)))
+                elif file.lower().endswith('.bib'):
+                    items.append(('bib', os.path.join(root, file)))
+
+        # metadata extracted ahead (in parallel with jobs > 1), consumed in the same order
+        metadata = extract_pdfs_metadata([path for kind, path in items if kind == 'pdf'],
+                                         jobs=jobs, timeout=timeout,
+                                         search_doi=search_doi, search_fulltext=search_fulltext,
+                                         scholar=kw.get('scholar', False))
+        try:
+            for kind, path in items:
                 try:
-                    if file.lower().endswith('.pdf'):
-                        yield from self.add_pdf(path, search_doi=search_doi, search_fulltext=search_fulltext, **kw)
-                    elif file.lower().endswith('.bib'):
+                    if kind == 'entrydir':
+                        logger.debug('read from hidden bibtex')
+                        entry = read_entry_dir(path, relative_to=self.relative_to)
+                        yield from self.insert_entry(entry, **kw)
+                    elif kind == 'pdf':
+                        pdf, bibtex, error = next(metadata)
+                        if error is not None:
+                            raise error
+                        yield from self.add_pdf(pdf, bibtex=bibtex, **kw)
+                    else:
                         yield from self.add_bibtex_file(path, **kw)
                 except Exception as error:
                     logger.warning(path+'::'+str(error))
                     continue
+        finally:
+            metadata.close()
 
     def scan_dir(self, direc, **kw):
         " like scan_dir_iter but returns a list"
@@ -603,14 +1055,79 @@ class Biblio:
         """Return the library as a BibTeX string. Does not sort; call sort() first if you need ordered output."""
         return format_library(self.db)
 
-    def save(self, bibtex):
+    def save(self, bibtex, cache=True):
+        """Write the library to bibtex, sorted. Unless cache is False (for a mere copy,
+        never loaded), also store its snapshot and key index, and its layout for the next save.
+        """
         if os.path.exists(bibtex):
             shutil.copy(bibtex, backupfile(bibtex))
         if self.relative_to not in (os.path.sep, None) and Path(self.relative_to).resolve() != Path(bibtex).parent.resolve():
             logger.warning("Saving bibtex file with relative paths may break links. Consider using `Biblio.update_file_path(Path(bibtex).parent)` before.")
         self.sort()  # consistent order before writing
-        s = self.format()
+        s, layout, formatted = self._format_incremental(bibtex)
         open(bibtex, 'w').write(s)
+        if not cache:
+            return
+        # the blocks as the next load parses them (str values, fields in written order, raw text...),
+        # so that the snapshot gives the same library as a parse
+        parsed = as_parsed(self.db.blocks, s, layout, formatted, jobs=papers.config.JOBS)
+        for n in formatted:
+            layout[n] = (block_state(self.db.blocks[n]),) + layout[n][1:]
+        duplicate_index = None
+        if self._duplicate_index is not None:
+            duplicate_index = self.duplicate_index(sync=True)
+            duplicate_index.reorder(self.entries)
+        if parsed:
+            write_snapshot(bibtex, s, self.db, layout=layout, duplicate_index=duplicate_index)
+        else:
+            logger.debug(f'{bibtex} does not parse back to the saved blocks: no snapshot')
+        write_index(bibtex, s, self.db.blocks, layout)
+        self._track(bibtex, s, layout)
+
+    def _format_incremental(self, bibtex):
+        """Same as format(), but the text of blocks unchanged since the last load or save
+        of bibtex is copied from the file instead of formatted again. Also returns the
+        layout of the new text, a list of (state, start, end) for each block, and the
+        indices of the blocks formatted again.
+        """
+        old = None
+        if self._saved_file is not None and self._saved_file[0] == os.path.abspath(bibtex) and os.path.exists(bibtex):
+            old = open(bibtex).read()
+            if content_hash(old) != self._saved_file[1]:
+                logger.debug(f'{bibtex} changed on disk since it was loaded: rewrite it entirely')
+                old = None
+
+        pieces = []  # joined with the block separator
+        layout = []
+        formatted = []
+        pos = 0  # position of the current block in the new text
+        run = None  # [start, end] of unchanged consecutive blocks in the old text
+        for n, block in enumerate(self.db.blocks):
+            i = self._saved_lookup(block) if old is not None else None
+            rec = self._saved_layout[i] if i is not None else None
+            if rec is not None and rec[1] is not None and rec[0] == block_state(block):
+                state, start, end = rec
+                if run is not None and run[1] + 1 == start:
+                    run[1] = end
+                else:
+                    if run is not None:
+                        pieces.append(old[run[0]:run[1]])
+                    run = [start, end]
+                size = end - start
+            else:
+                if run is not None:
+                    pieces.append(old[run[0]:run[1]])
+                    run = None
+                text = format_block(block)
+                state = block_state(block)
+                pieces.append(text)
+                size = len(text)
+                formatted.append(n)
+            layout.append((state, pos, pos + size))
+            pos += size + 1
+        if run is not None:
+            pieces.append(old[run[0]:run[1]])
+        return "\n".join(pieces), layout, formatted
 
 
     def update_file_path(self, relative_to):
@@ -630,10 +1147,22 @@ class Biblio:
 
 
 
-    def check_duplicates(self, key=None, eq=None, mode='i'):
+    def check_duplicates(self, key=None, eq=None, mode='i', report=None):
         """remove duplicates, in some sensse (see papers.conflict.check_duplicates)
+        report: list to which merge mode ('m') appends what was merged (see papers.duplicate.merge_duplicates)
         """
-        self.entries = check_duplicates(self.entries, key=key, eq=eq or self.eq, issorted=key is self.key, mode=mode)
+        # the default eq compares DOI and author+title, except for FUZZY similarity
+        blocks = duplicate_blocks if eq is None and self.similarity != 'FUZZY' else None
+        # FUZZY: author+title similarity of all pairs, scored in batch for large libraries
+        pairs = None
+        if eq is None and key is None and self.similarity == 'FUZZY' and len(self.entries) >= BATCH_MIN_SIZE:
+            pairs = duplicate_pairs(self.entries, self.similarity)
+        entries = self.entries
+        resolved = check_duplicates(list(entries), key=key, eq=eq or self.eq, issorted=key is self.key, mode=mode, blocks=blocks, pairs=pairs,
+                                    report=report, jobs=papers.config.JOBS)
+        kept = {id(e) for e in resolved}
+        current = {id(e) for e in entries}
+        self.replace_many([e for e in entries if id(e) not in kept], [e for e in resolved if id(e) not in current])
 
 
     def rename_entry_files(self, e, copy=False, formatter=None, relative_to=None, hardlink=False):
@@ -695,11 +1224,9 @@ class Biblio:
 
             # create hidden bib entry for special dir
             bibname = hidden_bibtex(newdir)
-            lib = library_from_entries([e])
-            bibtex = format_library(lib)
             if not papers.config.DRYRUN:
                 with open(bibname,'w') as f:
-                    f.write(bibtex)
+                    write_library([e], f)
 
             # remove old direc if empty?
             direcs = list({os.path.dirname(file) for file in files})
@@ -819,10 +1346,10 @@ class Biblio:
                 key = self.generate_key(e)
                 if get_entry_val(e, 'ID', '') != key:
                     logger.info('update key {} => {}'.format(get_entry_val(e, 'ID', ''), key))
-                    set_entry_key(e, key)
+                    self.set_key(e, key)
 
         if key_ascii:
-            set_entry_key(e, unicode_to_ascii(get_entry_val(e, 'ID', '')))
+            self.set_key(e, unicode_to_ascii(get_entry_val(e, 'ID', '')))
 
         if interactive and not entry_content_equal(e_old, e):
             print(bcolors.OKBLUE+'*** UPDATE ***'+bcolors.ENDC)
@@ -830,6 +1357,7 @@ class Biblio:
 
             if input('update? [Y/n] ').lower() not in ('', 'y'):
                 logger.info('cancel changes')
+                self.set_key(e, get_entry_val(e_old, 'ID', ''))
                 update_entry(e, e_old)
                 for k in [k for k, _ in e.items()]:
                     if k not in e_old:
@@ -853,6 +1381,46 @@ def get_biblio(config):
     return biblio
 
 
+def stream_biblio(config, key_filter=None, compact=False):
+    """
+    Read-only alternative to get_biblio for large libraries: returns an (empty) Biblio configured as get_biblio
+    would, and a generator over the bibtex entries, parsed as the file is read (see papers.entries.iter_entries).
+    Changes to the entries are not saved.
+
+    key_filter : callable, optional
+        if the key index of the bibtex is up-to-date (see papers.keyindex), only the entries whose key passes
+        the filter are parsed. Otherwise all entries are returned: the caller must still filter.
+    compact : bool, optional
+        yield papers.entries.CompactEntry instead of Entry (several times less memory per entry, for callers
+        that keep many of them, e.g. to search duplicates)
+    """
+    if config.bibtex is None:
+        raise ValueError('bibtex is not initialized')
+    relative_to = os.path.sep if config.absolute_paths else (os.path.dirname(config.bibtex) if config.bibtex else None)
+    biblio = Biblio(filesdir=config.filesdir, relative_to=relative_to, nameformat=config.nameformat, keyformat=config.keyformat)
+
+    def entries():
+        if not os.path.exists(config.bibtex):
+            return
+        # same file paths as after get_biblio's update_file_path
+        loaded_relative_to = os.path.dirname(config.bibtex)
+        entries = None
+        if key_filter is not None:
+            index = read_index(config.bibtex)
+            if index is not None:
+                entries = read_indexed_entries(config.bibtex, index, [k for k in index['entries'] if key_filter(k)])
+        if entries is None:
+            entries = iter_entries(config.bibtex)
+        for e in entries:
+            if compact:
+                e = CompactEntry.from_entry(e)
+            if loaded_relative_to != relative_to:
+                update_file_path(e, loaded_relative_to, relative_to)
+            yield e
+
+    return biblio, entries()
+
+
 def isvalidkey(key):
     return key and not key[0].isdigit()
 
@@ -943,8 +1511,7 @@ def entry_filecheck(e, delete_broken=False, fix_mendeley=False,
                     continue
 
         elif check_hash:
-            # hash_ = hashlib.sha256(open(file, 'rb').read()).digest()
-            hash_ = checksum(file) # a little faster
+            hash_ = file_checksum(file)  # cached
             if hash_ in hashes:
                 logger.info(get_entry_val(e, 'ID', '')+': file already exists (identical checksum): "{}"'.format(file))
                 continue
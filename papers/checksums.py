@@ -0,0 +1,80 @@
+"""Persistent cache of the checksums of attached files.
+
+Files are compared by content when duplicates are merged (merge_files), when a
+file is moved onto an existing one (utils.move) and by filecheck --hash-check.
+The sha256 of each file is kept in CACHE_DIR, keyed by its absolute path and
+valid as long as its size, mtime and inode are unchanged, so that an unchanged
+file is read only once. Files of different sizes are never hashed to be compared.
+Like the library snapshots, this is a pure cache: a mismatch or unreadable cache
+means hashing the file again.
+"""
+import os
+import collections
+
+from papers.config import CacheFile
+from papers.utils import checksum
+
+CACHE_FILE = 'checksums.json'
+# least recently hashed files beyond that number are forgotten
+CACHE_MAX_FILES = 100000
+
+
+class _ChecksumCache(CacheFile):
+    "{path: [size, mtime_ns, inode, sha256 hex]}"
+
+    def merge(self, disk, ours):
+        records = super().merge(disk, ours)
+        if len(records) > CACHE_MAX_FILES:
+            records = dict(list(records.items())[-CACHE_MAX_FILES:])
+        return records
+
+
+_cache = _ChecksumCache(CACHE_FILE, 'checksum cache')
+
+
+def _stamp(path):
+    st = os.stat(path)
+    return [st.st_size, st.st_mtime_ns, st.st_ino]
+
+
+def file_checksum(path):
+    """sha256 digest of a file, as papers.utils.checksum, read from the cache if the file did not change"""
+    path = os.path.abspath(path)
+    stamp = _stamp(path)
+    records = _cache.records()
+    with _cache.lock:
+        record = records.get(path)
+    if record is not None and record[:3] == stamp:
+        return bytes.fromhex(record[3])
+    # hashed outside of the lock: called from several threads (file_checksums, papers.pipeline)
+    digest = checksum(path)
+    with _cache.lock:
+        records.pop(path, None)  # most recent last, see CACHE_MAX_FILES
+        records[path] = stamp + [digest.hex()]
+        _cache.dirty = True
+    return digest
+
+
+def same_content(file1, file2):
+    """Whether two existing files have the same content: the same file, or the same size and checksum"""
+    if os.path.samefile(file1, file2):
+        return True
+    if os.path.getsize(file1) != os.path.getsize(file2):
+        return False
+    return file_checksum(file1) == file_checksum(file2)
+
+
+def size_collisions(files):
+    """The existing files that have the same size as another one in files: only these need a checksum
+    to find the files with the same content."""
+    sizes = {}
+    for f in dict.fromkeys(files):
+        if os.path.exists(f):
+            sizes[f] = os.path.getsize(f)
+    counts = collections.Counter(sizes.values())
+    return [f for f, size in sizes.items() if counts[size] > 1]
+
+
+def flush():
+    """Write the new checksums to the cache file (done at exit anyway)"""
+    _cache.flush()
@@ -1,7 +1,9 @@
 import os, json
+import atexit
 import contextlib
 import copy
 import tempfile
+import threading
 from pathlib import Path
 import hashlib
 import platformdirs
@@ -10,7 +12,7 @@ try:
     import fcntl  # not available on Windows
 except ImportError:
     fcntl = None
-from papers.entries import parse_string
+from papers.entries import iter_entries
 from papers import logger
 from papers.filename import Format, NAMEFORMAT, KEYFORMAT
 from papers import __version__
@@ -18,6 +20,8 @@ from papers.utils import bcolors, check_filesdir, search_config
 
 # GIT = False
 DRYRUN = False
+# worker processes for parsing large bibtex files (1: no pool, 0: one per CPU)
+JOBS = 1
 
 # platform-appropriate locations (on Linux these honor the XDG variables and
 # match the paths previous versions derived by hand; they differ on
@@ -213,13 +217,14 @@ class Config:
             status = bcolors.WARNING+' (missing)'+bcolors.ENDC
         elif check_files:
             try:
-                bibtexstring = open(self.bibtex).read()
-                db = parse_string(bibtexstring)
-                if len(db.entries):
-                    from papers.encoding import parse_file
-                    from papers.entries import get_entry_val
-                    nfiles = sum(len(parse_file(get_entry_val(e, 'file', ''))) for e in db.entries)
-                    status = bcolors.OKBLUE+' ({} entries, {} file links)'.format(len(db.entries), nfiles)+bcolors.ENDC
+                from papers.encoding import parse_file
+                from papers.entries import get_entry_val
+                nentries = nfiles = 0
+                for e in iter_entries(self.bibtex):
+                    nentries += 1
+                    nfiles += len(parse_file(get_entry_val(e, 'file', '')))
+                if nentries:
+                    status = bcolors.OKBLUE+' ({} entries, {} file links)'.format(nentries, nfiles)+bcolors.ENDC
                 else:
                     status = bcolors.WARNING+' (empty)'+bcolors.ENDC
             except:
@@ -290,6 +295,78 @@ def _write_cache_file(cache, file):
         raise
 
 
+def cache_path(name):
+    """path of a file or directory in CACHE_DIR, looked up at call time (CACHE_DIR may be redirected)"""
+    return os.path.join(CACHE_DIR, name)
+
+
+class CacheFile:
+    """A JSON cache file in CACHE_DIR, loaded once and written back at exit (see flush).
+
+    The records are kept in memory, most recently used last. Writing merges them with
+    the file content, as written meanwhile by other processes, under the file lock.
+    Subclasses may change the file format (load, dump) and the merge.
+    """
+    def __init__(self, name, description):
+        self.name = name
+        self.description = description
+        self.lock = threading.RLock()
+        self.file = None
+        self.dirty = False
+        self._records = {}
+        atexit.register(self.flush)
+
+    def load(self, file):
+        "records in a cache file"
+        return _read_cache_file(file)
+
+    def dump(self, records):
+        "content of the cache file"
+        return records
+
+    def merge(self, disk, ours):
+        "records to write, given those in the file and ours (kept for keys present in both)"
+        return {**disk, **ours}
+
+    def records(self):
+        "records of the current cache file, loaded once"
+        file = cache_path(self.name)
+        with self.lock:
+            if self.file != file:
+                self.flush()
+                self.file, self._records, self.dirty = file, self.load(file), False
+            return self._records
+
+    def reset(self):
+        "forget the records in memory without writing them: they are loaded again on next use"
+        with self.lock:
+            self.file, self._records, self.dirty = None, {}, False
+
+    def write(self, records):
+        "replace the records and the file content"
+        with self.lock:
+            os.makedirs(os.path.dirname(self.file), exist_ok=True)
+            with _cache_lock(self.file):
+                _write_cache_file(self.dump(records), self.file)
+            self._records, self.dirty = records, False
+
+    def flush(self):
+        """Write the new records to the cache file (done at exit anyway)"""
+        with self.lock:
+            if DRYRUN or not self.dirty:
+                return
+            try:
+                os.makedirs(os.path.dirname(self.file), exist_ok=True)
+                with _cache_lock(self.file):
+                    records = self.merge(self.load(self.file), self._records)
+                    _write_cache_file(self.dump(records), self.file)
+            except Exception as error:
+                logger.debug(f'could not write {self.description} {self.file}: {error}')
+                return
+            self.dirty = False
+            logger.debug(f'write {self.description}: {self.file}')
+
+
 def cached(file, hashed_key=False):
 
     file = os.path.join(CACHE_DIR, file)
@@ -297,11 +374,14 @@ def cached(file, hashed_key=False):
     def decorator(fun):
         # load lazily on first call so that importing papers does not touch the cache
         cache = None
+        # queries may run in threads (see papers.pipeline): the query itself is not locked
+        lock = threading.Lock()
         def decorated(doi):
             nonlocal cache
-            if cache is None:
-                _init_cache()
-                cache = _read_cache_file(file)
+            with lock:
+                if cache is None:
+                    _init_cache()
+                    cache = _read_cache_file(file)
             if hashed_key: # use hashed parameter as key (for full text query)
                 key = hashlib.sha256(doi.encode('utf-8')).hexdigest()[:6]
             else:
@@ -310,13 +390,15 @@ def cached(file, hashed_key=False):
                 logger.debug('load from cache: '+repr((file, key)))
                 return cache[key]
             else:
-                res = cache[key] = fun(doi)
-                if not DRYRUN:
-                    with _cache_lock(file):
-                        # merge entries written meanwhile by other processes,
-                        # keeping our own values for keys present in both
-                        cache = {**_read_cache_file(file), **cache}
-                        _write_cache_file(cache, file)
+                res = fun(doi)
+                with lock:
+                    cache[key] = res
+                    if not DRYRUN:
+                        with _cache_lock(file):
+                            # merge entries written meanwhile by other processes,
+                            # keeping our own values for keys present in both
+                            cache = {**_read_cache_file(file), **cache}
+                            _write_cache_file(cache, file)
             return res
         return decorated
     return decorator
@@ -3,6 +3,7 @@ import os
 import itertools
 import re
 import difflib
+import concurrent.futures
 
 import bibtexparser
 
@@ -12,6 +13,9 @@ from papers.entries import (
     format_library,
     library_from_entries,
     entry_from_dict,
+    entry_content_equal,
+    entry_fingerprint,
+    derived_field,
 )
 
 import logging
@@ -21,20 +25,33 @@ from papers.extract import isvaliddoi, fetch_entry
 from papers.encoding import parse_file, format_file, format_entries, family_names
 from papers.entries import update_entry
 
-from papers.utils import bcolors, checksum
+from papers.utils import bcolors
+from papers.checksums import file_checksum, size_collisions
 
 
 # ENTRY IDENTITY (for duplicate indexing and comparison)
 # ======================================================
 
 
+class _NonAsciiTable(dict):
+    "str.translate table replacing characters above U+0080, filled as they are met"
+    def __init__(self, replace):
+        self.replace = replace
+
+    def __missing__(self, code):
+        self[code] = value = self.replace if code > 128 else code
+        return value
+
+_NON_ASCII_TABLES = {}
+
+
 def _remove_unicode(s, replace='_'):
-    s2 = []
-    for c in s:
-        if ord(c) > 128:
-            c = replace
-        s2.append(c)
-    return ''.join(s2)
+    if s.isascii():
+        return s
+    table = _NON_ASCII_TABLES.get(replace)
+    if table is None:
+        table = _NON_ASCII_TABLES[replace] = _NonAsciiTable(replace)
+    return s.translate(table)
 
 
 def _simplify_string(s):
@@ -43,54 +60,177 @@ def _simplify_string(s):
     return s.lower().strip()
 
 
-def author_id(e):
+def _author_id(e):
     return _simplify_string(' '.join(family_names(get_entry_val(e, 'author', ''))))
 
 
-def title_id(e):
+def _title_id(e):
     return _simplify_string(get_entry_val(e, 'title', ''))
 
 
+def _entry_id(e):
+    return (get_entry_val(e, 'doi', '').lower(), ''.join([_author_id(e), _title_id(e)]))
+
+
+# derived from the author, title and doi fields, cached for each entry (see papers.entries.derived_field)
+
+def author_id(e):
+    return derived_field(e, 'author_id', _author_id)
+
+
+def title_id(e):
+    return derived_field(e, 'title_id', _title_id)
+
+
 def entry_id(e):
     """Entry identifier which is not the bibtex key. Returns (doi_lower, authortitle)."""
-    authortitle = ''.join([author_id(e), title_id(e)])
-    return (get_entry_val(e, 'doi', '').lower(), authortitle)
+    return derived_field(e, 'entry_id', _entry_id)
 
 
-def _build_duplicate_index(entries):
-    """Build (by_doi, by_authortitle) so duplicate checks only run on candidates. O(n)."""
-    by_doi = {}
-    by_authortitle = {}
-    for e in entries:
-        doi, at = entry_id(e)
-        if doi:
-            by_doi.setdefault(doi, []).append(e)
-        if at:
-            by_authortitle.setdefault(at, []).append(e)
-    return (by_doi, by_authortitle)
-
-
-def _get_duplicate_candidates(entry, by_doi, by_authortitle):
-    """Return list of entries that might duplicate `entry` (same doi or authortitle)."""
-    doi, at = entry_id(entry)
-    candidates = by_doi.get(doi, []) + by_authortitle.get(at, [])
-    # deduplicate by id(); same entry can be in both indices
-    seen = set()
-    out = []
-    for e in candidates:
-        if id(e) not in seen:
-            seen.add(id(e))
-            out.append(e)
-    return out
-
-
-def _add_to_duplicate_index(entry, by_doi, by_authortitle):
-    """Register one entry in the index (after it was added to the library)."""
-    doi, at = entry_id(entry)
+def duplicate_blocks(e):
+    """Blocking keys of an entry: entries that are duplicates at the PARTIAL level
+    or stricter (see papers.bib.compare_entries) share at least one of them, i.e.
+    the lower-case DOI, the normalised author+title, or the empty id when both
+    are missing. Not complete for FUZZY, which compares titles approximately."""
+    doi, at = entry_id(e)
+    keys = []
     if doi:
-        by_doi.setdefault(doi, []).append(entry)
+        keys.append(('doi', doi))
     if at:
-        by_authortitle.setdefault(at, []).append(entry)
+        keys.append(('authortitle', at))
+    if not keys:
+        keys.append(('id', ''))
+    return keys
+
+
+def _fuzzy_tokens(authortitle):
+    # token_set_ratio (rapidfuzz >= 3, no preprocessing) splits on whitespace
+    return frozenset(authortitle.split())
+
+
+def _anchor_token(tokens):
+    "one token of the set, chosen independently of the other entries: the longest"
+    return max(tokens, key=lambda t: (len(t), t))
+
+
+class DuplicateIndex:
+    """Candidates for the duplicate check of an entry being inserted (see Biblio.insert_entry_check),
+    so that it is not compared with the whole library: entries with the same DOI or author+title.
+
+    With fuzzy=True (FUZZY similarity), also the entries with no DOI, author and title if the entry
+    has none either (GOOD similarity), and the entries whose author+title tokens are a subset or a
+    superset of the entry's. At FUZZY_DUPLICATES (token_set_ratio == 100), these are exactly the
+    fuzzy matches, so the candidates contain all the duplicates a full scan would find:
+    - subsets are indexed under one of their tokens (see _anchor_token), which the entry has too
+    - supersets have all the entry's tokens: the entries with its rarest token are enough
+
+    Candidates are returned in the order entries were first added (the library order).
+
+    The index pickles with the entries it refers to: Biblio keeps it in the library snapshot
+    (see Biblio.duplicate_index).
+    """
+    def __init__(self, entries=(), fuzzy=False):
+        self.fuzzy = fuzzy
+        self._entries = {}  # id(entry) -> (entry, index keys, tokens, order)
+        self._index = {}  # index key -> {id(entry): entry}
+        self._count = 0
+        for e in entries:
+            self.add(e)
+
+    def _index_keys(self, entry):
+        doi, at = entry_id(entry)
+        keys = []
+        if doi:
+            keys.append(('doi', doi))
+        if at:
+            keys.append(('authortitle', at))
+        tokens = _fuzzy_tokens(at)
+        if self.fuzzy:
+            if not doi and not at:
+                keys.append(('empty',))
+            keys.extend(('token', t) for t in tokens)
+            if tokens:
+                keys.append(('anchor', _anchor_token(tokens)))
+        return keys, tokens
+
+    def add(self, entry):
+        """Add an entry, or update it after a change of its fields"""
+        record = self._entries.get(id(entry))
+        if record is not None:
+            order = record[3]
+            self.remove(entry)
+        else:
+            order = self._count
+            self._count += 1
+        keys, tokens = self._index_keys(entry)
+        self._entries[id(entry)] = (entry, keys, tokens, order)
+        for k in keys:
+            self._index.setdefault(k, {})[id(entry)] = entry
+
+    def remove(self, entry):
+        record = self._entries.pop(id(entry), None)
+        if record is None:
+            return
+        for k in record[1]:
+            members = self._index[k]
+            del members[id(entry)]
+            if not members:
+                del self._index[k]
+
+    def update(self, added=(), removed=()):
+        "Add or refresh the added (or modified) entries, remove the removed ones"
+        for e in removed:
+            self.remove(e)
+        for e in added:
+            self.add(e)
+
+    def reorder(self, entries):
+        "Order candidates as entries (the library after a sort), the others after them"
+        position = {id(e): i for i, e in enumerate(entries)}
+        for i, (e, keys, tokens, order) in self._entries.items():
+            self._entries[i] = (e, keys, tokens, position.get(i, len(position) + order))
+        self._count = max((record[3] for record in self._entries.values()), default=-1) + 1
+
+    def __getstate__(self):
+        # entries are keyed by id(), which does not survive pickling
+        return {'fuzzy': self.fuzzy, 'records': list(self._entries.values()), 'count': self._count}
+
+    def __setstate__(self, state):
+        self.fuzzy = state['fuzzy']
+        self._count = state['count']
+        self._entries = {}
+        self._index = {}
+        for record in state['records']:
+            e = record[0]
+            self._entries[id(e)] = record
+            for k in record[1]:
+                self._index.setdefault(k, {})[id(e)] = e
+
+    def candidates(self, entry):
+        doi, at = entry_id(entry)
+        found = {}
+        if doi:
+            found.update(self._index.get(('doi', doi), {}))
+        if at:
+            found.update(self._index.get(('authortitle', at), {}))
+        if self.fuzzy:
+            if not doi and not at:
+                found.update(self._index.get(('empty',), {}))
+            tokens = _fuzzy_tokens(at)
+            if tokens:
+                fuzzy = {}
+                for t in tokens:
+                    fuzzy.update(self._index.get(('anchor', t), {}))
+                rarest = min(tokens, key=lambda t: len(self._index.get(('token', t), ())))
+                fuzzy.update(self._index.get(('token', rarest), {}))
+                for i, e in fuzzy.items():
+                    other = self._entries[i][2]
+                    if other <= tokens or tokens <= other:
+                        found[i] = e
+        return sorted(found.values(), key=lambda e: self._entries[id(e)][3])
+
+    def __len__(self):
+        return len(self._entries)
 
 
 # SEARCH DUPLICATES
@@ -127,13 +267,77 @@ def groupby_equal(entries, eq=None):
     return sorted(groups.items())
 
 
-def search_duplicates(entries, key=None, eq=None, issorted=False, filter_key=None):
+def groupby_blocks(entries, eq, blocks):
+    """Same groups as groupby_equal(entries, eq), with eq only called on entries that
+    share a blocking key: blocks(e) returns hashable keys such that eq(e1, e2)
+    implies a common key (e.g. duplicate_blocks). As in groupby_equal, each entry
+    joins the first group with an equal member, or starts a new group.
+
+    >>> groupby_blocks([(1,0),(1,1),(1,2),(2,0),(3,0),(2,1),(4,0)], lambda e1, e2: e1[0]==e2[0], lambda e: [e[0]])
+    [(0, [(1, 0), (1, 1), (1, 2)]), (1, [(2, 0), (2, 1)]), (2, [(3, 0)]), (3, [(4, 0)])]
+    """
+    groups = []
+    by_block = {}  # blocking key -> {group index: members with that key}
+    for e in entries:
+        keys = set(blocks(e))
+        candidate_groups = sorted({g for k in keys for g in by_block.get(k, ())})
+        group = None
+        for g in candidate_groups:
+            seen = set()
+            for k in keys:
+                for ee in by_block.get(k, {}).get(g, ()):
+                    if id(ee) in seen:
+                        continue
+                    seen.add(id(ee))
+                    if eq(ee, e):
+                        group = g
+                        break
+                if group is not None:
+                    break
+            if group is not None:
+                break
+        if group is None:
+            group = len(groups)
+            groups.append([])
+        groups[group].append(e)
+        for k in keys:
+            by_block.setdefault(k, {}).setdefault(group, []).append(e)
+    return list(enumerate(groups))
+
+
+def groupby_pairs(entries, pairs):
+    """Same groups as groupby_equal(entries, eq), given the positions (j, i), j < i, of
+    all the pairs for which eq(entries[j], entries[i]) (e.g. papers.bib.duplicate_pairs).
+
+    >>> groupby_pairs([(1,0),(1,1),(1,2),(2,0),(3,0),(2,1),(4,0)], [(0, 1), (0, 2), (1, 2), (3, 5)])
+    [(0, [(1, 0), (1, 1), (1, 2)]), (1, [(2, 0), (2, 1)]), (2, [(3, 0)]), (3, [(4, 0)])]
+    """
+    earlier = {}  # i -> positions j < i of equal entries
+    for j, i in pairs:
+        earlier.setdefault(i, []).append(j)
+    groups = []
+    group_of = []
+    for i, e in enumerate(entries):
+        if i in earlier:
+            group = min(group_of[j] for j in earlier[i])
+        else:
+            group = len(groups)
+            groups.append([])
+        groups[group].append(e)
+        group_of.append(group)
+    return list(enumerate(groups))
+
+
+def search_duplicates(entries, key=None, eq=None, issorted=False, filter_key=None, blocks=None, pairs=None):
     """search for duplicates
 
     entries: list elements
     key: key to check for equality
     eq: binary operator for equality check (slower)
     issorted: if True and key is provided, skip sort
+    blocks: with eq, function returning the blocking keys of an element (see groupby_blocks),
+        so that eq is not called on every pair
+    pairs: instead of key or eq, positions of the equal elements (see groupby_pairs)
 
     returns:
     - unique_entries : list (entries for which no duplicates where found)
@@ -146,11 +350,17 @@ def search_duplicates(entries, key=None, eq=None, issorted=False, filter_key=Non
     >>> search_duplicates([(1,0), (1,1), (1,2), (2,0), (3,0), (2,1), (4,0)], eq=lambda e1, e2: e1[0]==e2[0])
     ([(3, 0), (4, 0)], [[(1, 2), (1, 0), (1, 1)], [(2, 0), (2, 1)]])
     """
-    if key or eq is None:
+    if pairs is not None:
+        grouped = groupby_pairs(entries, pairs)
+
+    elif key or eq is None:
         if not issorted:
             entries = sorted(entries, key=key)
         grouped = itertools.groupby(entries, key)
 
+    elif blocks is not None:
+        grouped = groupby_blocks(entries, eq, blocks)
+
     else:
         grouped = groupby_equal(entries, eq)
 
@@ -353,17 +563,35 @@ def entry_sdiff(entries, color=True, bcolors=bcolors, best=None):
 # RESOLVE DUPLICATES
 # ==================
 
-def merge_files(entries, relative_to=None):
-    checksums = []
-    files = []
-    for e in entries:
-        for f in parse_file(get_entry_val(e, 'file', ''), relative_to=relative_to):
-            check = checksum(f) if os.path.exists(f) else None
-            if f not in files and (check is None or check not in checksums):
-                files.append(f)
-                if check is not None:
-                    checksums.append(check)
-    return format_file(files, relative_to=relative_to)
+def merge_files(entries, relative_to=None, checksums=None):
+    """merged file field of the entries: files with the same checksum are kept once.
+    Only files of the same size are checksummed (see papers.checksums).
+    checksums: optional {path: checksum} of files already checksummed (see file_checksums)"""
+    known = checksums if checksums is not None else {}
+    files = list(dict.fromkeys(f for e in entries for f in parse_file(get_entry_val(e, 'file', ''), relative_to=relative_to)))
+    if len(files) < 2:
+        return format_file(files, relative_to=relative_to)
+    checksums = set()
+    merged = []
+    collisions = set(size_collisions(files))
+    for f in files:
+        if f in collisions:
+            check = known.get(f) or file_checksum(f)
+            if check in checksums:
+                continue
+            checksums.add(check)
+        merged.append(f)
+    return format_file(merged, relative_to=relative_to)
+
+
+def file_checksums(files, jobs=1):
+    """{path: checksum} of the existing files, computed in jobs threads (reading and hashing release the GIL).
+    Checksums are cached across runs (see papers.checksums)."""
+    files = [f for f in dict.fromkeys(files) if os.path.exists(f)]
+    if jobs == 1 or len(files) < 2:
+        return {f: file_checksum(f) for f in files}
+    with concurrent.futures.ThreadPoolExecutor(max_workers=jobs if jobs > 0 else None) as pool:
+        return dict(zip(files, pool.map(file_checksum, files)))
 
 
 def _ask_pick_loop(entries, extra=[], select=False):
@@ -484,8 +712,10 @@ class DuplicateSkipAll(Exception):
 
 class DuplicateHandler:
 
-    def __init__(self, entries):
+    def __init__(self, entries, checksums=None):
         self.entries = entries
+        self.checksums = checksums  # see merge_files
+        self.conflicts = []  # fields resolved from the best entry by the last merge
 
     # view methods
     def viewdiff(self, color=True, update=False):
@@ -518,23 +748,25 @@ class DuplicateHandler:
         return fetch_entry(self.best())
 
     def merge_files(self):
-        file = merge_files(self.entries)
+        file = merge_files(self.entries, checksums=self.checksums)
         if file:
             for e in self.entries:
                 e['file'] = file
 
-    def merge(self, interactive=True):
+    def merge(self, interactive=True, warn=True):
         """Merge the group into one entry; conflicting fields take the best
         entry's value. In interactive mode a conflicting merge is appended to
         the group as a proposal for review instead of replacing it.
+        warn: log conflicts as warnings (else debug messages)
         """
         self.merge_files()
         merged = merge_entries(self.entries)
         had_conflict = isinstance(merged, MergedEntry)
+        self.conflicts = []
 
         if had_conflict:
-            fields = [k for k in merged if isinstance(merged[k], ConflictingField)]
-            logger.warning('conflicting entries for fields: '+str(fields)+' (resolved from the best entry)')
+            fields = self.conflicts = [k for k in merged if isinstance(merged[k], ConflictingField)]
+            (logger.warning if warn else logger.debug)('conflicting entries for fields: '+str(fields)+' (resolved from the best entry)')
             best = self.best()
             for k in fields:
                 merged[k] = get_entry_val(best, k, None) or merged[k].choices[0]
@@ -654,13 +886,96 @@ def resolve_duplicates(duplicates, mode='i'):
     return conflict.entries
 
 
-def check_duplicates(entries, key=None, eq=None, issorted=False, filter_key=None, mode='i'):
+def unique_content(entries):
+    """entries without those with the same content as an earlier one (see entry_content_equal),
+    in linear time (unique compares each entry with all the kept ones)"""
+    kept = {}  # fingerprint -> kept entries
+    entries_ = []
+    for e in entries:
+        same = kept.setdefault(entry_fingerprint(e), [])
+        if not any(entry_content_equal(ee, e) for ee in same):
+            same.append(e)
+            entries_.append(e)
+    return entries_
+
+
+# fewer groups are merged in the main process: starting the workers and pickling the entries cost more
+MERGE_PROCESS_MIN_GROUPS = 2000
+
+
+def _merge_group(group, checksums):
+    "(resolved entries, report) of a group of duplicates, see merge_duplicates"
+    conflict = DuplicateHandler(unique_content(group), checksums=checksums)
+    if len(conflict.entries) > 1:
+        conflict.merge(interactive=False, warn=False)
+    merged = conflict.entries[0]
+    return conflict.entries, {
+        'keys': [get_entry_val(e, 'ID', '') for e in group],
+        'merged': get_entry_val(merged, 'ID', ''),
+        'conflicts': conflict.conflicts,
+        'files': parse_file(get_entry_val(merged, 'file', '')),
+    }
+
+
+def _merge_groups(args):
+    groups, checksums = args
+    return [_merge_group(group, checksums) for group in groups]
+
+
+def merge_duplicates(duplicate_groups, jobs=1):
+    """Merge each group of duplicates into one entry, without asking (check --duplicates -m m).
+    Same result as resolve_duplicates(group, 'm') on each group, except that entries with the same
+    content are only kept once, and that the attached files of all groups are checksummed once,
+    in jobs threads, before merging.
+
+    The groups are independent: with jobs > 1 (0: one per CPU) and at least MERGE_PROCESS_MIN_GROUPS
+    of them, they are merged in a pool of jobs processes, in chunks. The resolved entries are then
+    copies, as pickled back from the workers.
+
+    Returns the resolved entries and a report: one dict per group, with the keys of the group,
+    the key of the entry it was merged into, the fields that conflicted and the merged files.
+    """
+    # only files of the same size within a group can be merged as identical
+    files = [f for group in duplicate_groups
+             for f in size_collisions([f for e in group for f in parse_file(get_entry_val(e, 'file', ''))])]
+    checksums = file_checksums(files, jobs=jobs)
+    workers = jobs if jobs > 0 else os.cpu_count() or 1
+    if workers > 1 and len(duplicate_groups) >= MERGE_PROCESS_MIN_GROUPS:
+        size = -(-len(duplicate_groups) // (workers * 4))
+        chunks = [duplicate_groups[i:i+size] for i in range(0, len(duplicate_groups), size)]
+        args = [(chunk, {f: checksums[f] for group in chunk for e in group
+                         for f in parse_file(get_entry_val(e, 'file', '')) if f in checksums})
+                for chunk in chunks]
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers) as pool:
+            merged = [r for results in pool.map(_merge_groups, args) for r in results]
+    else:
+        merged = _merge_groups((duplicate_groups, checksums))
+    resolved = [e for entries, _ in merged for e in entries]
+    report = [r for _, r in merged]
+    conflicts = sum(1 for r in report if r['conflicts'])
+    if conflicts:
+        logger.warning(f'{conflicts} of {len(report)} merged groups had conflicting fields (resolved from the best entry)')
+    return resolved, report
+
+
+def check_duplicates(entries, key=None, eq=None, issorted=False, filter_key=None, mode='i', blocks=None, pairs=None,
+                     report=None, jobs=1):
     """check duplicates, given a key or equality function
     !! resolved duplicates are appended to the list of entries
+
+    In merge mode (mode='m'), the groups are merged by merge_duplicates (with jobs threads or processes),
+    whose report is appended to the report list if provided.
     """
-    entries, duplicate_groups = search_duplicates(entries, key, eq, issorted, filter_key)
+    entries, duplicate_groups = search_duplicates(entries, key, eq, issorted, filter_key, blocks=blocks, pairs=pairs)
     logger.info(str(len(duplicate_groups))+' duplicate(s)')
 
+    if mode == 'm':
+        resolved, merged = merge_duplicates(duplicate_groups, jobs=jobs)
+        entries.extend(resolved)
+        if report is not None:
+            report.extend(merged)
+        return entries
+
     for i, duplicates in enumerate(duplicate_groups):
         try:
             entries.extend(resolve_duplicates(duplicates, mode))
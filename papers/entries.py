@@ -4,16 +4,25 @@ Value access, entry copy/compare, parse/format. Used by bib, encoding, duplicate
 No dependency on bib or encoding to avoid circular imports.
 """
 
+import os
+import re
+import sys
+import gc
+import pickle
+import hashlib
+import weakref
+import contextlib
+import concurrent.futures
+
 import bibtexparser
 from bibtexparser import Library
-from bibtexparser.middlewares import SortFieldsAlphabeticallyMiddleware
-from bibtexparser.model import Entry, Field
-from bibtexparser.writer import BibtexFormat
+from bibtexparser.middlewares.parsestack import default_parse_stack
+from bibtexparser.model import Entry, Field, String, Preamble, ExplicitComment, ImplicitComment, ParsingFailedBlock, DuplicateBlockKeyBlock
 
 
 def get_entry_val(entry, key, default=''):
     """Get field value from an entry (v2 Entry or dict-like)."""
-    if hasattr(entry, 'fields_dict'):
+    if isinstance(entry, Entry):  # hasattr(entry, 'fields_dict') would build the dict once more
         if key == 'ID':
             return entry.key
         if key == 'ENTRYTYPE':
@@ -43,14 +52,88 @@ def update_entry(entry, other):
             entry[k] = v
 
 
+def _entry_content(entry, skip_keys=()):
+    "the normalized content of an entry as a dict, as compared by entry_content_equal"
+    if isinstance(entry, Entry):
+        content = {f.key: f.value for f in entry.fields}
+        content['ENTRYTYPE'] = entry.entry_type
+        content['ID'] = entry.key
+    else:
+        content = {k: get_entry_val(entry, k, '') for k, _ in entry.items()}
+    for k in skip_keys:
+        content.pop(k, None)
+    return content
+
+
+def _content_digest(content):
+    h = hashlib.blake2b(digest_size=16)
+    for k, v in sorted(content.items()):
+        h.update(f'{k}\0{type(v).__name__}\0{v}\0'.encode('utf-8', 'surrogateescape'))
+    return h.hexdigest()
+
+
+# id(entry) -> [weak reference, state, derived values], see entry_cache. The values are not kept on the
+# entries themselves: bibtexparser compares blocks by their __dict__, and they would be pickled along.
+_DERIVED = {}
+
+
+def _forget_derived(ref, i):
+    cached = _DERIVED.get(i)
+    if cached is not None and cached[0] is ref:
+        del _DERIVED[i]
+
+
+def entry_cache(entry):
+    """Dict of values derived from a v2 Entry (see derived_field), emptied when its type, key or
+    Field objects change: fields are replaced, not modified in place (see papers.journal), and
+    dropped with the entry. None for other entries (dicts...), whose derived values are not cached."""
+    if not isinstance(entry, Entry):
+        return None
+    state = (entry.entry_type, entry.key, tuple(entry.fields))
+    i = id(entry)
+    cached = _DERIVED.get(i)
+    if cached is None or cached[0]() is not entry:
+        cached = _DERIVED[i] = [weakref.ref(entry, lambda ref, i=i: _forget_derived(ref, i)), state, {}]
+    elif cached[1] != state:  # fields compare by identity first
+        cached[1] = state
+        cached[2] = {}
+    return cached[2]
+
+
+def derived_field(entry, name, compute):
+    "compute(entry), cached for the entry under name until it changes (see entry_cache)"
+    cache = entry_cache(entry)
+    if cache is None:
+        return compute(entry)
+    try:
+        return cache[name]
+    except KeyError:
+        value = cache[name] = compute(entry)
+        return value
+
+
+def entry_fingerprint(entry, skip_keys=()):
+    """Digest of the normalized content of an entry: entries equal for entry_content_equal have
+    the same fingerprint. Cached for v2 entries (see derived_field).
+    """
+    if skip_keys:
+        return _content_digest(_entry_content(entry, skip_keys))
+    return derived_field(entry, 'fingerprint', lambda e: _content_digest(_entry_content(e)))
+
+
 def entry_content_equal(entry, other, skip_keys=()):
-    """Compare two entries by normalized content. Use instead of entry == other for v2 Entry."""
+    """Compare two entries by normalized content. Use instead of entry == other for v2 Entry.
+    Entries with different fingerprints (see entry_fingerprint) differ: the content is only
+    compared field by field when they match."""
     if entry is other:
         return True
     try:
-        entry_rest = {k: get_entry_val(entry, k, '') for k, _ in entry.items() if k not in skip_keys}
-        other_rest = {k: get_entry_val(other, k, '') for k, _ in other.items() if k not in skip_keys}
-        return entry_rest == other_rest
+        if skip_keys:
+            # not cached: digests would cost more than the comparison
+            return _entry_content(entry, skip_keys) == _entry_content(other, skip_keys)
+        if entry_fingerprint(entry) != entry_fingerprint(other):
+            return False
+        return _entry_content(entry, skip_keys) == _entry_content(other, skip_keys)
     except Exception:
         return False
 
@@ -80,16 +163,273 @@ def library_from_entries(entries):
     for e in entries:
         if isinstance(e, Entry):
             lib.add(e)
+        elif isinstance(e, CompactEntry):
+            lib.add(e.to_entry())
         else:
             lib.add(entry_from_dict(dict(e.items())))
     return lib
 
 
-def parse_string(bibtex_str):
-    """Parse a BibTeX string; returns Library. Handles empty string."""
+def parse_string(bibtex_str, jobs=1):
+    """Parse a BibTeX string; returns Library. Handles empty string.
+    With jobs != 1, large strings are parsed in a process pool (see parse_string_parallel)."""
     if not bibtex_str or not bibtex_str.strip():
         return Library()
-    return bibtexparser.parse_string(bibtex_str)
+    if jobs != 1 and len(bibtex_str) >= PARALLEL_MIN_SIZE:
+        return parse_string_parallel(bibtex_str, jobs)
+    if _STRING_DEFINITION.search(bibtex_str):
+        # references may point to @string blocks anywhere in the file
+        return bibtexparser.parse_string(bibtex_str)
+    blocks, end, line = _parse_canonical(bibtex_str)
+    library = Library()
+    library.add(blocks, fail_on_duplicate_key=False)
+    if bibtex_str[end:].strip():
+        # from the first block not in canonical form on: split, and transform
+        # the new blocks after adding them, as bibtexparser does (duplicates are
+        # wrapped untransformed)
+        rest = bibtexparser.parse_string(bibtex_str[end:], parse_stack=[])
+        _shift_lines(rest.blocks, line)
+        # duplicates are wrapped again, of the keys in the whole library
+        library.add([block.ignore_error_block if isinstance(block, DuplicateBlockKeyBlock) else block
+                     for block in rest.blocks], fail_on_duplicate_key=False)
+        rest = Library([block for block in library.blocks[len(blocks):] if not isinstance(block, ParsingFailedBlock)])
+        for middleware in default_parse_stack():
+            rest = middleware.transform(library=rest)
+    return library
+
+
+# papers' own output (see format_library) has a strict layout:
+#   @type{key,\n name = {value},\n ... name = {value}\n}
+# with blocks separated by an empty line. Entries in that form are read directly,
+# with the same result as bibtexparser's splitter and default parse stack.
+_CANONICAL_HEAD = re.compile(r'@(\w+)\{([^\s,{}"=@\\]+),\n')
+_CANONICAL_FIELD = re.compile(r' ([^\s,{}"=@\\#]+) = \{')
+# most fields: one line, no braces or backslash in the value
+_CANONICAL_SIMPLE_FIELD = re.compile(r' ([^\s,{}"=@\\#]+) = \{([^{}\\\n]*)\}(,\n|\n\})')
+_CANONICAL_SPACE = re.compile(r'[ \t\n]*')
+_UNESCAPED_BRACE = re.compile(r'(?<!\\)[{}]')
+# an "@type{" at the start of a line aborts the current block in bibtexparser
+_BLOCK_START_IN_VALUE = re.compile(r'\n\s*@\w*[ \t]*[{(]')
+_SPECIAL_BLOCK_TYPES = ('comment', 'preamble', 'string')
+
+
+def _canonical_field(text, pos):
+    """Parse the field at pos in canonical form: return (key, value, end) with end
+    after the "," or the "}" closing the entry, or None if not in that form."""
+    m = _CANONICAL_SIMPLE_FIELD.match(text, pos)
+    if m:
+        return m.group(1), m.group(2), m.end()
+    m = _CANONICAL_FIELD.match(text, pos)
+    if not m:
+        return None
+    depth = 1
+    for brace in _UNESCAPED_BRACE.finditer(text, m.end()):
+        depth += 1 if brace.group() == '{' else -1
+        if depth == 0:
+            break
+    else:
+        return None
+    value = text[m.end():brace.start()]
+    if '@' in value and _BLOCK_START_IN_VALUE.search(value):
+        return None
+    end = brace.end()
+    if not text.startswith((',\n', '\n}'), end):
+        return None
+    return m.group(1), value, end + 2
+
+
+def _parse_canonical_entry(text, pos, line):
+    """Parse the entry at pos (an "@") in canonical form: return (entry, end, end line),
+    or None if it is not in that form."""
+    head = _CANONICAL_HEAD.match(text, pos)
+    if not head:
+        return None
+    entry_type = head.group(1).lower()
+    if entry_type.startswith(_SPECIAL_BLOCK_TYPES):
+        return None
+    start_line = line
+    fields = []
+    enclosings = {}
+    end = head.end()
+    while text[end-1] != '}':
+        line += 1
+        field = _canonical_field(text, end)
+        if field is None:
+            return None
+        key, value, end = field
+        if key in enclosings:
+            return None
+        fields.append(Field(key, value, start_line=line))
+        enclosings[key] = '{'
+        if '\n' in value:
+            line += value.count('\n')
+    line += 1  # the closing "}"
+    entry = Entry(entry_type, head.group(2), fields, start_line=start_line, raw=text[pos:end])
+    entry.parser_metadata['removed_enclosing'] = enclosings
+    return entry, end, line
+
+
+def _parse_canonical(text):
+    """Read the leading blocks of text that are in canonical form.
+    Return (blocks, end, line): the text from end on (at line number line) is left to bibtexparser."""
+    blocks = []
+    keys = set()
+    end = line = 0
+    while True:
+        space = _CANONICAL_SPACE.match(text, end)
+        pos = space.end()
+        if pos == len(text):
+            return blocks, end, line
+        parsed = _parse_canonical_entry(text, pos, line + text.count('\n', end, pos))
+        if parsed is None or parsed[0].key in keys:
+            return blocks, end, line
+        entry, end, line = parsed
+        blocks.append(entry)
+        keys.add(entry.key)
+
+
+def _shift_lines(blocks, offset):
+    """Make the line numbers of blocks parsed from a piece of a string relative to the whole
+    (no public setter for these)"""
+    if not offset:
+        return
+    for block in blocks:
+        for block in (block, getattr(block, 'ignore_error_block', None)):
+            if block is None:
+                continue
+            if block.start_line is not None:
+                block._start_line_in_file += offset
+            for field in getattr(block, 'fields', ()):
+                if field.start_line is not None:
+                    field._start_line += offset
+
+
+def _parsed_entries(blocks, text, layout, formatted):
+    "see as_parsed: the formatted entries parsed again, one by one, or None"
+    updates = []
+    formatted = set(formatted)
+    line = pos = 0
+    for n, (block, (_, start, end)) in enumerate(zip(blocks, layout)):
+        line += text.count('\n', pos, start)
+        pos = start
+        if n in formatted:
+            new = _parse_canonical_entry(text, start, line)
+            if new is not None and new[1] == end - 1:
+                new = new[0]
+            else:
+                # not in canonical form (unenclosed values...): parse the block alone
+                new = parse_string(text[start:end]).blocks
+                _shift_lines(new, line)
+                new = new[0] if len(new) == 1 else None
+            if not isinstance(new, Entry) or new.key != block.key:
+                return None
+            updates.append((block, new))
+        elif block.start_line is None:
+            return None
+        else:
+            updates.append((block, line - block.start_line))
+    return updates
+
+
+def as_parsed(blocks, text, layout, formatted, jobs=1):
+    """Bring blocks, just written as text, into the state parse_string(text) gives them, in place:
+    str values, fields in the written order, raw text, line numbers. layout is a list of
+    (state, start, end) parallel to the blocks, and formatted the indices of the blocks formatted
+    anew (see Biblio.save): these are parsed again, the others only get their new line numbers.
+    Return False, with the blocks unchanged, if the text does not parse back to the blocks.
+    """
+    updates = None  # (block, parsed block or line offset)
+    if not _STRING_DEFINITION.search(text) and all(isinstance(blocks[n], Entry) for n in formatted):
+        # one tuple per block: the garbage collector would scan the whole library again and again
+        with _gc_paused():
+            updates = _parsed_entries(blocks, text, layout, formatted)
+    if updates is None:
+        # @string references, comments...: parse the whole text
+        parsed = parse_string(text, jobs=jobs).blocks
+        if len(parsed) != len(blocks) or any(type(block) is not type(new) or getattr(block, 'key', None) != getattr(new, 'key', None)
+                                             for block, new in zip(blocks, parsed)):
+            return False
+        updates = list(zip(blocks, parsed))
+    for block, update in updates:
+        if isinstance(update, int):
+            _shift_lines([block], update)
+        else:
+            # the parsed state, on the same object: the library and its indexes keep their blocks
+            vars(block).update(vars(update))
+    return True
+
+
+# below that size (in characters), starting a process pool costs more than it saves
+PARALLEL_MIN_SIZE = 1 << 20
+
+_STRING_DEFINITION = re.compile(r'@\s*string\s*[{(]', re.IGNORECASE)
+
+
+def _split_chunks(text, n):
+    """Return (start, end) of at most n pieces of text of similar size, cut before
+    line-starting "@" that follow brace-balanced text (i.e. between top-level blocks)."""
+    bounds = [0]
+    depth = 0  # brace balance of text[:pos]
+    pos = 0
+    for i in range(1, n):
+        cut = text.find('\n@', max(len(text) * i // n, pos))
+        while cut != -1:
+            depth += text.count('{', pos, cut+1) - text.count('}', pos, cut+1)
+            pos = cut + 1
+            if depth == 0:
+                break
+            cut = text.find('\n@', pos)
+        if cut == -1:
+            break
+        bounds.append(cut + 1)
+    bounds.append(len(text))
+    return [(start, end) for start, end in zip(bounds[:-1], bounds[1:]) if start < end]
+
+
+def _parse_chunk(args):
+    text, line_offset, resolve_strings = args
+    library = parse_string(text) if resolve_strings else bibtexparser.parse_string(text, parse_stack=[])
+    _shift_lines(library.blocks, line_offset)
+    # pickled here, so that the parent process can unpickle with gc paused (see below)
+    return pickle.dumps(library.blocks, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+@contextlib.contextmanager
+def _gc_paused():
+    # the cyclic garbage collector repeatedly scans the many objects allocated
+    # while unpickling a library, which can double the unpickling time
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        if enabled:
+            gc.enable()
+
+
+def parse_string_parallel(bibtex_str, jobs=0):
+    """Parse a BibTeX string in a process pool of `jobs` workers (0: one per CPU).
+
+    The string is cut between top-level blocks into one chunk per worker. The
+    parsed blocks are merged in order into one Library, with the same result as
+    parse_string: duplicate keys across chunks are detected on merge, and if the
+    string defines @string values anywhere, references are resolved after merging.
+    """
+    if jobs <= 0:
+        jobs = os.cpu_count() or 1
+    chunks = _split_chunks(bibtex_str, jobs)
+    resolve_in_chunks = _STRING_DEFINITION.search(bibtex_str) is None
+    args = [(bibtex_str[start:end], bibtex_str.count('\n', 0, start), resolve_in_chunks) for start, end in chunks]
+    with concurrent.futures.ProcessPoolExecutor(max_workers=len(args)) as pool:
+        results = list(pool.map(_parse_chunk, args))
+    library = Library()
+    with _gc_paused():
+        for blocks in results:
+            library.add(pickle.loads(blocks), fail_on_duplicate_key=False)
+    if not resolve_in_chunks:
+        for middleware in default_parse_stack():
+            library = middleware.transform(library=library)
+    return library
 
 
 def parse_file(path, encoding='utf-8'):
@@ -97,11 +437,292 @@ def parse_file(path, encoding='utf-8'):
     return bibtexparser.parse_file(path, encoding=encoding)
 
 
+def _split_complete_blocks(text):
+    """Split text before the last line-starting "@" that follows brace-balanced text,
+    i.e. (complete blocks, remainder). The first part is empty if there is no such "@".
+    """
+    cut = text.rfind('\n@')
+    while cut != -1:
+        head = text[:cut+1]
+        if head.count('{') == head.count('}'):
+            return head, text[cut+1:]
+        # "@" at the start of a line inside a field value: look further back
+        cut = text.rfind('\n@', 0, cut)
+    return '', text
+
+
+def iter_entries(path, chunk_size=1 << 16):
+    """Yield the entries of a BibTeX file one at a time, reading it in chunks.
+
+    The file is read with the same (default) encoding as Biblio.load. Entries
+    are the same as Library.entries after a full parse: @string references are
+    resolved and entries with an already-seen key are skipped.
+    """
+    strings = {}  # @string definitions, prepended to later chunks for reference resolution
+    seen = set()
+    pending = ''
+    with open(path) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if chunk:
+                blocks, pending = _split_complete_blocks(pending + chunk)
+            else:
+                blocks, pending = pending, ''
+            if blocks.strip():
+                library = parse_string(''.join(strings.values()) + blocks)
+                for string in library.strings:
+                    if string.key not in strings:
+                        strings[string.key] = string.raw + '\n'
+                for entry in library.entries:
+                    if entry.key in seen:
+                        continue
+                    seen.add(entry.key)
+                    yield entry
+            if not chunk:
+                break
+
+
+# field name -> position, one shared dict per set of field names (most entries
+# of a library have one of a few dozen field sets)
+_FIELD_INDEXES = {}
+
+
+def _field_index(names):
+    names = tuple(names)
+    index = _FIELD_INDEXES.get(names)
+    if index is None:
+        index = _FIELD_INDEXES[names] = {sys.intern(name): i for i, name in enumerate(names)}
+    return index
+
+
+class CompactEntry:
+    """Read-mostly stand-in for an Entry, for commands that hold many entries
+    without saving them (see stream_biblio(compact=True)).
+
+    The raw text and Field objects are dropped: field values are kept in a
+    tuple, and field names in a dict shared by all entries with the same
+    fields. Access is dict-like as for Entry (e['title'], 'doi' in e, e.items(),
+    get_entry_val); to_entry() gives back an Entry, e.g. to format it.
+    """
+    __slots__ = ('entry_type', 'key', '_index', '_values', '_enclosings')
+
+    def __init__(self, entry_type, key, names, values, enclosings=None):
+        self.entry_type = sys.intern(entry_type)
+        self.key = key
+        self._index = _field_index(names)
+        self._values = tuple(values)
+        # None if no field demands an enclosing (the usual case)
+        self._enclosings = tuple(enclosings) if enclosings and any(enclosings) else None
+
+    @classmethod
+    def from_entry(cls, entry):
+        fields = entry.fields
+        return cls(entry.entry_type, entry.key, [f.key for f in fields], [f.value for f in fields],
+                   [f.enclosing for f in fields])
+
+    def to_entry(self):
+        enclosings = self._enclosings or (None,)*len(self._values)
+        return Entry(self.entry_type, self.key,
+                     [Field(k, v, enclosing=c) for k, v, c in zip(self._index, self._values, enclosings)])
+
+    def get(self, key, default=None):
+        """Field value (not Field, unlike Entry.get), as get_entry_val"""
+        if key == 'ID':
+            return self.key
+        if key == 'ENTRYTYPE':
+            return self.entry_type
+        i = self._index.get(key)
+        return default if i is None else self._values[i]
+
+    def __getitem__(self, key):
+        if key == 'ID':
+            return self.key
+        if key == 'ENTRYTYPE':
+            return self.entry_type
+        return self._values[self._index[key]]
+
+    def __contains__(self, key):
+        return key in ('ENTRYTYPE', 'ID') or key in self._index
+
+    def __setitem__(self, key, value):
+        if key == 'ID':
+            self.key = value
+            return
+        if key == 'ENTRYTYPE':
+            self.entry_type = value
+            return
+        i = self._index.get(key)
+        values = list(self._values)
+        enclosings = list(self._enclosings or (None,)*len(values))
+        if i is None:
+            self._index = _field_index(tuple(self._index) + (key,))
+            values.append(value)
+            enclosings.append(None)
+        else:
+            values[i] = value
+            enclosings[i] = None  # as a new Field
+        self._values = tuple(values)
+        self._enclosings = tuple(enclosings) if any(enclosings) else None
+
+    def __delitem__(self, key):
+        i = self._index.get(key)
+        if i is None:
+            return
+        keep = [j for j in range(len(self._values)) if j != i]
+        names = tuple(self._index)
+        self._index = _field_index(names[j] for j in keep)
+        self._values = tuple(self._values[j] for j in keep)
+        if self._enclosings is not None:
+            enclosings = tuple(self._enclosings[j] for j in keep)
+            self._enclosings = enclosings if any(enclosings) else None
+
+    def items(self):
+        return [('ENTRYTYPE', self.entry_type), ('ID', self.key)] + list(zip(self._index, self._values))
+
+    def keys(self):
+        return ['ENTRYTYPE', 'ID'] + list(self._index)
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        """Number of fields, as len(entry.fields)"""
+        return len(self._values)
+
+    def __repr__(self):
+        return f"CompactEntry(entry_type={self.entry_type!r}, key={self.key!r}, fields={dict(zip(self._index, self._values))!r})"
+
+
+# same output as bibtexparser.write_string with SortFieldsAlphabeticallyMiddleware,
+# the default unparse stack (enclose values in braces, unless a field demands
+# otherwise) and a BibtexFormat with indent " " and block separator "\n"
+PARSING_FAILED_COMMENT = "% WARNING Parsing failed for the following {n} lines."
+
+_UNENCLOSED_MARKS = re.compile(r'(?<!\\)[{}",=\n]')
+
+
+def _is_writable_unenclosed(value):
+    """Whether the value reads back the same when written without enclosing
+    (balanced braces, no comma, equal sign or newline outside braces and quotes)"""
+    depth = 0
+    in_quotes = False
+    for m in _UNENCLOSED_MARKS.finditer(value):
+        char = m.group()
+        if char == '{':
+            depth += 1
+        elif char == '}':
+            depth -= 1
+            if depth < 0:
+                return False
+        elif depth == 0:
+            if char == '"':
+                in_quotes = not in_quotes
+            elif not in_quotes:
+                return False
+    return depth == 0 and not in_quotes
+
+
+def _enclose(value, enclosing):
+    value = str(value)
+    if enclosing is None or enclosing == '{':
+        return '{' + value + '}'
+    if enclosing == '"':
+        return '"' + value + '"'
+    if enclosing == 'no-enclosing':
+        return value if _is_writable_unenclosed(value) else '{' + value + '}'
+    raise ValueError(f"enclosing must be either '{{' or '\"' or 'no-enclosing', not '{enclosing}'")
+
+
+def _field_key(field):
+    return field.key
+
+
+def format_block(block):
+    """Serialize a single block as format_library does: the BibTeX string of a
+    library is the formatted blocks joined by a newline. Does not modify the block."""
+    if isinstance(block, Entry):
+        fields = sorted(block.fields, key=_field_key)
+        lines = [f' {f.key} = {_enclose(f.value, getattr(f, "enclosing", None))},\n' for f in fields]
+        if lines:
+            lines[-1] = lines[-1][:-2] + '\n'
+        return f'@{block.entry_type}{{{block.key},\n' + ''.join(lines) + '}\n'
+    if isinstance(block, String):
+        return f'@string{{{block.key} = {_enclose(block.value, getattr(block, "enclosing", None))}}}\n'
+    if isinstance(block, Preamble):
+        return f'@preamble{{{block.value}}}\n'
+    if isinstance(block, ExplicitComment):
+        return f'@comment{{{block.comment}}}\n'
+    if isinstance(block, ImplicitComment):
+        return block.comment + '\n'
+    if isinstance(block, ParsingFailedBlock):
+        if block.raw is None:
+            raise ValueError(f'Cannot write a failed block without raw bibtex: {type(block).__name__}: {block.error}')
+        return PARSING_FAILED_COMMENT.format(n=len(block.raw.splitlines())) + '\n' + block.raw + '\n'
+    raise ValueError(f'Unknown block type: {type(block)}')
+
+
+def _check_writable(blocks):
+    # fail before anything is written, like bibtexparser
+    for block in blocks:
+        if isinstance(block, ParsingFailedBlock) and block.raw is None:
+            format_block(block)
+
+
+def write_library(library, file):
+    """Write a Library (or a list of blocks) to a text file object, as format_library.
+    Fields are written in alphabetical order; the library is not modified."""
+    blocks = library.blocks if isinstance(library, Library) else library
+    _check_writable(blocks)
+    for i, block in enumerate(blocks):
+        if i:
+            file.write('\n')
+        file.write(format_block(block))
+
+
 def format_library(library):
-    """Serialize a Library to a BibTeX string (single-space indent, newline between entries).
-    Fields in alphabetical order. Mutates the library in place (field order)."""
-    library = SortFieldsAlphabeticallyMiddleware().transform(library=library)
-    fmt = BibtexFormat()
-    fmt.indent = " "
-    fmt.block_separator = "\n"
-    return bibtexparser.write_string(library, bibtex_format=fmt)
+    """Serialize a Library (or a list of blocks) to a BibTeX string (single-space indent,
+    newline between entries). Fields in alphabetical order; the library is not modified."""
+    blocks = library.blocks if isinstance(library, Library) else library
+    _check_writable(blocks)
+    return '\n'.join([format_block(block) for block in blocks])
+
+
+def block_state(block):
+    """What format_block depends on, to tell whether a block changed since
+    it was last written. Compare with ==."""
+    if isinstance(block, Entry):
+        return (block.entry_type, block.key, tuple(sorted(((f.key, f.value, f.enclosing) for f in block.fields), key=_state_key)))
+    # strings, preambles, comments: few of them, compare the text itself
+    return format_block(block)
+
+
+def _state_key(field_state):
+    return field_state[0]
+
+
+BLOCK_TYPE_ORDER = (String, Preamble, Entry, ImplicitComment, ExplicitComment)
+
+
+def block_sort_key(block):
+    try:
+        type_index = BLOCK_TYPE_ORDER.index(type(block))
+    except ValueError:
+        type_index = len(BLOCK_TYPE_ORDER)
+    return type_index, getattr(block, 'key', '')
+
+
+def sort_blocks(blocks):
+    """Return the blocks ordered by type and key, comments staying on top of
+    the following block. Same order as bibtexparser's
+    SortBlocksByTypeAndKeyMiddleware, but the blocks are not copied."""
+    chunks = []
+    chunk = []
+    for block in blocks:
+        chunk.append(block)
+        if not isinstance(block, (ExplicitComment, ImplicitComment)):
+            chunks.append(chunk)
+            chunk = []
+    if chunk:
+        chunks.append(chunk)
+    chunks.sort(key=lambda chunk: block_sort_key(chunk[-1]))
+    return [block for chunk in chunks for block in chunk]
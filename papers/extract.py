@@ -10,6 +10,7 @@ import bibtexparser
 
 import papers
 from papers.config import cached
+from papers import extractcache, ocr
 from papers import logger
 from papers.encoding import family_names
 from papers.entries import (
@@ -40,22 +41,12 @@ class DOIRequestError(ValueError):
 def readpdf_fitz(pdf_path, pages=None, first=None, last=None):
     import fitz
 
-    # Open the PDF file
-    document = fitz.open(pdf_path)
-    text = ""
-
-    # Iterate through the pages
-    for page_num in range(len(document)):
-        if pages is not None and page_num+1 not in pages:
-            continue
-        elif first is not None and page_num+1 < first:
-            continue
-        elif last is not None and page_num+1 > last:
-            continue
-        page = document.load_page(page_num)
-        text += page.get_text()
-
-    return text
+    with fitz.open(pdf_path) as document:
+        # only the requested page range is visited
+        start = max(first or 1, 1) - 1
+        stop = len(document) if last is None else min(last, len(document))
+        return "".join(document.load_page(page_num).get_text() for page_num in range(start, stop)
+                       if pages is None or page_num+1 in pages)
 
 def readpdf_poputils(pdf, first=None, last=None, pages=None):
     # DEPRECATED
@@ -85,10 +76,22 @@ def readpdf(pdf, first=None, last=None):
 
 
 def readpdf_image(pdf, first=None, last=None):
-
+    """text of a page range, OCRed where the pages have no text layer (see papers.ocr)"""
     if not os.path.isfile(pdf):
         raise ValueError(repr(pdf) + ": not a file")
+    try:
+        import fitz
+    except ImportError:
+        return readpdf_image_poputils(pdf, first=first, last=last)
+
+    with fitz.open(pdf) as document:
+        start = max(first or 1, 1) - 1
+        stop = len(document) if last is None else min(last, len(document))
+        return "".join(ocr.page_texts(document, range(start, stop)))
+
 
+def readpdf_image_poputils(pdf, first=None, last=None):
+    # first page of the range only, whether it has a text layer or not
     tmpbase = tempfile.mktemp()
     tmppng = tmpbase + '.png'
     tmptxt = tmpbase + '.txt'
@@ -115,24 +118,258 @@ def readpdf_image(pdf, first=None, last=None):
 
     return txt
 
+class PdfReader:
+    """One open PDF document, for its metadata and the text of its first pages.
+
+    The document is opened once (PyMuPDF), on first use, and pages are only read
+    as the text is consumed (see pages and head). Without PyMuPDF, the metadata
+    and pages are read with poppler-utils. Use as a context manager, or close():
+
+        with PdfReader(pdf) as reader:
+            doi = reader.metadata_doi() or parse_doi(reader.head())
+    """
+    def __init__(self, pdf, image=False):
+        if not os.path.isfile(pdf):
+            raise ValueError(repr(pdf) + ": not a file")
+        self.pdf = pdf
+        self.image = image
+        self._document = None
+
+    @property
+    def document(self):
+        "the fitz document (ImportError without PyMuPDF)"
+        if self._document is None:
+            import fitz
+            self._document = fitz.open(self.pdf)
+        return self._document
+
+    def close(self):
+        if self._document is not None:
+            self._document.close()
+            self._document = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def metadata_doi(self):
+        "DOI from the Info dictionary or the XMP metadata, or None"
+        # often found without opening the document
+        return parse_doi_from_pdf_metadata_mmap(self.pdf) or self.document_metadata_doi()
+
+    def document_metadata_doi(self):
+        "same as metadata_doi, from the opened document only (without scanning the file bytes)"
+        try:
+            document = self.document
+        except ImportError:
+            return parse_doi_from_pdf_metadata_poppler(self.pdf)
+        return _parse_doi_from_fitz_document(document)
+
+    def pages(self, maxpages=None):
+        "text of each page, read lazily, up to maxpages"
+        try:
+            count = len(self.document)
+        except ImportError:
+            yield from self._pages_poputils(maxpages)
+            return
+        if maxpages is not None:
+            count = min(count, maxpages)
+        if self.image:
+            # only the pages without a text layer are OCRed, several at a time
+            yield from ocr.page_texts(self.document, range(count))
+            return
+        for i in range(count):
+            logger.debug('read pdf page: '+str(i+1))
+            yield self.document.load_page(i).get_text()
+
+    def _pages_poputils(self, maxpages=None):
+        if not self.image:
+            logger.warning("PyMuPDF not installed, using pdftotext")
+        # pdftoppm fails past the last page
+        i = 0
+        while maxpages is None or i < maxpages:
+            i += 1
+            logger.debug('read pdf page: '+str(i))
+            if self.image:
+                yield readpdf_image_poputils(self.pdf, first=i, last=i)
+            else:
+                yield readpdf_poputils(self.pdf, first=i, last=i)
+
+    def head(self, maxpages=10, minwords=200):
+        "text of the first pages, until it has minwords words (see pdfhead)"
+        txt = ''
+        pages = self.pages(maxpages)
+        while len(txt.strip().split()) < minwords:
+            page = next(pages, None)
+            if page is None:
+                break
+            txt += page
+        return txt
+
+
 # CrossRef DOI standard: /^10.\d{4,9}/[-._;()/:A-Z0-9]+$/i
 REGEXP = re.compile(r'[doi,doi.org/][\s\.\:]{0,2}(10\.\d{4,9}/[-._;()/:a-z0-9]+)')
 ARXIV = re.compile(r'arxiv:\s*(\d{4}\.\d{4,5})')
 
+XMP_DOI_PATTERNS = [
+    r'<prism:doi>(10\.\d{4,9}/[-._;()/:a-z0-9]+)</prism:doi>',
+    r'<dc:identifier>doi:(10\.\d{4,9}/[-._;()/:a-z0-9]+)</dc:identifier>',
+    r'<pdfx:doi>(10\.\d{4,9}/[-._;()/:a-z0-9]+)</pdfx:doi>',
+    r'<crossmark:DOI>(10\.\d{4,9}/[-._;()/:a-z0-9]+)</crossmark:DOI>',
+]
+# same patterns, to search the bytes of the file
+_XMP_DOI_REGEXPS = [re.compile(pattern.encode(), re.IGNORECASE) for pattern in XMP_DOI_PATTERNS]
+_INFO_DOI = re.compile(r'10\.\d{4,9}/[-._;()/:a-z0-9]+', re.IGNORECASE)
+
 def _parse_doi_from_metadata_string(metadata):
     """Extract DOI from XMP metadata string."""
-    patterns = [
-        r'<prism:doi>(10\.\d{4,9}/[-._;()/:a-z0-9]+)</prism:doi>',
-        r'<dc:identifier>doi:(10\.\d{4,9}/[-._;()/:a-z0-9]+)</dc:identifier>',
-        r'<pdfx:doi>(10\.\d{4,9}/[-._;()/:a-z0-9]+)</pdfx:doi>',
-        r'<crossmark:DOI>(10\.\d{4,9}/[-._;()/:a-z0-9]+)</crossmark:DOI>',
-    ]
-    for pattern in patterns:
+    for pattern in XMP_DOI_PATTERNS:
         match = re.search(pattern, metadata, re.IGNORECASE)
         if match:
             return match.group(1)
     return None
 
+
+# the last trailer is at the very end; an object ends within METADATA_SCAN_BYTES of its offset
+TRAILER_SCAN_BYTES = 1024
+METADATA_SCAN_BYTES = 512 * 1024
+
+_STARTXREF = re.compile(rb'startxref\s+(\d+)')
+_XREF_SUBSECTION = re.compile(rb'\s*(\d+)[ \t]+(\d+)[ \t]*(?:\r\n|\r|\n)')
+_INFO_ENTRY = re.compile(rb'/(Subject|Keywords|Title)\s*(\((?:\\.|[^\\)])*\)|<[0-9a-fA-F\s]*>)', re.DOTALL)
+
+def _pdf_string(raw):
+    "value of a PDF literal (...) or hex <...> string"
+    if raw.startswith(b'<'):
+        data = bytes.fromhex(re.sub(rb'\s', b'', raw[1:-1]).decode('ascii'))
+    else:
+        escapes = {b'n': b'\n', b'r': b'\r', b't': b'\t', b'b': b'\b', b'f': b'\f'}
+        def unescape(match):
+            c = match.group(1)
+            if c[:1].isdigit():
+                return bytes([int(c, 8) & 0xff])
+            if c[:1] in b'\r\n':
+                return b''  # line continuation
+            return escapes.get(c, c)
+        data = re.sub(rb'\\([0-7]{1,3}|\r\n|.)', unescape, raw[1:-1], flags=re.DOTALL)
+    if data.startswith(b'\xfe\xff'):
+        return data[2:].decode('utf-16-be', errors='ignore')
+    return data.decode('latin-1')
+
+def _ref(dictionary, key):
+    "(number, generation) of an indirect reference in a dictionary, or None"
+    match = re.search(rb'/' + key + rb'\s*(\d+)\s+(\d+)\s+R', dictionary)
+    return (int(match.group(1)), int(match.group(2))) if match else None
+
+def _xref_sections(mm):
+    "[(offset, trailer dictionary)] of the cross-reference sections, the last one first"
+    match = None
+    for match in _STARTXREF.finditer(mm, max(0, len(mm) - TRAILER_SCAN_BYTES)):
+        pass
+    sections = []
+    offset = int(match.group(1)) if match else None
+    while offset is not None and offset < len(mm) and len(sections) < 100:
+        if mm[offset:offset+4] == b'xref':
+            start = mm.find(b'trailer', offset)
+            end = mm.find(b'startxref', start)
+        else:
+            # cross-reference stream: its dictionary is the trailer
+            start = offset
+            end = mm.find(b'stream', offset)
+        if start < 0 or end < 0:
+            break
+        sections.append((offset, mm[start:end]))
+        prev = re.search(rb'/Prev\s+(\d+)', sections[-1][1])
+        offset = int(prev.group(1)) if prev else None
+    return sections
+
+def _object_offset(mm, sections, ref):
+    "offset of an uncompressed object, or None"
+    header = re.compile(rb'\s*%d\s+%d\s+obj' % ref)
+    for offset, trailer in sections:
+        if mm[offset:offset+4] != b'xref':
+            break
+        pos = offset + 4
+        match = _XREF_SUBSECTION.match(mm, pos)
+        while match:
+            first, count = int(match.group(1)), int(match.group(2))
+            pos = match.end()
+            if first <= ref[0] < first + count:
+                entry = mm[pos + 20*(ref[0]-first):pos + 20*(ref[0]-first+1)]
+                if entry[17:18] == b'n' and header.match(mm, int(entry[:10])):
+                    return int(entry[:10])
+                break  # free, or not a standard table
+            match = _XREF_SUBSECTION.match(mm, pos + 20*count)
+    # cross-reference streams: the last definition in the file, unless in an object stream
+    start = mm.rfind(b'%d %d obj' % ref)
+    while start > 0 and mm[start-1:start].isdigit():
+        start = mm.rfind(b'%d %d obj' % ref, 0, start)
+    return start if start >= 0 else None
+
+def _object_dictionary(mm, sections, ref):
+    offset = _object_offset(mm, sections, ref)
+    if offset is None:
+        return None
+    end = mm.find(b'endobj', offset, offset + METADATA_SCAN_BYTES)
+    stream = mm.find(b'stream', offset, end)
+    return mm[offset:stream if stream >= 0 else end] if end >= 0 else None
+
+def _xmp_doi(mm, start, end):
+    for regexp in _XMP_DOI_REGEXPS:
+        match = regexp.search(mm, start, end)
+        if match:
+            return match.group(1).decode('ascii')
+
+def parse_doi_from_pdf_metadata_mmap(pdf_path):
+    """Extract DOI from the PDF metadata by reading the bytes of the file, without parsing it.
+
+    The Info dictionary (Subject, Keywords, Title) and the XMP packet are found from the
+    trailer and the cross-reference table, and the DOI patterns run directly on the
+    mapped file. Only uncompressed metadata of unencrypted files, with the catalog outside
+    of an object stream, can be read this way: return None otherwise, or if there is no DOI
+    (see parse_doi_from_pdf_metadata).
+    """
+    import mmap
+    with open(pdf_path, 'rb') as f:
+        try:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None  # empty file
+    with mm:
+        sections = _xref_sections(mm)
+        if not sections or b'/Encrypt' in sections[0][1]:
+            return None  # encrypted strings: left to fitz
+        trailer = sections[0][1]
+
+        info = None
+        if re.search(rb'/Info\s*<<', trailer):
+            info = trailer[trailer.index(b'/Info'):]
+        elif _ref(trailer, b'Info'):
+            info = _object_dictionary(mm, sections, _ref(trailer, b'Info'))
+        if info:
+            fields = {key.decode(): _pdf_string(value) for key, value in _INFO_ENTRY.findall(info)}
+            for key in ['Subject', 'Keywords', 'Title']:
+                match = _INFO_DOI.search(fields.get(key, ''))
+                if match:
+                    return match.group(0)
+
+        catalog = _object_dictionary(mm, sections, _ref(trailer, b'Root')) if _ref(trailer, b'Root') else None
+        if catalog is None:
+            # in an object stream (compressed): left to fitz, as any XMP packet found in the
+            # file may belong to an embedded image or form rather than to the document
+            return None
+        ref = _ref(catalog, b'Metadata')
+        offset = _object_offset(mm, sections, ref) if ref else None
+        if offset is None:
+            return None
+        stream = mm.find(b'stream', offset, offset + METADATA_SCAN_BYTES)
+        if stream < 0 or b'/Filter' in mm[offset:stream]:
+            return None  # compressed: left to fitz
+        return _xmp_doi(mm, stream, mm.find(b'endstream', stream))
+
+
 def parse_doi_from_pdf_metadata_poppler(pdf_path):
     """Extract DOI from PDF metadata using pdfinfo (poppler-utils)."""
     try:
@@ -149,28 +386,37 @@ def parse_doi_from_pdf_metadata_fitz(pdf_path):
     import fitz
 
     with fitz.open(pdf_path) as doc:
-        metadata = doc.metadata
-
-        # Try direct metadata fields first
-        if metadata:
-            # Check common metadata fields
-            for key in ['subject', 'keywords', 'title']:
-                value = metadata.get(key, '')
-                if value and '10.' in value:
-                    # Try to extract DOI from the field
-                    doi_match = re.search(r'10\.\d{4,9}/[-._;()/:a-z0-9]+', value, re.IGNORECASE)
-                    if doi_match:
-                        return doi_match.group(0)
-
-        # Fall back to XMP metadata
-        xmp = doc.get_xml_metadata() if hasattr(doc, 'get_xml_metadata') else doc.xref_get_key(-1, "Metadata")
-        if xmp:
-            xmp_str = xmp if isinstance(xmp, str) else xmp.decode('utf-8', errors='ignore')
-            return _parse_doi_from_metadata_string(xmp_str)
+        return _parse_doi_from_fitz_document(doc)
+
+
+def _parse_doi_from_fitz_document(doc):
+    """DOI from the metadata of an open fitz document (see parse_doi_from_pdf_metadata_fitz)"""
+    metadata = doc.metadata
+
+    # Try direct metadata fields first
+    if metadata:
+        # Check common metadata fields
+        for key in ['subject', 'keywords', 'title']:
+            value = metadata.get(key, '')
+            if value and '10.' in value:
+                # Try to extract DOI from the field
+                doi_match = re.search(r'10\.\d{4,9}/[-._;()/:a-z0-9]+', value, re.IGNORECASE)
+                if doi_match:
+                    return doi_match.group(0)
+
+    # Fall back to XMP metadata
+    xmp = doc.get_xml_metadata() if hasattr(doc, 'get_xml_metadata') else doc.xref_get_key(-1, "Metadata")
+    if xmp:
+        xmp_str = xmp if isinstance(xmp, str) else xmp.decode('utf-8', errors='ignore')
+        return _parse_doi_from_metadata_string(xmp_str)
 
 
 def parse_doi_from_pdf_metadata(pdf_path):
-    """Extract DOI from PDF metadata (tries fitz, falls back to poppler)."""
+    """Extract DOI from PDF metadata (scans the file bytes, then tries fitz, falls back to poppler)."""
+    doi = parse_doi_from_pdf_metadata_mmap(pdf_path)
+    if doi:
+        return doi
+
     # Try fitz first (no subprocess overhead)
 
     try:
@@ -302,30 +548,46 @@ def isvaliddoi(doi):
     return doi.lower() == doi2.lower()
 
 
-def pdfhead(pdf, maxpages=10, minwords=200, image=False):
+def readpdf_head(pdf, maxpages=10, minwords=200, image=False):
     """
-    read pdf header
+    read pdf header (not cached, see pdfhead)
     """
-    i = 0
-    txt = ''
-    while len(txt.strip().split()) < minwords and i < maxpages:
-        i += 1
-        logger.debug('read pdf page: '+str(i))
-        if image:
-            txt += readpdf_image(pdf, first=i, last=i)
-        else:
-            txt += readpdf(pdf, first=i, last=i)
-    return txt
+    with PdfReader(pdf, image=image) as reader:
+        return reader.head(maxpages, minwords)
+
 
+def _cached_head(reader, maxpages=10, minwords=200):
+    key = extractcache.settings_key('head', maxpages, minwords, reader.image)
+    return extractcache.cached_value(reader.pdf, key, lambda: reader.head(maxpages, minwords))
 
-def extract_pdf_doi(pdf, image=False):
-    # Try PDF metadata first (fast and reliable for many publishers)
-    metadata_doi = parse_doi_from_pdf_metadata(pdf)
-    if metadata_doi:
-        return metadata_doi
 
-    # Fall back to text extraction if metadata doesn't have DOI
-    return parse_doi(pdfhead(pdf, image=image))
+def pdfhead(pdf, maxpages=10, minwords=200, image=False):
+    """
+    read pdf header, from the extraction cache if the file was read before
+    """
+    with PdfReader(pdf, image=image) as reader:
+        return _cached_head(reader, maxpages, minwords)
+
+
+def extract_pdf_doi(pdf, image=False, maxpages=10, minwords=200):
+    with PdfReader(pdf, image=image) as reader:
+        # Try PDF metadata first (fast and reliable for many publishers): often found in the
+        # file bytes, faster than hashing the file for the cache
+        metadata_doi = (parse_doi_from_pdf_metadata_mmap(pdf)
+                        or extractcache.cached_value(pdf, 'metadata_doi', reader.document_metadata_doi))
+        if metadata_doi:
+            return metadata_doi
+
+        # Fall back to text extraction if metadata doesn't have DOI
+        def parsed_doi():
+            try:
+                return parse_doi(_cached_head(reader, maxpages, minwords))
+            except DOIParsingError:
+                return None  # cached as well
+        doi = extractcache.cached_value(pdf, extractcache.settings_key('doi', maxpages, minwords, image), parsed_doi)
+        if doi is None:
+            raise DOIParsingError('no DOI found in the first pages of '+pdf)
+        return doi
 
 
 def query_text(txt, max_query_words=200):
@@ -0,0 +1,154 @@
+"""Persistent cache of what is extracted from PDF files.
+
+Reading the first pages of a PDF (pdfhead), all the more with OCR (--image), and its
+metadata are the slow part of `papers extract`, `papers doi`, `filecheck --metadata-check`
+and `add --recursive`. The results are kept in CACHE_DIR, keyed by the sha256 of the
+file (see papers.checksums: an unchanged file is not hashed again), so that a file
+renamed or copied elsewhere is not read again either. For each file are stored:
+
+- `metadata_doi`: the DOI of the Info dictionary or XMP metadata, or None
+- `head:<maxpages>:<minwords>:<image>`: the text of the first pages with these settings
+- `doi:<maxpages>:<minwords>:<image>`: the DOI parsed from that text, or None
+
+Records are evicted least recently used first beyond CACHE_MAX_BYTES, and all of them
+when VERSION changes. See also `papers cache`.
+"""
+import os
+import json
+
+import papers.config
+from papers import logger
+from papers.config import CacheFile, cache_path, _read_cache_file
+from papers.checksums import file_checksum
+
+CACHE_FILE = 'extraction.json'
+# least recently used files beyond that size (JSON-encoded) are forgotten
+CACHE_MAX_BYTES = 20 * 2**20
+# bump when the extraction changes, to discard older records
+VERSION = 1
+
+
+class _ExtractionCache(CacheFile):
+    "{sha256 hex: {field: value}}, in a file that also holds VERSION"
+
+    def load(self, file):
+        data = _read_cache_file(file)
+        if data.get('version') != VERSION:
+            return {}
+        return data.get('records', {})
+
+    def dump(self, records):
+        return {'version': VERSION, 'records': records}
+
+    def merge(self, disk, ours):
+        # records written meanwhile by other processes are less recently used than ours
+        records = {key: record for key, record in disk.items() if key not in ours}
+        records.update(ours)
+        return _evict(records, CACHE_MAX_BYTES)
+
+
+_cache = _ExtractionCache(CACHE_FILE, 'extraction cache')
+
+
+def cache_file():
+    return cache_path(CACHE_FILE)
+
+
+def settings_key(field, maxpages, minwords, image):
+    "name of a field that depends on the extractor settings"
+    return f'{field}:{maxpages}:{minwords}:{int(bool(image))}'
+
+
+def _key(pdf):
+    try:
+        return file_checksum(pdf).hex()
+    except OSError:
+        return None  # the extractors report missing files
+
+
+def get(pdf, field):
+    "cached value of a field for a PDF file (KeyError if not cached)"
+    key = _key(pdf)
+    with _cache.lock:
+        records = _cache.records()
+        if key not in records or field not in records[key]:
+            raise KeyError(field)
+        # most recently used, written with the next new record: a hit alone does not rewrite the file
+        records[key] = records.pop(key)
+        logger.debug(f'load from extraction cache: {pdf} {field}')
+        return records[key][field]
+
+
+def put(pdf, field, value):
+    "store the value of a field for a PDF file"
+    key = _key(pdf)
+    if key is None:
+        return
+    with _cache.lock:
+        records = _cache.records()
+        record = records.pop(key, {})
+        record[field] = value
+        records[key] = record
+        _cache.dirty = True
+
+
+def cached_value(pdf, field, compute):
+    "value of a field for a PDF file, from the cache or compute() (then cached)"
+    try:
+        return get(pdf, field)
+    except KeyError:
+        pass
+    value = compute()
+    put(pdf, field, value)
+    return value
+
+
+def _size(item):
+    key, record = item
+    return len(key) + len(json.dumps(record)) + 6
+
+
+def _evict(records, max_bytes):
+    "keep the most recently used records within max_bytes"
+    kept = []
+    total = 0
+    for item in reversed(list(records.items())):
+        total += _size(item)
+        if total > max_bytes:
+            break
+        kept.append(item)
+    return dict(reversed(kept))
+
+
+def flush():
+    """Write the new records to the cache file (done at exit anyway)"""
+    _cache.flush()
+
+
+def stats():
+    "{'file', 'files' (PDF files), 'bytes', 'max_bytes', 'settings' (count per extractor settings)}"
+    with _cache.lock:
+        _cache.flush()
+        records = _cache.records()
+        settings = {}
+        for record in records.values():
+            for field in record:
+                if field.startswith('head:'):
+                    settings[field[5:]] = settings.get(field[5:], 0) + 1
+        return {'file': _cache.file, 'files': len(records),
+                'bytes': os.path.getsize(_cache.file) if os.path.exists(_cache.file) else 0,
+                'max_bytes': CACHE_MAX_BYTES, 'settings': settings}
+
+
+def prune(max_bytes=None):
+    """Evict the least recently used records beyond max_bytes (default CACHE_MAX_BYTES), or all
+    with max_bytes=0. Return the number of evicted files."""
+    if max_bytes is None:
+        max_bytes = CACHE_MAX_BYTES
+    with _cache.lock:
+        _cache.flush()
+        records = _cache.records()
+        kept = _evict(records, max_bytes)
+        if not papers.config.DRYRUN:
+            _cache.write(kept)
+        return len(records) - len(kept)
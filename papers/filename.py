@@ -3,7 +3,7 @@ Key and file name formatting
 """
 from slugify import slugify
 from papers.encoding import family_names
-from papers.entries import get_entry_val
+from papers.entries import get_entry_val, derived_field
 
 def listtag(words, maxlength=30, minwordlen=3, n=100, sep='-'):
     # preformat & filter words
@@ -28,6 +28,12 @@ UNKNOWN_YEAR = '0000'
 UNKNOWN_JOURNAL = None
 UNKNOWN_TITLE = ""
 
+def _author_slugs(entry):
+    return tuple(slugify(nm) for nm in family_names(get_entry_val(entry, "author", UNKNOWN_AUTHOR).lower()))
+
+def _title_slugs(entry):
+    return tuple(slugify(entry["title"]).split('-'))
+
 def make_template_fields(
     entry,
     author_num=2,
@@ -54,8 +60,7 @@ def make_template_fields(
     Each one of these needs a specific, explicit assignment below.
     """
     # names = bibtexparser.customization.getnames(entry.get('author','unknown').lower().split(' and '))
-    _names = family_names(get_entry_val(entry, "author", UNKNOWN_AUTHOR).lower())
-    _names = [slugify(nm) for nm in _names]
+    _names = derived_field(entry, "author_slugs", _author_slugs)
     author = author_sep.join([nm for nm in _names[:author_num]])
     Author = author_sep.join([nm.capitalize() for nm in _names[:author_num]])
     AuthorX = _cite_author([nm.capitalize() for nm in _names]).replace(" ", author_sep)
@@ -70,7 +75,7 @@ def make_template_fields(
         title = UNKNOWN_TITLE
         Title = UNKNOWN_TITLE
     else:
-        titlewords = slugify(entry["title"]).split('-')
+        titlewords = derived_field(entry, "title_slugs", _title_slugs)
         _titles = listtag(
             titlewords,
             n=title_word_num,
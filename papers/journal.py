@@ -0,0 +1,78 @@
+"""Journal of the changes made to a Biblio, e.g. by one command.
+
+Commands report the entries they added, modified or removed, and the backup
+with files saves a modified version of the library before going back to it.
+Instead of a deep copy of the whole Biblio, the journal keeps, for each entry,
+its type, its key and its list of fields as they were when it was opened.
+Fields are changed in papers by replacing them (entry[k] = v, del entry[k],
+set_field), not by modifying Field objects, so these are shared, not copied.
+"""
+from bibtexparser import Library
+from bibtexparser.model import Entry
+
+
+class Journal:
+    """Changes to the entries of biblio since the journal was opened"""
+
+    def __init__(self, biblio):
+        self.biblio = biblio
+        self._attrs = dict(vars(biblio))
+        self._blocks = list(biblio.db.blocks)
+        self._entries = [(e, e.entry_type, e.key, list(e.fields)) for e in self._blocks if isinstance(e, Entry)]
+
+    @staticmethod
+    def _content_changed(record):
+        e, entry_type, _, fields = record
+        return (e.entry_type != entry_type or len(e.fields) != len(fields)
+                or any(a is not b for a, b in zip(e.fields, fields)))
+
+    @staticmethod
+    def _before(record):
+        e, entry_type, key, fields = record
+        if e.entry_type == entry_type and e.key == key and not Journal._content_changed(record):
+            return e
+        return Entry(entry_type, key, list(fields))
+
+    def entries_before(self):
+        """The entries when the journal was opened (unchanged ones are the current entries)"""
+        return [self._before(record) for record in self._entries]
+
+    def records(self):
+        """The changes as a list of (action, before, after), where action is 'add',
+        'remove', 'rename' (new key) or 'modify' (type or fields), before is the entry as
+        it was (None if added) and after the current entry (None if removed)."""
+        current = {id(e): e for e in self.biblio.entries}
+        records = []
+        for record in self._entries:
+            e = record[0]
+            if current.pop(id(e), None) is None:
+                records.append(('remove', self._before(record), None))
+                continue
+            if e.key != record[2]:
+                records.append(('rename', self._before(record), e))
+            if self._content_changed(record):
+                records.append(('modify', self._before(record), e))
+        records.extend(('add', None, e) for e in current.values())
+        return records
+
+    def summary(self):
+        """One line per kind of change, e.g. for a commit message"""
+        names = {'add': 'Added', 'remove': 'Removed', 'rename': 'Renamed', 'modify': 'Modified'}
+        keys = {action: [] for action in names}
+        for action, before, after in self.records():
+            if action == 'rename':
+                keys[action].append(f'{before.key} -> {after.key}')
+            else:
+                keys[action].append((after or before).key)
+        return '\n'.join(f'{names[action]}: {", ".join(k)}' for action, k in keys.items() if k)
+
+    def undo(self):
+        """Bring biblio back to its state when the journal was opened: entries get their
+        type, key and fields back (in place), the library its blocks, and the Biblio its
+        attributes (files directory, tracking of the saved file...)."""
+        for e, entry_type, key, fields in self._entries:
+            e.entry_type = entry_type
+            e.key = key
+            e.fields = list(fields)
+        vars(self.biblio).update(self._attrs)
+        self.biblio.db = Library(self._blocks, fail_on_duplicate_key=False)
@@ -0,0 +1,117 @@
+"""Key index of a bibtex file, for random access to single entries.
+
+The index maps each entry key to the byte range of its block in the file,
+and is stored next to it (hidden file, like the .backup copy). It is written
+by Biblio.save from the layout of the text it just wrote, and is valid as
+long as the file size and mtime are unchanged. Readers must fall back to a
+normal parse when it is missing or stale.
+"""
+import os
+import json
+import mmap
+import locale
+
+from bibtexparser.model import Entry, String
+
+from papers import logger
+from papers.config import _write_cache_file
+from papers.entries import parse_string
+
+INDEX_VERSION = 1
+
+
+def index_file(bibtex):
+    return os.path.join(os.path.dirname(bibtex), '.'+os.path.basename(bibtex)+'.index')
+
+
+def _file_encoding():
+    # the encoding open() uses for the bibtex file (see Biblio.load and Biblio.save)
+    return locale.getpreferredencoding(False)
+
+
+def write_index(bibtex, content, blocks, layout):
+    """Index the bibtex file just written with content. layout is a list of
+    (state, start, end) parallel to blocks, in characters (see Biblio.save).
+    """
+    encoding = _file_encoding()
+    newline_extra = len(os.linesep) - 1  # text mode translates "\n" on write
+
+    if content.isascii() and not newline_extra:
+        nbytes = len
+    else:
+        def nbytes(text):
+            return len(text.encode(encoding)) + newline_extra * text.count('\n')
+
+    entries = {}
+    strings = []
+    cpos = bpos = 0
+    for block, (_, start, end) in zip(blocks, layout):
+        if not isinstance(block, (Entry, String)):
+            continue
+        bpos += nbytes(content[cpos:start])
+        bstart = bpos
+        bpos += nbytes(content[start:end])
+        cpos = end
+        if isinstance(block, String):
+            strings.append([bstart, bpos])
+        elif block.key not in entries:
+            entries[block.key] = [bstart, bpos]
+
+    st = os.stat(bibtex)
+    index = {
+        'version': INDEX_VERSION,
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'encoding': encoding,
+        'strings': strings,
+        'entries': entries,
+    }
+    try:
+        _write_cache_file(index, index_file(bibtex))
+    except OSError as error:
+        logger.debug(f'could not write key index for {bibtex}: {error}')
+
+
+def read_index(bibtex):
+    """Return the index of the bibtex file if it is up-to-date, else None"""
+    file = index_file(bibtex)
+    if not os.path.exists(file):
+        return None
+    try:
+        index = json.load(open(file))
+        st = os.stat(bibtex)
+        if (index['version'], index['size'], index['mtime_ns'], index['encoding']) != (INDEX_VERSION, st.st_size, st.st_mtime_ns, _file_encoding()):
+            logger.debug(f'stale key index: {file}')
+            return None
+    except (OSError, ValueError, KeyError, TypeError) as error:
+        logger.debug(f'unreadable key index {file}: {error}')
+        return None
+    return index
+
+
+def read_indexed_entries(bibtex, index, keys):
+    """Parse the entries for keys only (in file order), by mapping the bibtex file
+    in memory. Returns None if the index turns out not to match the file.
+    """
+    ranges = sorted((index['entries'][k], k) for k in keys)
+    if not ranges:
+        return []
+    encoding = index['encoding']
+    with open(bibtex, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        def read(start, end):
+            return mm[start:end].decode(encoding).replace('\r\n', '\n')
+        try:
+            # @string definitions, for references in the entries
+            strings = ''.join(read(start, end) + '\n' for start, end in index['strings'])
+            blocks = [(read(start, end), key) for (start, end), key in ranges]
+        except (ValueError, UnicodeDecodeError) as error:
+            logger.debug(f'key index does not match {bibtex}: {error}')
+            return None
+    entries = []
+    for text, key in blocks:
+        library = parse_string(strings + text)
+        if len(library.entries) != 1 or library.entries[0].key != key:
+            logger.debug(f'key index does not match {bibtex}')
+            return None
+        entries.append(library.entries[0])
+    return entries
@@ -0,0 +1,166 @@
+"""OCR of the pages of a PDF without a text layer (--image).
+
+Pages that have a text layer are read as such: only the others (scans) are OCRed.
+They are rendered in-process by PyMuPDF, then sent by batches of OCR_BATCH pages
+to tesseract, as one multi-page TIFF on its standard input: one tesseract call
+per batch and no temporary file. Batches are OCRed concurrently by up to
+OCR_JOBS tesseract processes (default: one per CPU), while the text is consumed
+in page order. As the first page is often enough to find a DOI, it is OCRed
+alone, and a further batch is only rendered when the consumer asks for the next
+page: one more batch per page consumed, up to OCR_JOBS batches ahead. pdfhead,
+which stops once it has enough words, thus does not OCR pages it will not read.
+"""
+import os
+import struct
+import itertools
+import collections
+import subprocess as sp
+from concurrent.futures import ThreadPoolExecutor
+
+from papers import logger
+
+# concurrent tesseract processes (None: one per CPU)
+OCR_JOBS = None
+# pages per tesseract call
+OCR_BATCH = 4
+OCR_DPI = 300
+OCR_LANG = 'eng'
+# pages with fewer words are considered to have no text layer
+OCR_MIN_WORDS = 10
+
+
+def has_text_layer(txt):
+    return len(txt.split()) >= OCR_MIN_WORDS
+
+
+def render_page(page, dpi=OCR_DPI):
+    "(width, height, 8-bit grayscale samples, dpi) of a fitz page"
+    import fitz
+    pixmap = page.get_pixmap(dpi=dpi, colorspace=fitz.csGRAY, alpha=False)
+    return pixmap.width, pixmap.height, pixmap.samples, dpi
+
+
+def multipage_tiff(images):
+    """Uncompressed, 8-bit grayscale, multi-page TIFF of [(width, height, samples, dpi)]"""
+    out = bytearray(b'II' + struct.pack('<HI', 42, 8))
+    for n, (width, height, samples, dpi) in enumerate(images):
+        tags = 12
+        rationals = len(out) + 2 + tags * 12 + 4
+        data = rationals + 16
+        end = data + len(samples) + len(samples) % 2  # IFD offsets are even
+        entries = [(256, 4, width), (257, 4, height), (258, 3, 8), (259, 3, 1), (262, 3, 1),
+                   (273, 4, data), (277, 3, 1), (278, 4, height), (279, 4, len(samples)),
+                   (282, 5, rationals), (283, 5, rationals + 8), (296, 3, 2)]
+        out += struct.pack('<H', tags)
+        for tag, typ, value in entries:
+            out += struct.pack('<HHIHH' if typ == 3 else '<HHII', tag, typ, 1, value, *([0] if typ == 3 else []))
+        out += struct.pack('<I', end if n < len(images) - 1 else 0)
+        out += struct.pack('<IIII', dpi, 1, dpi, 1)
+        out += samples
+        if len(samples) % 2:
+            out += b'\0'
+    return bytes(out)
+
+
+def tesseract(images, lang=OCR_LANG, threads=None):
+    """Text of each page image, OCRed by one tesseract call"""
+    cmd = ['tesseract', 'stdin', 'stdout', '-l', lang, 'quiet']
+    logger.info(' '.join(cmd) + f'  # {len(images)} page(s)')
+    env = None
+    if threads is not None:
+        # tesseract's own threads compete with the other tesseract processes
+        env = dict(os.environ, OMP_THREAD_LIMIT=str(threads))
+    txt = sp.run(cmd, input=multipage_tiff(images), stdout=sp.PIPE, check=True, env=env).stdout.decode('utf-8', errors='replace')
+    # pages are separated by form feeds
+    texts = txt.split('\f')[:len(images)]
+    if len(texts) < len(images):
+        texts = [txt] + [''] * (len(images) - 1)
+    return texts
+
+
+class _Batch:
+    def __init__(self):
+        self.pages = []
+        self.future = None
+
+
+def page_texts(document, pages=None, jobs=None, batch_size=None, dpi=OCR_DPI, lang=OCR_LANG):
+    """Text of the pages (0-based indices, default all) of a fitz document, in order, with OCR of
+    the pages without a text layer. Lazy: stop iterating to stop OCRing."""
+    jobs = jobs or OCR_JOBS or os.cpu_count() or 1
+    batch_size = batch_size or OCR_BATCH
+    pages = iter(range(len(document)) if pages is None else pages)
+    # the first page alone, then full batches
+    sizes = itertools.chain([1], itertools.repeat(batch_size))
+    size = next(sizes)
+    # planned pages: text, or (batch, index in batch)
+    slots = collections.deque()
+    queued = collections.deque()
+    filling = None
+    submitted = 0  # batches not consumed yet
+    exhausted = False
+    executor = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix='papers-ocr')
+
+    def submit(batch):
+        nonlocal submitted
+        # fitz is not thread-safe: rendered here, OCRed in the threads
+        images = [render_page(document.load_page(i), dpi) for i in batch.pages]
+        batch.future = executor.submit(tesseract, images, lang, 1 if jobs > 1 else None)
+        submitted += 1
+
+    def plan(done):
+        "read the pages ahead until done() or the last page, and batch those without a text layer"
+        nonlocal filling, size, exhausted
+        while not exhausted and not done():
+            i = next(pages, None)
+            if i is None:
+                exhausted = True
+                if filling is not None:
+                    queued.append(filling)
+                    filling = None
+                break
+            txt = document.load_page(i).get_text()
+            if has_text_layer(txt):
+                slots.append(txt)
+                continue
+            if filling is None:
+                filling = _Batch()
+            slots.append((filling, len(filling.pages)))
+            filling.pages.append(i)
+            if len(filling.pages) == size:
+                queued.append(filling)
+                filling, size = None, next(sizes)
+
+    # resumed by the consumer: more text is needed, one more batch may be OCRed ahead
+    resumed = False
+    try:
+        while True:
+            if resumed and submitted < jobs:
+                plan(lambda: queued)
+                if queued:
+                    submit(queued.popleft())
+            plan(lambda: slots)
+            if not slots:
+                break
+
+            slot = slots.popleft()
+            if isinstance(slot, str):
+                yield slot
+                resumed = True
+                continue
+            batch, i = slot
+            if batch.future is None:
+                # needed now: do not wait for the batch to be complete or a worker to be free
+                if batch is filling:
+                    filling = None
+                else:
+                    queued.remove(batch)
+                submit(batch)
+            texts = batch.future.result()
+            if i == len(batch.pages) - 1:
+                submitted -= 1
+            logger.debug(f'OCRed pdf page: {batch.pages[i]+1}')
+            yield texts[i]
+            resumed = True
+    finally:
+        executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,212 @@
+"""Staged extraction of PDF metadata, for add --recursive and extract.
+
+The metadata of a PDF is obtained in two steps of a different nature: reading
+its first pages (CPU bound, even more so with OCR) and querying crossref or
+google scholar with the DOI or the text found there (network bound).
+
+With jobs > 1 the pages are read by a pool of worker processes, and the queries
+are sent by a small pool of threads as soon as the text of a file is available.
+The results are handed back to the caller one at a time and in the order of the
+input files, so that the insertion into the library stays single-threaded and
+its outcome (keys, duplicates) does not depend on which worker is fastest.
+No more than `queue_size` files are in flight, whatever the number of files.
+Texts found in the extraction cache (papers.extractcache) are not read again.
+
+A file that takes more than `timeout` seconds to be read and queried, from the
+time a worker starts reading it, is reported as failed: its worker process is
+killed and replaced, so that one pathological PDF cannot stall the whole run.
+No more files than workers are handed to the process pool, so that a file does
+not wait in the pool's queue while its time runs.
+"""
+import os
+import time
+import threading
+import collections
+import multiprocessing
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from papers import logger
+from papers import extractcache
+from papers.extract import pdfhead, readpdf_head, extract_txt_metadata
+
+# threads sending metadata queries (crossref etiquette: keep it small)
+FETCH_JOBS = 4
+
+
+def _context():
+    # a fresh interpreter rather than a fork of a process that runs threads
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+
+
+def _init_worker(ocr_jobs):
+    # the CPUs are shared by the worker processes: as many tesseract processes in total
+    from papers import ocr
+    ocr.OCR_JOBS = ocr_jobs
+
+
+def _resolve(future, value=None, error=None):
+    # callbacks of a killed worker may race with its replacement: first wins
+    if future.done():
+        return
+    if error is not None:
+        future.set_exception(error)
+    else:
+        future.set_result(value)
+
+
+class _Task:
+    "one input file: its text (set from the process pool) and its query (thread pool)"
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.text = Future()
+        self.query = None
+        self.started = None  # time.monotonic() when its text was looked up or its reading started
+
+
+def extract_pdfs_metadata(pdfs, jobs=1, timeout=None, fetch_jobs=FETCH_JOBS, queue_size=None,
+                          search_doi=True, search_fulltext=True, maxpages=10, minwords=200, image=False, **kw):
+    """Metadata of several PDF files, as extract_pdf_metadata
+
+    Yield (pdf, bibtex, error) in the order of `pdfs`, where error is the exception
+    raised for that file (bibtex is None then), or None. With jobs=1 (the default) and
+    no timeout, the files are processed one after the other in the calling process.
+    jobs=0 means one worker process per CPU.
+    """
+    if jobs == 0:
+        jobs = os.cpu_count() or 1
+
+    if jobs == 1 and timeout is None:
+        for pdf in pdfs:
+            try:
+                txt = pdfhead(pdf, maxpages, minwords, image=image)
+                bibtex = extract_txt_metadata(txt, search_doi, search_fulltext, **kw)
+            except Exception as error:
+                yield pdf, None, error
+            else:
+                yield pdf, bibtex, None
+        return
+
+    if queue_size is None:
+        queue_size = 2 * (jobs + fetch_jobs)
+
+    ctx = _context()
+    ocr_jobs = max(1, (os.cpu_count() or 1) // jobs)
+    fetch = ThreadPoolExecutor(max_workers=fetch_jobs, thread_name_prefix='papers-fetch')
+    pool = ctx.Pool(jobs, _init_worker, (ocr_jobs,))
+    # the state below is shared with the pool's result thread, which calls on_text
+    lock = threading.Lock()
+    generation = 0  # of the pool: results of a killed pool are dropped
+    reading = 0  # files handed to the pool
+    waiting = collections.deque()  # files to be read when a worker is free
+
+    head = extractcache.settings_key('head', maxpages, minwords, image)
+
+    def query(task, txt):
+        task.query = fetch.submit(extract_txt_metadata, txt, search_doi, search_fulltext, **kw)
+        _resolve(task.text, txt)
+
+    def dispatch():
+        # under lock
+        nonlocal reading
+        while waiting and reading < jobs:
+            task = waiting.popleft()
+            reading += 1
+            task.started = time.monotonic()
+            pool.apply_async(readpdf_head, (task.pdf, maxpages, minwords, image),
+                             callback=lambda txt, task=task, gen=generation: on_text(gen, task, txt),
+                             error_callback=lambda error, task=task, gen=generation: on_text(gen, task, error=error))
+
+    def on_text(gen, task, txt=None, error=None):
+        # called in the pool's result thread: hand the text over to the query threads
+        nonlocal reading
+        with lock:
+            if gen != generation or task.text.done():
+                return  # late result of a killed pool: the file is read again
+            reading -= 1
+            dispatch()
+            if error is not None:
+                _resolve(task.text, error=error)
+                return
+            extractcache.put(task.pdf, head, txt)
+            query(task, txt)
+
+    def read(task):
+        # the extraction cache is only used from this process
+        try:
+            txt = extractcache.get(task.pdf, head)
+        except KeyError:
+            pass
+        else:
+            task.started = time.monotonic()
+            query(task, txt)
+            return
+        with lock:
+            waiting.append(task)
+            dispatch()
+
+    def restart(pending):
+        # the only way to stop a stuck worker is to kill the pool: resubmit the others
+        nonlocal pool, generation, reading, waiting
+        with lock:
+            generation += 1
+            old = pool
+        old.terminate()
+        old.join()
+        with lock:
+            pool = ctx.Pool(jobs, _init_worker, (ocr_jobs,))
+            reading = 0
+            waiting = collections.deque(task for task in pending if not task.text.done())
+            dispatch()
+
+    def remaining(task):
+        "seconds left for the task: its text and its query share the timeout"
+        if timeout is None:
+            return None
+        return max(0, task.started + timeout - time.monotonic())
+
+    def wait_text(task):
+        # files are handed to the pool in order: the task is being read, or will be once the
+        # pool's result thread has handed it over
+        while task.started is None:
+            try:
+                return task.text.result(timeout=0.05)
+            except FutureTimeoutError:
+                pass
+        return task.text.result(timeout=remaining(task))
+
+    pending = collections.deque()
+    pdfs = iter(pdfs)
+    try:
+        while True:
+            for pdf in pdfs:
+                task = _Task(pdf)
+                read(task)
+                pending.append(task)
+                if len(pending) >= queue_size:
+                    break
+            if not pending:
+                break
+
+            task = pending.popleft()
+            try:
+                try:
+                    wait_text(task)
+                except FutureTimeoutError:
+                    logger.debug(f'{task.pdf}: kill worker after {timeout} s')
+                    restart(pending)
+                    raise TimeoutError(f'could not read the PDF in {timeout} s') from None
+                try:
+                    bibtex = task.query.result(timeout=remaining(task))
+                except FutureTimeoutError:
+                    # a thread cannot be killed: the query is abandoned
+                    raise TimeoutError(f'no metadata in {timeout} s') from None
+            except Exception as error:
+                yield task.pdf, None, error
+            else:
+                yield task.pdf, bibtex, None
+
+    finally:
+        pool.terminate()
+        pool.join()
+        fetch.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,136 @@
+"""Persistent snapshots of parsed bibtex libraries.
+
+Parsing is the main start-up cost of every command on a large library. A
+snapshot pickles the parsed Library into CACHE_DIR, keyed by the bibtex path
+and validated against the file size, mtime and content hash and the papers
+version, so that loading an unchanged file skips bibtexparser altogether. Snapshots are a pure cache:
+any mismatch or read error falls back to a regular parse.
+"""
+import os
+import pickle
+import hashlib
+import tempfile
+import contextlib
+
+import bibtexparser
+
+import papers
+import papers.config
+from papers.config import cache_path
+from papers import logger
+from papers.entries import parse_string
+
+# bump whenever the pickled payload changes in an incompatible way
+SNAPSHOT_VERSION = 1
+# least recently written snapshots beyond that number are removed
+SNAPSHOT_MAX_FILES = 16
+
+
+def _snapshot_dir():
+    return cache_path('snapshots')
+
+
+def snapshot_file(bibtex):
+    """cache file holding the snapshot of a bibtex file (one per absolute path)"""
+    path = os.path.abspath(bibtex).encode('utf-8', 'surrogateescape')
+    return os.path.join(_snapshot_dir(), hashlib.sha256(path).hexdigest()[:16] + '.pickle')
+
+
+def content_hash(content):
+    """sha256 hex digest of the bibtex content (str)"""
+    return hashlib.sha256(content.encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+def _header(bibtex, content):
+    """what a snapshot must match to be valid for the current file"""
+    st = os.stat(bibtex)
+    return {
+        # papers' own version too: the duplicate index stored along depends on how
+        # entries are normalized (entry_id...), which may change with any release
+        'version': (SNAPSHOT_VERSION, papers.__version__, getattr(bibtexparser, '__version__', None)),
+        'path': os.path.abspath(bibtex),
+        'size': st.st_size,
+        'mtime_ns': st.st_mtime_ns,
+        'sha256': content_hash(content),
+    }
+
+
+def read_snapshot(bibtex, content):
+    """Return the snapshot payload (a dict with at least 'library') if it matches
+    the bibtex file, whose current content is passed as argument, else None.
+    """
+    file = snapshot_file(bibtex)
+    if not os.path.exists(file):
+        return None
+    try:
+        expected = _header(bibtex, content)
+        with open(file, 'rb') as f:
+            # the header is pickled separately, so that a stale snapshot
+            # is rejected without unpickling the whole library
+            if pickle.load(f) != expected:
+                logger.debug(f'stale library snapshot: {file}')
+                return None
+            payload = pickle.load(f)
+    except Exception as error:
+        logger.debug(f'unreadable library snapshot {file}: {error}')
+        return None
+    logger.debug(f'load library snapshot: {file}')
+    return payload
+
+
+def write_snapshot(bibtex, content, library, **payload):
+    """Store a snapshot of library, the parsed version of content (the bibtex
+    file as currently on disk). Additional keyword arguments are stored along.
+    Failures are logged and otherwise ignored.
+    """
+    if papers.config.DRYRUN:
+        return
+    file = snapshot_file(bibtex)
+    try:
+        header = _header(bibtex, content)
+        os.makedirs(os.path.dirname(file), exist_ok=True)
+        # atomic replace, so that a concurrent load never sees a partial file
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(file),
+                                   prefix=os.path.basename(file) + '.', suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(header, f, protocol=pickle.HIGHEST_PROTOCOL)
+                pickle.dump({'library': library, **payload}, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, file)
+        except BaseException:
+            with contextlib.suppress(OSError):
+                os.remove(tmp)
+            raise
+    except Exception as error:
+        logger.debug(f'could not write library snapshot {file}: {error}')
+        return
+    logger.debug(f'write library snapshot: {file}')
+    _prune_snapshots()
+
+
+def _prune_snapshots(max_files=None):
+    if max_files is None:
+        max_files = SNAPSHOT_MAX_FILES
+    direc = _snapshot_dir()
+    with contextlib.suppress(OSError):
+        files = [os.path.join(direc, f) for f in os.listdir(direc) if f.endswith('.pickle')]
+        if len(files) <= max_files:
+            return
+        files.sort(key=os.path.getmtime, reverse=True)
+        for f in files[max_files:]:
+            os.remove(f)
+
+
+def load_library(bibtex, content=None, jobs=1):
+    """Return the snapshot payload for a bibtex file (a dict with at least 'library',
+    the parsed Library), from its snapshot when valid, otherwise by parsing it
+    (with jobs processes, see parse_string) and writing a new snapshot.
+    """
+    if content is None:
+        content = open(bibtex).read()
+    payload = read_snapshot(bibtex, content)
+    if payload is not None:
+        return payload
+    payload = {'library': parse_string(content, jobs=jobs)}
+    write_snapshot(bibtex, content, payload['library'])
+    return payload
@@ -127,7 +127,8 @@ def move(f1, f2, copy=False, interactive=True, dryrun=False, hardlink=False):
 
     if os.path.exists(f2):
         # if identical file, pretend nothing happened, skip copying
-        if os.path.samefile(f1, f2) or checksum(f2) == checksum(f1):
+        from papers.checksums import same_content
+        if same_content(f1, f2):
             if not copy and not dryrun:
                 logger.info(f'{maybe}rm {f1}')
                 os.remove(f1)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Benchmark the FUZZY duplicate search (papers check --duplicates with --similarity FUZZY):
+groupby_equal (are_duplicates on every entry against every group) vs groupby_pairs on the pairs
+found by duplicate_pairs (rapidfuzz process.cdist if numpy is installed, process.extract otherwise).
+Entries are those of benchmark_duplicates.py (~10% injected duplicates).
+Usage:
+  python scripts/benchmark_batch_scoring.py [--counts 500 2000 5000] [--max-quadratic 1000]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark_duplicates import make_entries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--counts", type=int, nargs="+", default=[500, 2000, 5000])
+    parser.add_argument("--max-quadratic", type=int, default=1000, help="largest count to run groupby_equal on")
+    parser.add_argument("--workers", type=int, default=-1, help="rapidfuzz threads (-1: all CPUs)")
+    o = parser.parse_args()
+
+    from papers.bib import are_duplicates, duplicate_pairs, _numpy
+    from papers.duplicate import groupby_equal, groupby_pairs
+
+    eq = lambda a, b: are_duplicates(a, b, similarity="FUZZY")
+    print("numpy:", "yes (process.cdist)" if _numpy() else "no (process.extract)")
+
+    for count in o.counts:
+        entries = make_entries(count)
+        t0 = time.perf_counter()
+        groups = groupby_pairs(entries, duplicate_pairs(entries, "FUZZY", workers=o.workers))
+        new = time.perf_counter() - t0
+        ndup = sum(len(g) for _, g in groups if len(g) > 1)
+        line = f"{count} entries ({ndup} in duplicate groups): duplicate_pairs {new:.2f}s"
+        if count <= o.max_quadratic:
+            t0 = time.perf_counter()
+            expected = groupby_equal(entries, eq)
+            old = time.perf_counter() - t0
+            assert groups == expected, "groups differ"
+            line += f", groupby_equal {old:.2f}s, speedup {old/new:.0f}x"
+        print(line, flush=True)
+
+
+if __name__ == "__main__":
+    main()
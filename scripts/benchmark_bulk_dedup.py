@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Benchmark the non-interactive merge of duplicates (papers check --duplicates -m m) on a generated dump:
+blocked duplicate search, merge of each group (papers.duplicate.merge_duplicates) and library rebuild.
+Entries are those of benchmark_duplicates.py (~10% injected duplicates).
+Usage:
+  python scripts/benchmark_bulk_dedup.py [--counts 10000 100000] [--jobs 1 4] [--report report.json]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark_duplicates import make_entries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1], help="papers.config.JOBS values to compare")
+    parser.add_argument("--report", help="write the report of the last count to this file")
+    o = parser.parse_args()
+
+    import papers.config
+    from papers.bib import Biblio
+
+    for count, jobs in [(count, jobs) for count in o.counts for jobs in o.jobs]:
+        papers.config.JOBS = jobs
+        biblio = Biblio(similarity="PARTIAL")
+        entries = make_entries(count)
+        for i, e in enumerate(entries):
+            e.key = f"{e.key}-{i}"  # unique keys, as required by the library
+        t0 = time.perf_counter()
+        biblio.entries = entries
+        load = time.perf_counter() - t0
+        report = []
+        t0 = time.perf_counter()
+        biblio.check_duplicates(mode="m", report=report)
+        dedup = time.perf_counter() - t0
+        print(f"{count} entries, jobs={jobs} -> {len(biblio.entries)} ({len(report)} groups merged): "
+              f"library built in {load:.2f}s, check_duplicates -m m {dedup:.2f}s", flush=True)
+        if o.report:
+            json.dump(report, open(o.report, "w"), indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+#!/usr/bin/env python3
+"""
+Benchmark the comparison of attached files in merge_files (duplicate merging) with the checksum cache
+(papers.checksums): pairs of entries whose files are identical copies, or files of other sizes.
+Usage:
+  python scripts/benchmark_checksums.py [--pairs 200] [--size-mb 2]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--pairs", type=int, default=200)
+    parser.add_argument("--size-mb", type=float, default=2)
+    o = parser.parse_args()
+
+    import papers.config
+    import papers.checksums
+    from papers.duplicate import merge_files
+    from papers.entries import entry_from_dict
+    from papers.utils import checksum
+
+    with tempfile.TemporaryDirectory() as tmp:
+        papers.config.CACHE_DIR = os.path.join(tmp, "cache")
+        size = int(o.size_mb * 2**20)
+        pairs = []
+        for i in range(o.pairs):
+            data = os.urandom(size)
+            a, b = os.path.join(tmp, f"{i}a.pdf"), os.path.join(tmp, f"{i}b.pdf")
+            open(a, "wb").write(data)
+            # half of the pairs are copies, the others differ in size
+            open(b, "wb").write(data if i % 2 else data[:-1])
+            pairs.append([entry_from_dict({"ID": f"{i}{x}", "file": f":{f}:pdf"}) for x, f in zip("ab", (a, b))])
+
+        t0 = time.perf_counter()
+        for entries in pairs:
+            {checksum(e["file"].split(":")[1]) for e in entries}  # as before: every file hashed
+        before = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for entries in pairs:
+            merge_files(entries, relative_to=os.path.sep)
+        cold = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        for entries in pairs:
+            merge_files(entries, relative_to=os.path.sep)
+        warm = time.perf_counter() - t0
+        print(f"{o.pairs} pairs of {o.size_mb} MB files: hash all {before:.2f}s, "
+              f"merge_files {cold:.2f}s (empty cache), {warm:.2f}s (cached)")
+        papers.checksums.flush()
+
+
+if __name__ == "__main__":
+    main()
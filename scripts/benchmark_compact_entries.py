@@ -0,0 +1,59 @@
+#!/usr/bin/env python3
+"""
+Measure the memory held per entry (tracemalloc) by the entries of a library: bibtexparser Entry
+as parsed, vs papers.entries.CompactEntry (stream_biblio(compact=True), list --compact).
+Usage:
+  python scripts/benchmark_compact_entries.py [library.bib] [--count 10000]
+"""
+from __future__ import annotations
+
+import argparse
+import gc
+import subprocess
+import sys
+import tempfile
+import tracemalloc
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+
+def generate_bib(path: Path, count: int) -> Path:
+    gen = SCRIPT_DIR / "generate_dummy_bib.py"
+    subprocess.run([sys.executable, str(gen), "--count", str(count), "--out", str(path)], check=True,
+                   stdout=subprocess.DEVNULL)
+    return path
+
+
+def held_memory(load) -> tuple[int, list]:
+    """Bytes still allocated after load() returns (the returned entries)"""
+    gc.collect()
+    tracemalloc.start()
+    entries = load()
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return size, entries
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("bibtex", nargs="?", help="library to load (default: generated)")
+    parser.add_argument("--count", type=int, default=10000, help="entries of the generated library")
+    o = parser.parse_args()
+
+    from papers.entries import iter_entries, CompactEntry
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(o.bibtex) if o.bibtex else generate_bib(Path(tmp) / "dummy.bib", o.count)
+        full, entries = held_memory(lambda: list(iter_entries(path)))
+        n = len(entries)
+        del entries
+        compact, entries = held_memory(lambda: [CompactEntry.from_entry(e) for e in iter_entries(path)])
+        assert len(entries) == n
+
+    print(f"{n} entries: Entry {full/n:.0f} B/entry, CompactEntry {compact/n:.0f} B/entry, ratio {full/compact:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+#!/usr/bin/env python3
+"""
+Benchmark the derived-field cache (entry_id, author_id, title_id, fingerprints) on duplicate sweeps:
+the same sweep is repeated, with the values recomputed on every call (no cache) and with the
+values cached on the entries (papers.entries.derived_field).
+Entries are those of benchmark_duplicates.py (~10% injected duplicates).
+Usage:
+  python scripts/benchmark_derived_fields.py [--count 50000] [--repeat 3] [--fuzzy-count 1000]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark_duplicates import make_entries
+
+
+def _uncached(entry, name, compute):
+    return compute(entry)
+
+
+def sweeps(label, run, repeat):
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        run()
+        times.append(time.perf_counter() - t0)
+    print(f"{label}: " + ", ".join(f"{t:.2f}s" for t in times), flush=True)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=50000, help="entries for the PARTIAL sweep (groupby_blocks)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--fuzzy-count", type=int, default=1000, help="entries for the FUZZY sweep (groupby_equal), 0 to skip")
+    o = parser.parse_args()
+
+    from papers.bib import are_duplicates
+    from papers.duplicate import groupby_blocks, groupby_equal, duplicate_blocks
+
+    partial = lambda a, b: are_duplicates(a, b, similarity="PARTIAL")
+    fuzzy = lambda a, b: are_duplicates(a, b, similarity="FUZZY")
+
+    for cached in [False, True]:
+        label = "cached" if cached else "no cache"
+        patches = [] if cached else [mock.patch(f"papers.{m}.derived_field", _uncached) for m in ["entries", "duplicate"]]
+        for p in patches:
+            p.start()
+        try:
+            entries = make_entries(o.count)
+            sweeps(f"{o.count} entries, PARTIAL, {label}", lambda: groupby_blocks(entries, partial, duplicate_blocks), o.repeat)
+            if o.fuzzy_count:
+                entries = make_entries(o.fuzzy_count)
+                sweeps(f"{o.fuzzy_count} entries, FUZZY, {label}", lambda: groupby_equal(entries, fuzzy), 1)
+        finally:
+            for p in patches:
+                p.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark the duplicate search with an equality function (papers list --duplicates, check --duplicates):
+groupby_equal (every entry against every group) vs groupby_blocks (DOI and author+title blocking).
+Entries are generated with ~10% injected duplicates (same DOI, same author+title, exact copies).
+Usage:
+  python scripts/benchmark_duplicates.py [--counts 1000 10000 100000] [--max-quadratic 1000]
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+
+
+def make_entries(count: int, dup_rate: float = 0.1, seed: int = 0) -> list:
+    from papers.entries import entry_from_dict
+    rng = random.Random(seed)
+    dicts = []
+    for i in range(count):
+        if dicts and rng.random() < dup_rate:
+            d = dict(rng.choice(dicts))
+            d["ID"] = f"Dup{i}"
+            kind = rng.randrange(3)
+            if kind == 0:
+                d["title"] = f"Another title {i}"  # same DOI
+            elif kind == 1:
+                d.pop("doi", None)  # same author+title
+        else:
+            d = {"ENTRYTYPE": "article", "ID": f"Author{i}{1900 + i % 125}",
+                 "author": f"Author{i}, First and Second, Author{i % 97}",
+                 "title": f"Title of paper number {i} with some text",
+                 "year": str(1900 + i % 125)}
+            if rng.random() < 0.8:
+                d["doi"] = f"10.1000/dummy.{i}"
+        dicts.append(d)
+    return [entry_from_dict(d) for d in dicts]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--counts", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--max-quadratic", type=int, default=1000, help="largest count to run groupby_equal on")
+    o = parser.parse_args()
+
+    from papers.bib import are_duplicates
+    from papers.duplicate import groupby_equal, groupby_blocks, duplicate_blocks
+
+    eq = lambda a, b: are_duplicates(a, b, similarity="PARTIAL")
+
+    for count in o.counts:
+        entries = make_entries(count)
+        t0 = time.perf_counter()
+        groups = groupby_blocks(entries, eq, duplicate_blocks)
+        new = time.perf_counter() - t0
+        ndup = sum(len(g) for _, g in groups if len(g) > 1)
+        line = f"{count} entries ({ndup} in duplicate groups): groupby_blocks {new:.2f}s"
+        if count <= o.max_quadratic:
+            t0 = time.perf_counter()
+            expected = groupby_equal(entries, eq)
+            old = time.perf_counter() - t0
+            assert groups == expected, "groups differ"
+            line += f", groupby_equal {old:.2f}s, speedup {old/new:.0f}x"
+        print(line, flush=True)
+
+
+if __name__ == "__main__":
+    main()
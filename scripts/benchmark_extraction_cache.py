@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Benchmark the extraction cache (papers.extractcache) for extract_pdf_doi on a generated corpus
+of PDFs: first run (empty cache), then a new run that loads the cache file, as a new command would.
+Usage:
+  python scripts/benchmark_extraction_cache.py [--count 1000] [--pages 12] [--words 80]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from benchmark_pdf_extraction import make_corpus
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--words", type=int, default=80, help="words per page (200 words are read)")
+    o = parser.parse_args()
+
+    import papers.config
+    from papers import checksums, extractcache
+    from papers.extract import extract_pdf_doi
+
+    with tempfile.TemporaryDirectory() as tmp:
+        papers.config.CACHE_DIR = os.path.join(tmp, "cache")
+        files = make_corpus(tmp, o.count, o.pages, o.words)
+        for name in ["empty cache", "cached"]:
+            # as a new process: the cache files are read again
+            for module in (checksums, extractcache):
+                module.flush()
+                module._cache.reset()
+            t0 = time.perf_counter()
+            for file in files:
+                extract_pdf_doi(file)
+            extractcache.flush()
+            elapsed = time.perf_counter() - t0
+            print(f"{name}: {elapsed:.2f} s ({len(files)/elapsed:.0f} PDFs/s)")
+        print(f"cache file: {os.path.getsize(extractcache.cache_file()) / 2**20:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Benchmark format_library (papers' own serializer) against bibtexparser's writer
+(sort fields middleware + write_string, the previous implementation) on 10k and 50k entries.
+Usage:
+  python scripts/benchmark_format.py [--counts 10000 50000] [--rounds 3]
+"""
+from __future__ import annotations
+
+import argparse
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+
+def generate_bib(path: Path, count: int) -> Path:
+    gen = SCRIPT_DIR / "generate_dummy_bib.py"
+    subprocess.run([sys.executable, str(gen), "--count", str(count), "--out", str(path)], check=True,
+                   stdout=subprocess.DEVNULL)
+    return path
+
+
+def bibtexparser_format(library) -> str:
+    import bibtexparser
+    from bibtexparser.middlewares import SortFieldsAlphabeticallyMiddleware
+    from bibtexparser.writer import BibtexFormat
+    library = SortFieldsAlphabeticallyMiddleware().transform(library=library)
+    fmt = BibtexFormat()
+    fmt.indent = " "
+    fmt.block_separator = "\n"
+    return bibtexparser.write_string(library, bibtex_format=fmt)
+
+
+def timed(func, library, rounds: int) -> tuple[float, str]:
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        text = func(library)
+        best = min(best, time.perf_counter() - t0)
+    return best, text
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 50000])
+    parser.add_argument("--rounds", type=int, default=3)
+    o = parser.parse_args()
+
+    import logging
+    logging.getLogger("bibtexparser").setLevel(logging.ERROR)  # large library deep-copy warning
+    from papers.entries import parse_string, format_library
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in o.counts:
+            library = parse_string(generate_bib(Path(tmp) / f"dummy{count}.bib", count).read_text())
+            old, old_text = timed(bibtexparser_format, library, o.rounds)
+            new, new_text = timed(format_library, library, o.rounds)
+            assert new_text == old_text, "output differs"
+            print(f"{count} entries: bibtexparser {old:.2f}s, format_library {new:.2f}s, speedup {old/new:.1f}x", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Measure the recall and speed of papers.duplicate.DuplicateIndex for FUZZY similarity on insert,
+against a full scan of the library (the previous behaviour), on a synthetic corpus where some
+queries are fuzzy duplicates (title words dropped or added, DOI missing).
+Usage:
+  python scripts/benchmark_fuzzy_index.py [--counts 2000 10000] [--queries 100]
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import time
+
+SURNAMES = ["Smith", "Doe", "Perrette", "Müller", "Garcia", "Wang", "Li", "Nguyen", "Kowalski", "Dubois"]
+
+
+def make_corpus(count: int, queries: int, seed: int = 0) -> tuple[list, list]:
+    from papers.entries import entry_from_dict
+    rng = random.Random(seed)
+    vocab = [f"word{i}" for i in range(3000)] + ["the", "of", "and", "in", "a", "on", "for"] * 50
+    library = []
+    for i in range(count):
+        authors = " and ".join(f"{rng.choice(SURNAMES)}{rng.randrange(500)}, A." for _ in range(rng.randrange(1, 4)))
+        d = {"ENTRYTYPE": "article", "ID": f"key{i}", "author": authors,
+             "title": " ".join(rng.choice(vocab) for _ in range(rng.randrange(4, 12)))}
+        if rng.random() < 0.7:
+            d["doi"] = f"10.1000/{i}"
+        library.append(d)
+    new = []
+    for i in range(queries):
+        if rng.random() < 0.5:
+            d = dict(rng.choice(library))
+            d.pop("doi", None)
+            words = d["title"].split()
+            if rng.random() < 0.5:
+                words = words[:max(1, len(words) - rng.randrange(1, 3))]  # subset
+            else:
+                words = words + [rng.choice(vocab)]  # superset
+            d["title"] = " ".join(words)
+        else:
+            d = {"ENTRYTYPE": "article", "author": f"{rng.choice(SURNAMES)}{rng.randrange(500)}, B.",
+                 "title": " ".join(rng.choice(vocab) for _ in range(rng.randrange(4, 12)))}
+        d["ID"] = f"new{i}"
+        new.append(d)
+    return [entry_from_dict(d) for d in library], [entry_from_dict(d) for d in new]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--counts", type=int, nargs="+", default=[2000, 10000])
+    parser.add_argument("--queries", type=int, default=100)
+    o = parser.parse_args()
+
+    from papers.bib import are_duplicates
+    from papers.duplicate import DuplicateIndex
+
+    eq = lambda a, b: are_duplicates(a, b, similarity="FUZZY")
+
+    for count in o.counts:
+        library, new = make_corpus(count, o.queries)
+        t0 = time.perf_counter()
+        index = DuplicateIndex(library, fuzzy=True)
+        build = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        expected = [[e for e in library if eq(e, q)] for q in new]
+        scan = time.perf_counter() - t0
+
+        t0 = time.perf_counter()
+        candidates = [index.candidates(q) for q in new]
+        found = [[e for e in c if eq(e, q)] for c, q in zip(candidates, new)]
+        indexed = time.perf_counter() - t0
+
+        pairs = sum(len(x) for x in expected)
+        hits = sum(len({id(e) for e in f} & {id(e) for e in x}) for f, x in zip(found, expected))
+        mean = sum(len(c) for c in candidates) / len(candidates)
+        print(f"{count} entries, {len(new)} inserts: recall {hits}/{pairs} ({100*hits/max(pairs, 1):.1f}%), "
+              f"{mean:.1f} candidates/insert (max {max(len(c) for c in candidates)}); "
+              f"full scan {1000*scan/len(new):.1f} ms/insert, index {1000*indexed/len(new):.2f} ms/insert "
+              f"(build {build:.2f}s)", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+"""
+Benchmark papers merge (Biblio.merge_entries) against papers add (Biblio.add_bibtex with check_duplicate)
+on two generated libraries sharing half of their entries (those of benchmark_duplicates.py).
+Usage:
+  python scripts/benchmark_merge.py [--counts 10000 100000] [--skip-add]
+"""
+from __future__ import annotations
+
+import argparse
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from benchmark_duplicates import make_entries
+
+
+def libraries(count):
+    first = make_entries(count, seed=0)
+    second = make_entries(count, seed=0)[count // 2:] + make_entries(count // 2, seed=1)
+    for i, e in enumerate(first):
+        e.key = f"a{i}"
+    for i, e in enumerate(second):
+        e.key = f"b{i}"
+    return first, second
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 100000])
+    parser.add_argument("--skip-add", action="store_true", help="only time papers merge")
+    o = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    from papers.bib import Biblio
+    from papers.entries import format_library, library_from_entries, parse_string
+
+    for count in o.counts:
+        first, second = libraries(count)
+        text = format_library(library_from_entries(second))
+
+        biblio = Biblio()
+        biblio.entries = first
+        t0 = time.perf_counter()
+        counts = biblio.merge_entries(parse_string(text).entries, on_conflict="s")
+        merge = time.perf_counter() - t0
+        print(f"{count} x {count} entries -> {len(biblio.entries)} {counts}: merge {merge:.2f}s", flush=True)
+
+        if not o.skip_add:
+            biblio = Biblio()
+            biblio.entries = libraries(count)[0]
+            t0 = time.perf_counter()
+            biblio.add_bibtex(text, check_duplicate=True, on_conflict="s", update_key=True)
+            print(f"{count} x {count} entries -> {len(biblio.entries)}: add {time.perf_counter() - t0:.2f}s", flush=True)
+
+
+if __name__ == "__main__":
+    main()
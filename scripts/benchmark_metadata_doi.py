@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Report the hit rate and latency of the byte-scanning metadata DOI path
+(papers.extract.parse_doi_from_pdf_metadata_mmap) against fitz, on tests/downloadedpapers and on
+a synthetic corpus mixing the ways publishers store the DOI (XMP, Info dictionary, compressed
+object streams, encryption, none), and the latency of extract_pdf_doi end to end, with an empty
+and a loaded extraction cache.
+Usage:
+  python scripts/benchmark_metadata_doi.py [--count 500] [--pages 10] [--kb 0]
+"""
+from __future__ import annotations
+
+import argparse
+import glob
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+WORDS = "ocean ice bloom arctic carbon model flux satellite chlorophyll season edge sea".split()
+KINDS = ["xmp", "info", "compressed", "encrypted", "none"]
+
+
+def make_corpus(direc, count, pages, kb=0, seed=0):
+    import fitz
+    rng = random.Random(seed)
+    files = []
+    for i in range(count):
+        kind = KINDS[i % len(KINDS)]
+        doi = f"10.5194/bg-{i}-515-2011"
+        doc = fitz.open()
+        for p in range(pages):
+            doc.new_page().insert_textbox(fitz.Rect(50, 50, 550, 800), " ".join(rng.choice(WORDS) for _ in range(300)))
+        if kb:
+            # noise does not compress: a figure of about kb kB
+            side = int((kb * 1024 / 3) ** 0.5)
+            noise = fitz.Pixmap(fitz.csRGB, side, side, rng.randbytes(side * side * 3), 0)
+            doc[0].insert_image(fitz.Rect(50, 600, 250, 800), pixmap=noise)
+        save = {}
+        if kind in ("xmp", "compressed"):
+            doc.set_xml_metadata('<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF><rdf:Description>'
+                                 f'<prism:doi>{doi}</prism:doi></rdf:Description></rdf:RDF></x:xmpmeta>')
+        if kind == "compressed":
+            # flate-compressed XMP stream and Info dictionary in an object stream
+            xref = int(doc.xref_get_key(doc.pdf_catalog(), "Metadata")[1].split()[0])
+            doc.update_stream(xref, doc.xref_stream(xref), compress=True)
+            doc.set_metadata({"title": "compressed"})
+            save = dict(garbage=1, use_objstms=1)
+        if kind in ("info", "encrypted"):
+            doc.set_metadata({"subject": f"Biogeosciences, doi:{doi}"})
+        if kind == "encrypted":
+            save = dict(encryption=fitz.PDF_ENCRYPT_AES_256, owner_pw="owner", user_pw="")
+        file = os.path.join(direc, f"{i}-{kind}.pdf")
+        doc.save(file, **save)
+        files.append(file)
+    return files
+
+
+def extract_doi(file):
+    from papers.extract import extract_pdf_doi
+    try:
+        return extract_pdf_doi(file)
+    except ValueError:
+        return None  # no DOI in the text either
+
+
+def report(name, files, cache_dir):
+    import papers.config
+    from papers import checksums, extractcache
+    from papers.extract import (parse_doi_from_pdf_metadata_mmap, parse_doi_from_pdf_metadata_fitz,
+                                parse_doi_from_pdf_metadata)
+    timings = {}
+    results = {}
+    repeat = max(1, 100 // len(files))
+    for label, fun in [("mmap", parse_doi_from_pdf_metadata_mmap), ("fitz", parse_doi_from_pdf_metadata_fitz),
+                       ("mmap, then fitz", parse_doi_from_pdf_metadata)]:
+        fun(files[0])  # warm-up
+        t0 = time.perf_counter()
+        for _ in range(repeat):
+            results[label] = [fun(file) for file in files]
+        timings[label] = (time.perf_counter() - t0) / len(files) / repeat
+    # end to end: file checksums and extracted text cached, as in papers extract or papers add
+    elapsed = 0
+    for i in range(repeat):
+        papers.config.CACHE_DIR = os.path.join(cache_dir, f"{name}-{i}")
+        for module in (checksums, extractcache):
+            module._cache.reset()
+        t0 = time.perf_counter()
+        for file in files:
+            extract_doi(file)
+        elapsed += time.perf_counter() - t0
+    timings["extract_pdf_doi, empty cache"] = elapsed / len(files) / repeat
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        for file in files:
+            extract_doi(file)
+    timings["extract_pdf_doi, cached"] = (time.perf_counter() - t0) / len(files) / repeat
+    with_doi = [i for i, doi in enumerate(results["fitz"]) if doi]
+    hits = [i for i in with_doi if results["mmap"][i] == results["fitz"][i]]
+    wrong = [files[i] for i, doi in enumerate(results["mmap"]) if doi and doi != results["fitz"][i]]
+    size = sum(os.path.getsize(file) for file in files) / len(files)
+    print(f"{name}: {len(files)} PDFs of {size / 1024:.0f} kB, {len(with_doi)} with a metadata DOI (fitz)")
+    print(f"  fast path hit rate: {len(hits)}/{len(with_doi)}" + (f", {len(wrong)} different from fitz: {wrong}" if wrong else ""))
+    for label, seconds in timings.items():
+        print(f"  {label}: {seconds*1000:.3f} ms/PDF")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=500)
+    parser.add_argument("--pages", type=int, default=10)
+    parser.add_argument("--kb", type=int, default=0, help="random image data per PDF, as the figures of a paper")
+    o = parser.parse_args()
+
+    import papers.config
+    papers.config.DRYRUN = True  # the caches stay in memory
+
+    testdir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "tests", "downloadedpapers")
+    with tempfile.TemporaryDirectory() as tmp:
+        report("tests/downloadedpapers", sorted(glob.glob(os.path.join(testdir, "*.pdf"))), tmp)
+        files = make_corpus(tmp, o.count, o.pages, o.kb)
+        report("synthetic", files, tmp)
+        for kind in KINDS:
+            report(f"synthetic ({kind})", [f for f in files if f.endswith(f"-{kind}.pdf")], tmp)
+
+
+if __name__ == "__main__":
+    main()
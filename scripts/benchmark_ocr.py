@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark the OCR of scanned PDFs (papers.ocr.page_texts, as used by --image) against one tesseract
+call per page with a temporary PNG, as readpdf_image did. Without --tesseract, a stand-in tesseract
+is put on the PATH: it spends --page-cpu seconds of CPU per page and --startup seconds per call.
+Usage:
+  python scripts/benchmark_ocr.py [--count 20] [--pages 4] [--jobs 1 2 4] [--tesseract]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess as sp
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+FAKE_TESSERACT = '''#!{python}
+import struct, sys, time
+def burn(seconds):
+    end = time.process_time() + seconds
+    while time.process_time() < end:
+        pass
+data = sys.stdin.buffer.read() if sys.argv[1] == 'stdin' else open(sys.argv[1], 'rb').read()
+pages = 1
+if data[:2] == b'II':
+    pages, ifd = 0, struct.unpack('<I', data[4:8])[0]
+    while ifd:
+        pages += 1
+        count = struct.unpack('<H', data[ifd:ifd+2])[0]
+        ifd = struct.unpack('<I', data[ifd+2+12*count:ifd+6+12*count])[0]
+burn({startup})
+text = []
+for i in range(pages):
+    burn({page_cpu})
+    text.append('scanned text ' * 100 + '\\f')
+if sys.argv[2] == 'stdout':
+    sys.stdout.write(''.join(text))
+else:
+    open(sys.argv[2] + '.txt', 'w').write(''.join(text))
+'''
+
+
+def make_scans(direc, count, pages):
+    import fitz
+    files = []
+    for i in range(count):
+        doc = fitz.open()
+        for p in range(pages):
+            page = doc.new_page()
+            page.draw_rect(fitz.Rect(50, 50 + p, 550, 800), color=(0, 0, 0))  # no text layer
+        file = os.path.join(direc, f"{i}.pdf")
+        doc.save(file)
+        files.append(file)
+    return files
+
+
+def legacy_ocr(pdf):
+    # one rendering to a temporary PNG and one tesseract call per page (pdftoppm replaced by PyMuPDF)
+    import fitz
+    txt = ''
+    with fitz.open(pdf) as doc:
+        for page in doc:
+            tmpbase = tempfile.mktemp()
+            page.get_pixmap(dpi=300).save(tmpbase + '.png')
+            sp.check_call(["tesseract", tmpbase + '.png', tmpbase, "-l", "eng", "quiet"])
+            txt += open(tmpbase + '.txt').read()
+            os.remove(tmpbase + '.png')
+            os.remove(tmpbase + '.txt')
+    return txt
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=20)
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--tesseract", action="store_true", help="use the installed tesseract")
+    parser.add_argument("--page-cpu", type=float, default=0.5)
+    parser.add_argument("--startup", type=float, default=0.15)
+    o = parser.parse_args()
+
+    import fitz
+    from papers import ocr
+
+    with tempfile.TemporaryDirectory() as tmp:
+        if not o.tesseract:
+            bindir = os.path.join(tmp, "bin")
+            os.makedirs(bindir)
+            script = os.path.join(bindir, "tesseract")
+            open(script, "w").write(FAKE_TESSERACT.format(python=sys.executable, startup=o.startup, page_cpu=o.page_cpu))
+            os.chmod(script, 0o755)
+            os.environ["PATH"] = bindir + os.pathsep + os.environ["PATH"]
+        files = make_scans(tmp, o.count, o.pages)
+        pages = o.count * o.pages
+
+        t0 = time.perf_counter()
+        for file in files:
+            legacy_ocr(file)
+        elapsed = time.perf_counter() - t0
+        print(f"one call per page: {elapsed:.2f} s ({pages/elapsed:.2f} pages/s)")
+
+        for jobs in o.jobs:
+            t0 = time.perf_counter()
+            for file in files:
+                with fitz.open(file) as doc:
+                    list(ocr.page_texts(doc, jobs=jobs))
+            elapsed = time.perf_counter() - t0
+            print(f"page_texts jobs={jobs}: {elapsed:.2f} s ({pages/elapsed:.2f} pages/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Benchmark parallel parsing of large .bib files (papers.entries.parse_string_parallel)
+with 1/2/4/8 workers against the serial parse, on 10k-200k entries.
+Usage:
+  python scripts/benchmark_parallel_parse.py [--counts 10000 50000 200000] [--jobs 1 2 4 8] [--rounds 1]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+
+
+def generate_bib(path: Path, count: int) -> Path:
+    gen = SCRIPT_DIR / "generate_dummy_bib.py"
+    subprocess.run([sys.executable, str(gen), "--count", str(count), "--out", str(path)], check=True,
+                   stdout=subprocess.DEVNULL)
+    return path
+
+
+def timed(func, text: str, rounds: int, **kw) -> float:
+    best = float("inf")
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        func(text, **kw)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--counts", type=int, nargs="+", default=[10000, 50000, 200000])
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--rounds", type=int, default=1)
+    o = parser.parse_args()
+
+    from papers.entries import parse_string, parse_string_parallel
+
+    print(f"CPUs: {os.cpu_count()}", flush=True)
+    with tempfile.TemporaryDirectory() as tmp:
+        for count in o.counts:
+            text = generate_bib(Path(tmp) / f"dummy{count}.bib", count).read_text()
+            serial = timed(parse_string, text, o.rounds)
+            print(f"{count} entries ({len(text)/1024/1024:.1f} MB): serial {serial:.2f}s", flush=True)
+            for jobs in o.jobs:
+                elapsed = timed(parse_string_parallel, text, o.rounds, jobs=jobs)
+                print(f"  jobs={jobs}: {elapsed:.2f}s, speedup {serial/elapsed:.2f}x", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+"""
+Benchmark page-1 DOI extraction (papers.extract.extract_pdf_doi) on a generated corpus of PDFs:
+one PdfReader per file (document opened once, pages read until minwords) against the former
+pdfhead, which opened the document again for each page and for the metadata.
+Usage:
+  python scripts/benchmark_pdf_extraction.py [--count 1000] [--pages 12] [--words 80]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+WORDS = "ocean ice bloom arctic carbon model flux satellite chlorophyll season edge sea".split()
+
+
+def make_corpus(direc, count, pages, words, seed=0):
+    import fitz
+    rng = random.Random(seed)
+    files = []
+    for i in range(count):
+        doc = fitz.open()
+        for p in range(pages):
+            page = doc.new_page()
+            text = " ".join(rng.choice(WORDS) for _ in range(words))
+            if p == 0:
+                text = f"Biogeosciences, doi:10.5194/bg-{i}-515-2011\n" + text
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800), text)
+        file = os.path.join(direc, f"{i}.pdf")
+        doc.save(file)
+        files.append(file)
+    return files
+
+
+def _legacy_readpdf(pdf_path, first=None, last=None):
+    # papers.extract.readpdf_fitz before PdfReader: opened for each call, all pages visited
+    import fitz
+    document = fitz.open(pdf_path)
+    text = ""
+    for page_num in range(len(document)):
+        if first is not None and page_num+1 < first:
+            continue
+        elif last is not None and page_num+1 > last:
+            continue
+        text += document.load_page(page_num).get_text()
+    return text
+
+
+def _legacy_extract_pdf_doi(pdf, maxpages=10, minwords=200):
+    from papers.extract import parse_doi, parse_doi_from_pdf_metadata
+    doi = parse_doi_from_pdf_metadata(pdf)
+    if doi:
+        return doi
+    i = 0
+    txt = ''
+    while len(txt.strip().split()) < minwords and i < maxpages:
+        i += 1
+        txt += _legacy_readpdf(pdf, first=i, last=i)
+    return parse_doi(txt)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--words", type=int, default=80, help="words per page (200 words are read)")
+    o = parser.parse_args()
+
+    from papers.extract import extract_pdf_doi
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = make_corpus(tmp, o.count, o.pages, o.words)
+        for name, extract in [("before", _legacy_extract_pdf_doi), ("PdfReader", extract_pdf_doi)]:
+            t0 = time.perf_counter()
+            dois = [extract(f) for f in files]
+            elapsed = time.perf_counter() - t0
+            assert dois == [f"10.5194/bg-{i}-515-2011" for i in range(o.count)], dois[:3]
+            print(f"{name}: {o.count} PDFs of {o.pages} pages in {elapsed:.2f}s ({o.count / elapsed:.0f} PDFs/s)", flush=True)
+
+
+if __name__ == "__main__":
+    main()
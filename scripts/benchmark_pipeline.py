@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""
+Benchmark papers.pipeline.extract_pdfs_metadata (as used by add --recursive and extract) on
+a generated corpus of PDFs, with the DOI query replaced by a fixed network latency.
+Usage:
+  python scripts/benchmark_pipeline.py [--count 200] [--latency 0.2] [--jobs 1 2 4]
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from benchmark_pdf_extraction import make_corpus
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--count", type=int, default=200)
+    parser.add_argument("--pages", type=int, default=12)
+    parser.add_argument("--words", type=int, default=80, help="words per page (200 words are read)")
+    parser.add_argument("--latency", type=float, default=0.2, help="seconds per DOI query")
+    parser.add_argument("--jobs", type=int, nargs="+", default=[1, 2, 4])
+    o = parser.parse_args()
+
+    from papers.pipeline import extract_pdfs_metadata
+
+    def fetch(doi):
+        time.sleep(o.latency)
+        return "@article{key, doi = {%s}}" % doi
+
+    with tempfile.TemporaryDirectory() as tmp:
+        files = make_corpus(tmp, o.count, o.pages, o.words)
+        with mock.patch("papers.extract.fetch_bibtex_by_doi", fetch):
+            for jobs in o.jobs:
+                t0 = time.perf_counter()
+                results = list(extract_pdfs_metadata(files, jobs=jobs))
+                elapsed = time.perf_counter() - t0
+                failed = sum(error is not None for pdf, bibtex, error in results)
+                print(f"jobs={jobs}: {elapsed:.2f} s ({len(files)/elapsed:.1f} PDFs/s, {failed} failed)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""
+Benchmark Biblio.load on a large .bib: cold (parse + write snapshot) vs warm
+(load from the persistent snapshot in the cache directory).
+Usage:
+  python scripts/benchmark_snapshot_load.py [dummy_library.bib] [--rounds 3]
+  python scripts/benchmark_snapshot_load.py  # generates dummy if needed
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+SCRIPT_DIR = Path(__file__).resolve().parent
+REPO_ROOT = SCRIPT_DIR.parent
+DEFAULT_BIB = REPO_ROOT / "dummy_library.bib"
+
+
+def ensure_dummy_bib(path: Path, count: int = 11470) -> Path:
+    if path.exists():
+        return path
+    gen = SCRIPT_DIR / "generate_dummy_bib.py"
+    if not gen.exists():
+        raise SystemExit(f"Bib not found: {path}. Run: python scripts/generate_dummy_bib.py --out {path}")
+    import subprocess
+    subprocess.run([sys.executable, str(gen), "--count", str(count), "--out", str(path)], check=True)
+    return path
+
+
+def timed_load(bib_path: Path) -> tuple[float, int]:
+    from papers.bib import Biblio
+    t0 = time.perf_counter()
+    biblio = Biblio.load(str(bib_path), "")
+    return time.perf_counter() - t0, len(biblio.entries)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("bib", nargs="?", type=Path, default=DEFAULT_BIB)
+    parser.add_argument("--rounds", type=int, default=3)
+    o = parser.parse_args()
+
+    bib_path = ensure_dummy_bib(o.bib)
+    print(f"Bib: {bib_path}, size: {bib_path.stat().st_size/1024/1024:.2f} MB", flush=True)
+
+    import papers.config
+    import papers.snapshot
+
+    # a throw-away cache directory, so that user snapshots are left alone
+    with tempfile.TemporaryDirectory() as cache_dir:
+        papers.config.CACHE_DIR = cache_dir
+        cold, warm = [], []
+        for i in range(o.rounds):
+            snapshot = papers.snapshot.snapshot_file(str(bib_path))
+            if os.path.exists(snapshot):
+                os.remove(snapshot)
+            elapsed, n = timed_load(bib_path)
+            cold.append(elapsed)
+            elapsed, n = timed_load(bib_path)
+            warm.append(elapsed)
+            print(f"  round {i+1}: cold {cold[-1]:.3f}s, warm {warm[-1]:.3f}s ({n} entries)", flush=True)
+        size = os.path.getsize(papers.snapshot.snapshot_file(str(bib_path)))
+
+    cold_mean = sum(cold) / len(cold)
+    warm_mean = sum(warm) / len(warm)
+    print(f"  snapshot size: {size/1024/1024:.2f} MB", flush=True)
+    print(f"  mean: cold {cold_mean:.3f}s, warm {warm_mean:.3f}s, speedup {cold_mean/warm_mean:.1f}x", flush=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,36 @@
+"""pytest setup: each test uses its own, empty cache directory.
+
+The caches (library snapshots, file checksums, text extracted from PDFs, DOI queries)
+would otherwise be read from and written to the user's cache directory, and a test
+could pass on a result cached by an earlier test or run instead of running the code it tests.
+"""
+import os
+import shutil
+import tempfile
+
+import pytest
+
+_CACHE_HOME = tempfile.mkdtemp(prefix='papers-tests-')
+# set before papers is imported, for the paths computed at import (DOI query caches)
+os.environ['XDG_CACHE_HOME'] = _CACHE_HOME
+
+
+@pytest.fixture(scope='session')
+def _cache_home():
+    yield _CACHE_HOME
+    shutil.rmtree(_CACHE_HOME, ignore_errors=True)
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(_cache_home, tmp_path, monkeypatch):
+    import papers.config
+    from papers import checksums, extractcache
+    cache_home = str(tmp_path/'cache')
+    # inherited by the papers commands run in subprocesses
+    monkeypatch.setenv('XDG_CACHE_HOME', cache_home)
+    # also where platformdirs ignores XDG_CACHE_HOME (macOS, Windows)
+    monkeypatch.setattr(papers.config, 'CACHE_DIR', os.path.join(cache_home, 'papers'))
+    yield papers.config.CACHE_DIR
+    # written now rather than at exit, into a removed directory
+    checksums.flush()
+    extractcache.flush()
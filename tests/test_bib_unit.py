@@ -4,6 +4,9 @@ import unittest
 from unittest import mock
 
 from papers.bib import (
+    Biblio,
+    KeyIndex,
+    DuplicateKeyError,
     append_abc,
     isvalidkey,
     compare_entries,
@@ -17,7 +20,9 @@ from papers.bib import (
     FAIR_DUPLICATES,
     PARTIAL_DUPLICATES,
 )
-from papers.duplicate import author_id, title_id, entry_id
+from papers.duplicate import author_id, title_id, entry_id, _remove_unicode
+from papers.encoding import family_names
+from papers.entries import entry_from_dict
 
 
 def _fake_response(content=b"", status=200, content_type=""):
@@ -57,6 +62,133 @@ class TestAppendAbc(unittest.TestCase):
         result = append_abc('Author2000', ['Author2000', 'Author2000b'])
         self.assertEqual(result, 'Author2000c')
 
+    def test_past_z(self):
+        keys = {'Author2000'} | {'Author2000'+l for l in 'bcdefghijklmnopqrstuvwxyz'}
+        self.assertEqual(append_abc('Author2000', keys), 'Author2000aa')
+        self.assertEqual(append_abc('Author2000z'), 'Author2000aa')
+        self.assertEqual(append_abc('Author2000', keys | {'Author2000aa'}), 'Author2000ab')
+
+
+class TestKeyIndex(unittest.TestCase):
+
+    BIB = """@article{Doe2000,
+ title = {First}
+}
+
+@article{Smith2010,
+ title = {Second}
+}
+"""
+
+    def setUp(self):
+        self.biblio = Biblio.loads(self.BIB, '')
+
+    def _entry(self, key, title='Other'):
+        return Biblio.loads(f'@article{{{key},\n title = {{{title}}}\n}}\n', '').entries[0]
+
+    def test_case_insensitive(self):
+        index = KeyIndex(self.biblio.entries)
+        self.assertIn('doe2000', index)
+        self.assertIn('DOE2000', index)
+        self.assertNotIn('Doe2001', index)
+        self.assertEqual([e.key for e in self.biblio.entries_with_key('SMITH2010')], ['Smith2010'])
+
+    def test_insert_conflict(self):
+        with self.assertRaises(DuplicateKeyError):
+            self.biblio.insert_entry(self._entry('doe2000'))
+        self.biblio.insert_entry(self._entry('Doe2001'))
+        self.assertEqual([e.key for e in self.biblio.entries_with_key('doe2001')], ['Doe2001'])
+
+    def test_set_key(self):
+        e = self.biblio.entries_with_key('Doe2000')[0]
+        self.biblio.set_key(e, 'Doe2000x')
+        self.assertEqual(self.biblio.entries_with_key('Doe2000'), [])
+        self.assertEqual(self.biblio.entries_with_key('doe2000X'), [e])
+
+    def test_direct_library_changes(self):
+        self.biblio._keys()
+        self.biblio.db.add(self._entry('New'))
+        self.assertEqual(len(self.biblio.entries_with_key('new')), 1)
+        self.biblio.db.remove(self.biblio.entries_with_key('new')[0])
+        self.assertEqual(self.biblio.entries_with_key('new'), [])
+        self.biblio.entries = self.biblio.entries[:1]
+        self.assertEqual(self.biblio.entries_with_key('smith2010'), [])
+
+    def test_generate_key_suffix(self):
+        self.biblio.keyformat = lambda e: 'Doe2000'
+        keys = []
+        for i in range(30):
+            e = self._entry('tmp', title=f'Paper {i}')
+            key = self.biblio.generate_key(e)
+            self.biblio.set_key(e, key)
+            self.biblio.insert_entry(e)
+            keys.append(key)
+        self.assertEqual(keys[:2], ['Doe2000b', 'Doe2000c'])
+        self.assertEqual(keys[24:], ['Doe2000z', 'Doe2000aa', 'Doe2000ab', 'Doe2000ac', 'Doe2000ad', 'Doe2000ae'])
+        # an entry's own key is not a conflict
+        self.assertEqual(self.biblio.generate_key(self.biblio.entries_with_key('Doe2000')[0]), 'Doe2000')
+
+
+class TestBulkChanges(unittest.TestCase):
+
+    BIB = """@string{jgr = {Journal of Geophysical Research}}
+
+@article{Doe2000,
+ title = {First}
+}
+
+@comment{between entries}
+
+@article{Smith2010,
+ title = {Second}
+}
+
+@article{Zeta,
+ title = {Last}
+}
+"""
+
+    def setUp(self):
+        self.biblio = Biblio.loads(self.BIB, '')
+        self.doe, self.smith, self.zeta = self.biblio.entries
+
+    def _entry(self, key, title='Other'):
+        return Biblio.loads(f'@article{{{key},\n title = {{{title}}}\n}}\n', '').entries[0]
+
+    def _blocks(self):
+        return [getattr(b, 'key', type(b).__name__) for b in self.biblio.db.blocks]
+
+    def test_remove_many(self):
+        self.biblio.remove_many([self.zeta, self.doe])
+        self.assertEqual(self._blocks(), ['jgr', 'ExplicitComment', 'Smith2010'])
+        self.assertEqual(self.biblio.entries_with_key('doe2000'), [])
+        with self.assertRaises(ValueError):
+            self.biblio.remove_many([self.doe])
+
+    def test_remove_by_identity(self):
+        copy = self._entry('Smith2010', 'Second')
+        with self.assertRaises(ValueError):
+            self.biblio.remove_many([copy])
+        self.assertEqual(len(self.biblio.entries), 3)
+
+    def test_replace_many(self):
+        new = [self._entry('New'), self.zeta]
+        self.biblio.replace_many([self.smith, self.zeta], new)
+        self.assertEqual(self._blocks(), ['jgr', 'Doe2000', 'ExplicitComment', 'New', 'Zeta'])
+        self.assertIs(self.biblio.entries_with_key('new')[0], new[0])
+
+    def test_replace_many_rekeyed(self):
+        # keys changed in place, as by a merge of duplicates
+        self.smith.key = 'Smith2010b'
+        self.biblio.replace_many([self.doe], [])
+        self.assertEqual(self.biblio.entries_with_key('smith2010'), [])
+        self.assertEqual(self.biblio.entries_with_key('smith2010b'), [self.smith])
+
+    def test_changes(self):
+        self.biblio.replace_many([self.smith], [self._entry('New')])
+        added, removed, modified = self.biblio.changes()
+        self.assertEqual(([e.key for e in added], [e.key for e in removed], modified), (['New'], ['Smith2010'], []))
+
 
 class TestIsvalidkey(unittest.TestCase):
 
@@ -128,6 +260,25 @@ class TestEntryId(unittest.TestCase):
         """_remove_unicode replaces chars with ord > 128"""
         e = {"author": "Müller, Hans"}
         self.assertEqual(author_id(e), "m_ller")
+        self.assertEqual(_remove_unicode("Ab\x80\x81ç日", replace=""), "Ab\x80")
+
+    def test_entry_id_cached_until_change(self):
+        e = entry_from_dict({"ENTRYTYPE": "article", "ID": "x", "author": "Smith, J.", "title": "Paper"})
+        with mock.patch("papers.duplicate.family_names", side_effect=family_names) as names:
+            self.assertEqual(entry_id(e), ("", "smithpaper"))
+            self.assertEqual(entry_id(e), ("", "smithpaper"))
+            self.assertEqual(names.call_count, 1)
+            e["title"] = "Other"
+            self.assertEqual(entry_id(e), ("", "smithother"))
+            self.assertEqual(names.call_count, 2)
+
+    def test_cache_not_on_entry(self):
+        # bibtexparser compares entries by __dict__, which is also what gets pickled
+        d = {"ENTRYTYPE": "article", "ID": "x", "author": "Smith, J.", "title": "Paper"}
+        e, other = entry_from_dict(d), entry_from_dict(d)
+        entry_id(e)
+        self.assertEqual(e, other)
+        self.assertEqual(e.__dict__.keys(), other.__dict__.keys())
 
 
 class TestAreDuplicates(unittest.TestCase):
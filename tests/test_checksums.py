@@ -0,0 +1,89 @@
+"""Unit tests for papers.checksums (persistent cache of file checksums)"""
+import concurrent.futures
+import json
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import papers.config as pconfig
+import papers.checksums as checksums
+from papers.duplicate import merge_files
+from papers.entries import entry_from_dict
+from papers.utils import checksum, move
+
+
+class TestChecksumCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.files = {}
+        for name, content in [('a.pdf', 'aaaa'), ('copy.pdf', 'aaaa'), ('b.pdf', 'bbbb'), ('long.pdf', 'longer')]:
+            self.files[name] = os.path.join(self._tmp.name, name)
+            open(self.files[name], 'w').write(content)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_file_read_once(self):
+        with mock.patch('papers.checksums.checksum', side_effect=checksum) as calls:
+            first = checksums.file_checksum(self.files['a.pdf'])
+            second = checksums.file_checksum(self.files['a.pdf'])
+        self.assertEqual(calls.call_count, 1)
+        self.assertEqual(first, second)
+        self.assertEqual(first, checksum(self.files['a.pdf']))
+
+    def test_modified_file(self):
+        before = checksums.file_checksum(self.files['a.pdf'])
+        open(self.files['a.pdf'], 'w').write('modified')
+        self.assertNotEqual(checksums.file_checksum(self.files['a.pdf']), before)
+
+    def test_threads(self):
+        files = []
+        for i in range(200):
+            files.append(os.path.join(self._tmp.name, f'{i}.pdf'))
+            open(files[-1], 'w').write(str(i))
+        with concurrent.futures.ThreadPoolExecutor(8) as pool:
+            digests = pool.map(checksums.file_checksum, files)
+            for _ in range(20):
+                checksums.flush()  # iterates over the records while they are added
+        self.assertEqual(list(digests), [checksum(f) for f in files])
+        checksums.flush()
+        records = json.load(open(os.path.join(pconfig.CACHE_DIR, checksums.CACHE_FILE)))
+        self.assertEqual(len(records), 200)
+
+    def test_persisted(self):
+        digest = checksums.file_checksum(self.files['b.pdf'])
+        checksums.flush()
+        records = json.load(open(os.path.join(pconfig.CACHE_DIR, checksums.CACHE_FILE)))
+        self.assertEqual(records[self.files['b.pdf']][3], digest.hex())
+
+    def test_dry_run_not_persisted(self):
+        checksums.file_checksum(self.files['b.pdf'])
+        with mock.patch.object(pconfig, 'DRYRUN', True):
+            checksums.flush()
+        self.assertFalse(os.path.exists(os.path.join(pconfig.CACHE_DIR, checksums.CACHE_FILE)))
+
+    def test_same_content(self):
+        with mock.patch('papers.checksums.checksum', side_effect=checksum) as calls:
+            self.assertFalse(checksums.same_content(self.files['a.pdf'], self.files['long.pdf']))
+            self.assertEqual(calls.call_count, 0)  # sizes differ
+            self.assertTrue(checksums.same_content(self.files['a.pdf'], self.files['a.pdf']))
+            self.assertTrue(checksums.same_content(self.files['a.pdf'], self.files['copy.pdf']))
+            self.assertFalse(checksums.same_content(self.files['a.pdf'], self.files['b.pdf']))
+        self.assertEqual(calls.call_count, 3)
+
+    def test_merge_files_compares_sizes_first(self):
+        entries = [entry_from_dict({'ID': 'A', 'file': ':{}:pdf;:{}:pdf'.format(self.files['a.pdf'], self.files['long.pdf'])}),
+                   entry_from_dict({'ID': 'B', 'file': ':{}:pdf'.format(self.files['copy.pdf'])})]
+        with mock.patch('papers.checksums.checksum', side_effect=checksum) as calls:
+            merged = merge_files(entries, relative_to=os.path.sep)
+        self.assertEqual(calls.call_count, 2)  # not long.pdf
+        self.assertIn('a.pdf', merged)
+        self.assertIn('long.pdf', merged)
+        self.assertNotIn('copy.pdf', merged)
+
+    def test_move_onto_identical_file(self):
+        move(self.files['copy.pdf'], self.files['a.pdf'])
+        self.assertFalse(os.path.exists(self.files['copy.pdf']))
+        self.assertEqual(open(self.files['a.pdf']).read(), 'aaaa')
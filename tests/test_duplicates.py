@@ -1,5 +1,8 @@
 """Tests for papers duplicate detection and merging (21% -> higher coverage)"""
+import json
 import os
+import pickle
+import random
 import subprocess as sp
 import tempfile
 import unittest
@@ -7,24 +10,34 @@ import unittest
 from unittest.mock import patch
 
 import bibtexparser
+try:
+    import numpy
+except ImportError:
+    numpy = None
 from papers.entries import parse_string as bp_parse_string
 
-from papers.bib import Biblio
+from papers.bib import Biblio, are_duplicates, compare_entries, compare_entries_batch, duplicate_pairs
 from papers.duplicate import (
     search_duplicates,
     list_duplicates,
     list_uniques,
     groupby_equal,
+    groupby_blocks,
+    groupby_pairs,
+    duplicate_blocks,
+    DuplicateIndex,
     merge_entries,
     MergedEntry,
     ConflictingField,
     check_duplicates,
+    merge_duplicates,
+    resolve_duplicates,
     edit_entries,
     entry_sdiff,
     title_id,
 )
 from papers.entries import entry_from_dict, get_entry_val, format_library, library_from_entries
-from papers.utils import bcolors
+from papers.utils import bcolors, checksum
 from tests.common import PAPERSCMD, paperscmd, BibTest
 
 
@@ -59,6 +72,211 @@ class TestGroupbyEqual(unittest.TestCase):
         self.assertEqual(len(groups), 4)
 
 
+class TestGroupbyBlocks(unittest.TestCase):
+    """groupby_blocks gives the same groups as groupby_equal"""
+
+    def _entries(self, n, seed):
+        # few distinct values: many duplicates, including chains (same doi, then same
+        # author+title with another doi), missing fields and case differences
+        rng = random.Random(seed)
+        entries = []
+        for i in range(n):
+            d = {'ENTRYTYPE': 'article', 'ID': f'key{rng.randrange(n)}'}
+            if rng.random() < 0.7:
+                d['doi'] = rng.choice(['10.1/a', '10.1/A', '10.1/b', '10.1/c', '10.1/d'])
+            if rng.random() < 0.8:
+                d['author'] = rng.choice(['Doe, John', 'Smith, Jane', 'Müller, Hans'])
+            if rng.random() < 0.8:
+                d['title'] = rng.choice(['First', 'Second', 'Third'])
+            if rng.random() < 0.3:
+                d['year'] = rng.choice(['2000', '2001'])
+            entries.append(entry_from_dict(d))
+        return entries
+
+    def test_same_groups_as_groupby_equal(self):
+        for similarity in ['EXACT', 'GOOD', 'FAIR', 'PARTIAL']:
+            eq = lambda a, b: are_duplicates(a, b, similarity=similarity)
+            for seed in range(5):
+                entries = self._entries(60, seed)
+                expected = groupby_equal(entries, eq)
+                self.assertEqual(groupby_blocks(entries, eq, duplicate_blocks), expected, (similarity, seed))
+
+    def test_list_eq_with_key(self):
+        # as in papers list --duplicates
+        eq = lambda a, b: get_entry_val(a, 'ID', '') == get_entry_val(b, 'ID', '') or are_duplicates(a, b, similarity='PARTIAL')
+        blocks = lambda e: duplicate_blocks(e) + [('ID', get_entry_val(e, 'ID', ''))]
+        entries = self._entries(80, 42)
+        self.assertEqual(groupby_blocks(entries, eq, blocks), groupby_equal(entries, eq))
+
+    def test_fewer_comparisons(self):
+        calls = []
+        def eq(a, b):
+            calls.append(1)
+            return are_duplicates(a, b, similarity='PARTIAL')
+        entries = [entry_from_dict({'ID': f'k{i}', 'doi': f'10.1/{i}', 'title': f'title {i}'}) for i in range(200)]
+        uniques, groups = search_duplicates(entries, eq=eq, blocks=duplicate_blocks)
+        self.assertEqual((len(uniques), groups), (200, []))
+        self.assertEqual(calls, [])
+
+
+class TestDuplicateIndex(unittest.TestCase):
+    """DuplicateIndex candidates contain all duplicates found by a full scan"""
+
+    WORDS = ['ice', 'edge', 'blooms', 'arctic', 'the', 'of', 'ocean', 'sea', 'level', 'rise']
+
+    def _entries(self, n, seed):
+        rng = random.Random(seed)
+        entries = []
+        for i in range(n):
+            d = {'ENTRYTYPE': 'article', 'ID': f'key{i}'}
+            if rng.random() < 0.3:
+                d['doi'] = f'10.1/{rng.randrange(20)}'
+            if rng.random() < 0.8:
+                d['author'] = rng.choice(['Doe, John', 'Smith, Jane and Doe, John', 'Müller, Hans'])
+            if rng.random() < 0.9:
+                d['title'] = ' '.join(rng.sample(self.WORDS, rng.randrange(1, 5)))
+            entries.append(entry_from_dict(d))
+        return entries
+
+    def test_fuzzy_candidates_complete(self):
+        for seed in range(3):
+            entries = self._entries(150, seed)
+            library, new = entries[:100], entries[100:]
+            index = DuplicateIndex(library, fuzzy=True)
+            for e in new:
+                expected = [ee for ee in library if are_duplicates(ee, e, similarity='FUZZY')]
+                candidates = index.candidates(e)
+                self.assertEqual([ee for ee in candidates if are_duplicates(ee, e, similarity='FUZZY')], expected)
+                self.assertLess(len(candidates), len(library))
+
+    def test_partial_candidates(self):
+        entries = self._entries(100, 0)
+        index = DuplicateIndex(entries[:50])
+        for e in entries[50:]:
+            expected = [ee for ee in entries[:50] if are_duplicates(ee, e, similarity='PARTIAL')]
+            self.assertEqual([ee for ee in index.candidates(e) if are_duplicates(ee, e, similarity='PARTIAL')], expected)
+
+    def test_update_and_remove(self):
+        a = entry_from_dict({'ID': 'a', 'author': 'Doe, John', 'title': 'ice blooms'})
+        b = entry_from_dict({'ID': 'b', 'author': 'Doe, John', 'title': 'ocean'})
+        index = DuplicateIndex([a], fuzzy=True)
+        self.assertEqual(index.candidates(b), [])
+        a['title'] = 'ocean blooms'
+        index.add(a)
+        self.assertEqual(index.candidates(b), [a])
+        index.remove(a)
+        self.assertEqual((index.candidates(b), len(index)), ([], 0))
+
+    def test_pickle(self):
+        entries = self._entries(60, 2)
+        index = DuplicateIndex(entries[:40], fuzzy=True)
+        entries2, index2 = pickle.loads(pickle.dumps((entries, index)))
+        for e, e2 in zip(entries[40:], entries2[40:]):
+            self.assertEqual([ee.key for ee in index2.candidates(e2)], [ee.key for ee in index.candidates(e)])
+            self.assertTrue(all(any(ee is x for x in entries2) for ee in index2.candidates(e2)))
+
+    def test_persisted_with_library(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            bibtex = os.path.join(tmp, 'papers.bib')
+            biblio = Biblio(similarity='FUZZY')
+            biblio.entries = self._entries(50, 3)
+            biblio.duplicate_index()
+            biblio.save(bibtex)
+
+            biblio = Biblio.load(bibtex, '', similarity='FUZZY')
+            first = biblio.entries[0]
+            first['title'] = 'unrelated words'
+            biblio.db.remove(biblio.entries[1])
+            with patch('papers.bib.DuplicateIndex') as build:
+                index = biblio.duplicate_index()
+            build.assert_not_called()
+            self.assertEqual(len(index), 49)
+            new = entry_from_dict({'ENTRYTYPE': 'article', 'ID': 'new', 'author': get_entry_val(first, 'author'), 'title': 'unrelated'})
+            self.assertIn(first, index.candidates(new))
+
+            # another similarity level: indexed again
+            biblio.similarity = 'PARTIAL'
+            self.assertFalse(biblio.duplicate_index().fuzzy)
+
+    def test_updated_on_insert(self):
+        biblio = Biblio(similarity='FUZZY')
+        biblio.entries = self._entries(50, 4)
+        index = biblio.duplicate_index()
+        new = [entry_from_dict({'ENTRYTYPE': 'article', 'ID': f'new{i}', 'author': 'Nobody, Else', 'title': f'unrelated {i}'})
+               for i in range(5)]
+        conflict = entry_from_dict({'ENTRYTYPE': 'article', 'ID': 'new0', 'author': 'Nobody, Else', 'title': 'unrelated 0', 'year': '2000'})
+        with patch.object(Biblio, 'changes', side_effect=Biblio.changes, autospec=True) as changes:
+            for e in new:
+                biblio.insert_entry(e, check_duplicate=True, duplicate_index=biblio.duplicate_index())
+            biblio.insert_entry(conflict, check_duplicate=True, on_conflict='o')
+            self.assertIs(biblio.duplicate_index(), index)
+        changes.assert_not_called()
+        self.assertEqual(len(index), 55)
+        self.assertEqual(index.candidates(conflict), [conflict])
+
+    def test_fuzzy_insert_uses_index(self):
+        biblio = Biblio(similarity='FUZZY')
+        for e in self._entries(50, 1):
+            biblio.insert_entry(e)
+        new = entry_from_dict({'ENTRYTYPE': 'article', 'ID': 'new', 'author': 'Nobody, Else', 'title': 'unrelated words'})
+        with patch.object(Biblio, 'eq', side_effect=Biblio.eq, autospec=True) as eq:
+            biblio.insert_entry(new, check_duplicate=True)
+        eq.assert_not_called()
+        self.assertIn(new, biblio.entries)
+
+
+class TestBatchScoring(unittest.TestCase):
+    """compare_entries_batch and duplicate_pairs agree with compare_entries and are_duplicates"""
+
+    def _entries(self, n, seed):
+        # mixes the cases of TestGroupbyBlocks (keyed pairs) and TestDuplicateIndex (fuzzy pairs)
+        entries = TestGroupbyBlocks._entries(self, n, seed) + TestDuplicateIndex._entries(TestDuplicateIndex, n, seed)
+        random.Random(seed).shuffle(entries)
+        for i, e in enumerate(entries):
+            e.key = f'key{i}'
+        return entries
+
+    def test_compare_entries_batch(self):
+        entries = self._entries(30, 0)
+        for fuzzy in [False, True]:
+            expected = [[compare_entries(a, b, fuzzy=fuzzy) for b in entries] for a in entries]
+            self.assertEqual(compare_entries_batch(entries, fuzzy=fuzzy), expected)
+        others = entries[:10]
+        self.assertEqual(compare_entries_batch(entries, others, fuzzy=True),
+                         [[compare_entries(a, b, fuzzy=True) for b in others] for a in entries])
+
+    def test_duplicate_pairs(self):
+        entries = self._entries(40, 1)
+        for similarity in ['EXACT', 'GOOD', 'FAIR', 'PARTIAL', 'FUZZY']:
+            expected = [(j, i) for i in range(len(entries)) for j in range(i)
+                        if are_duplicates(entries[j], entries[i], similarity=similarity)]
+            self.assertEqual(duplicate_pairs(entries, similarity, chunk_size=7), sorted(expected), similarity)
+
+    def test_same_groups_as_groupby_equal(self):
+        entries = self._entries(40, 2)
+        for similarity in ['PARTIAL', 'FUZZY']:
+            eq = lambda a, b: are_duplicates(a, b, similarity=similarity)
+            self.assertEqual(groupby_pairs(entries, duplicate_pairs(entries, similarity)), groupby_equal(entries, eq))
+
+    @unittest.skipUnless(numpy, 'numpy is not installed: rapidfuzz process.cdist is not used')
+    def test_cdist_as_extract(self):
+        entries = self._entries(30, 4)
+        with patch('papers.bib._numpy', return_value=None):
+            rows = compare_entries_batch(entries, fuzzy=True)
+            pairs = duplicate_pairs(entries, 'FUZZY', chunk_size=7)
+        self.assertEqual(compare_entries_batch(entries, fuzzy=True), rows)
+        self.assertEqual(duplicate_pairs(entries, 'FUZZY', chunk_size=7), pairs)
+
+    def test_check_duplicates_uses_pairs(self):
+        biblio = Biblio(similarity='FUZZY')
+        biblio.entries = self._entries(120, 3)
+        expected = search_duplicates(biblio.entries, eq=biblio.eq)
+        with patch.object(Biblio, 'eq', side_effect=Biblio.eq, autospec=True) as eq:
+            found = search_duplicates(biblio.entries, pairs=duplicate_pairs(biblio.entries, 'FUZZY'))
+        eq.assert_not_called()
+        self.assertEqual(found, expected)
+
+
 class TestMergeEntries(unittest.TestCase):
 
     def test_merge_identical_entries(self):
@@ -198,6 +416,45 @@ class TestCheckDuplicatesResolution(unittest.TestCase):
         self.assertTrue(hasattr(result[0], 'fields_dict'))
         self.assertIn('@article', format_library(library_from_entries(result)))
 
+    def test_merge_mode_report(self):
+        report = []
+        result = check_duplicates(self.entries(), eq=self.eq, mode='m', report=report)
+        self.assertEqual(len(result), 2)
+        self.assertEqual([r['keys'] for r in report], [['A2000', 'A2000b'], ['B2010', 'B2010b']])
+        self.assertEqual([r['conflicts'] for r in report], [['ID', 'year'], ['ID', 'year']])
+        self.assertEqual([r['merged'] for r in report], [get_entry_val(e, 'ID') for e in result])
+
+    def test_merge_duplicates_as_resolve_duplicates(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            for name, content in [('a.pdf', 'a'), ('copy.pdf', 'a'), ('b.pdf', 'b')]:
+                open(os.path.join(tmp, name), 'w').write(content)
+
+            def groups():
+                # A2000 and an exact copy of it, A2000b with the same file under another name
+                entries = self.entries()
+                entries.append(self.entries()[0])
+                for e, name in zip(entries, ['a.pdf', 'copy.pdf', 'b.pdf', 'b.pdf', 'a.pdf']):
+                    e['file'] = os.path.join(tmp, name)
+                return search_duplicates(entries, eq=self.eq)[1]
+
+            with patch('papers.checksums.checksum', side_effect=checksum) as calls:
+                expected = [format_library(library_from_entries(resolve_duplicates(g, 'm'))) for g in groups()]
+                resolved, report = merge_duplicates(groups(), jobs=2)
+            # each file once (then cached), and b.pdf is alone in its group
+            self.assertEqual(calls.call_count, 2)
+            self.assertEqual([format_library(library_from_entries([e])) for e in resolved], expected)
+            self.assertEqual([len(r['files']) for r in report], [1, 1])
+
+    def test_merge_duplicates_in_processes(self):
+        def groups():
+            return [group for _ in range(3) for group in search_duplicates(self.entries(), eq=self.eq)[1]]
+        expected = merge_duplicates(groups())
+        with patch('papers.duplicate.MERGE_PROCESS_MIN_GROUPS', 2):
+            resolved, report = merge_duplicates(groups(), jobs=2)
+        self.assertEqual(report, expected[1])
+        self.assertEqual([format_library(library_from_entries([e])) for e in resolved],
+                         [format_library(library_from_entries([e])) for e in expected[0]])
+
     def test_interactive_merge_then_pick_is_saveable(self):
         # merging used to produce a plain dict that crashed the library on save
         with patch('builtins.input', side_effect=['m', '3']):
@@ -686,3 +943,117 @@ class TestCheckResolveDuplicate(BibTest):
         func = lambda: sp.check_call(self.command('m\n3'), shell=True)
         self.assertRaises(Exception, func)
 
+    def test_merge_mode_report(self):
+        report = self.mybib + '.report.json'
+        try:
+            sp.check_call(f'{PAPERSCMD} check --duplicates -m m --report {report} --bibtex {self.mybib}', shell=True)
+            data = json.load(open(report))
+        finally:
+            if os.path.exists(report):
+                os.remove(report)
+        self.assertEqual((data['entries_before'], data['entries_after']), (2, 1))
+        self.assertEqual(data['groups'][0]['keys'], ['AnotherKey', 'Perrette_2011'])
+        self.assertEqual(open(self.mybib).read().count('@article'), 1)
+
+
+
+class TestMergeLibraries(unittest.TestCase):
+
+    library = """@article{Perrette_2011,
+ doi = {10.5194/bg-8-515-2011},
+ journal = {Biogeosciences},
+ year = {RareYear}
+}
+
+@article{Smith2000,
+ author = {Smith, John},
+ title = {A title},
+ year = {2000}
+}"""
+
+    other = """@article{AnotherKey,
+ author = {New Author Field},
+ doi = {10.5194/bg-8-515-2011},
+ journal = {ConflictJournal}
+}
+
+@article{Smith2000,
+ author = {Smith, John},
+ title = {A title},
+ year = {2000}
+}
+
+@article{smith2000,
+ author = {Smith, Jane},
+ title = {Another title},
+ year = {2000}
+}"""
+
+    def merge(self, mode):
+        biblio = Biblio.loads(self.library, '')
+        counts = biblio.merge_entries(bp_parse_string(self.other).entries, on_conflict=mode)
+        return biblio, counts
+
+    def test_counts(self):
+        biblio, counts = self.merge('s')
+        self.assertEqual(counts, {'added': 1, 'duplicates': 1, 'conflicts': 1, 'renamed': 1})
+        self.assertEqual([e.key for e in biblio.entries], ['Perrette_2011', 'Smith2000', 'smith2000b'])
+
+    def test_update(self):
+        biblio, counts = self.merge('u')
+        e = biblio.entries[0]
+        self.assertEqual((e.key, e['journal'], e['author']), ('Perrette_2011', 'Biogeosciences', 'New Author Field'))
+
+    def test_overwrite(self):
+        biblio, counts = self.merge('o')
+        self.assertEqual(sorted(e.key for e in biblio.entries), ['AnotherKey', 'Smith2000', 'smith2000b'])
+
+    def test_append(self):
+        biblio, counts = self.merge('a')
+        self.assertEqual([e.key for e in biblio.entries], ['Perrette_2011', 'Smith2000', 'AnotherKey', 'smith2000b'])
+
+    def test_as_add_bibtex(self):
+        other = self.other.split('\n\n@article{smith2000')[0]  # no key conflict, which add_bibtex raises on
+        for mode in 'suUoa':
+            biblio = Biblio.loads(self.library, '')
+            biblio.merge_entries(bp_parse_string(other).entries, on_conflict=mode)
+            expected = Biblio.loads(self.library, '')
+            expected.add_bibtex(other, check_duplicate=True, on_conflict=mode)
+            self.assertEqual(sorted(format_library(biblio.db).strip().split('\n\n')),
+                             sorted(format_library(expected.db).strip().split('\n\n')), mode)
+
+    def test_duplicate_index_in_sync(self):
+        biblio, counts = self.merge('o')
+        index = biblio.duplicate_index()
+        self.assertEqual(len(index), 3)
+        self.assertEqual([e.key for e in index.candidates(biblio.entries[0])], ['AnotherKey'])
+
+
+class TestMergeCommand(BibTest):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.first = os.path.join(self._tmp.name, 'first.bib')
+        self.second = os.path.join(self._tmp.name, 'second.bib')
+        self.output = os.path.join(self._tmp.name, 'merged.bib')
+        open(self.first, 'w').write(TestMergeLibraries.library)
+        open(self.second, 'w').write(TestMergeLibraries.other)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_merge(self):
+        out = sp.check_output(f'{PAPERSCMD} merge {self.first} {self.second} -o {self.output} -m u', shell=True).decode()
+        self.assertIn('1 added, 1 exact duplicates, 1 conflicts, 1 keys renamed', out)
+        merged = Biblio.load(self.output, '')
+        self.assertEqual(sorted(e.key for e in merged.entries), ['Perrette_2011', 'Smith2000', 'smith2000b'])
+        self.assertEqual(merged.entries_with_key('Perrette_2011')[0]['author'], 'New Author Field')
+        # the inputs are left alone
+        self.assertEqual(open(self.first).read(), TestMergeLibraries.library)
+
+    def test_merge_not_interactive_by_default(self):
+        out = sp.check_output(f'{PAPERSCMD} merge {self.first} {self.second} -o {self.output}', shell=True,
+                              stdin=sp.DEVNULL).decode()
+        self.assertIn('1 conflicts', out)
+        merged = Biblio.load(self.output, '')
+        self.assertEqual(merged.entries_with_key('Perrette_2011')[0]['author'], 'New Author Field')
@@ -0,0 +1,311 @@
+"""Unit tests for papers.entries (parse/format helpers)"""
+import io
+import os
+import pickle
+import subprocess
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import bibtexparser
+from bibtexparser.middlewares import SortBlocksByTypeAndKeyMiddleware
+
+from papers.entries import parse_string, format_library, write_library, iter_entries, sort_blocks, parse_string_parallel, _split_chunks
+from papers.entries import CompactEntry, get_entry_val, entry_fingerprint, entry_content_equal, entry_from_dict
+
+
+BIB = """@string{foo = {bar}}
+
+% {unbalanced comment
+@article{Doe2000,
+ author = {Doe, John},
+ journal = foo,
+ abstract = {a line
+@starting with at},
+ year = {2000}
+}
+
+@article{Doe2000,
+ title = {duplicate key}
+}
+
+@misc{Alpha,
+ title = {last}
+}
+"""
+
+
+def _signature(entries):
+    return [(e.entry_type, e.key, [(f.key, f.value) for f in e.fields]) for e in entries]
+
+
+class TestIterEntries(unittest.TestCase):
+
+    def setUp(self):
+        fd, self.bibtex = tempfile.mkstemp(suffix='.bib')
+        with os.fdopen(fd, 'w') as f:
+            f.write(BIB)
+
+    def tearDown(self):
+        os.remove(self.bibtex)
+
+    def test_same_entries_as_full_parse(self):
+        expected = _signature(parse_string(BIB).entries)
+        self.assertEqual([key for _, key, _ in expected], ['Doe2000', 'Alpha'])
+        for chunk_size in [1, 7, 50, 1 << 16]:
+            self.assertEqual(_signature(iter_entries(self.bibtex, chunk_size=chunk_size)), expected, chunk_size)
+
+    def test_string_reference_resolved(self):
+        # @string definitions apply to entries parsed in later chunks
+        self.assertEqual(parse_string(BIB).entries[0]['journal'], 'bar')
+        self.assertEqual(next(iter_entries(self.bibtex, chunk_size=10))['journal'], 'bar')
+
+    def test_lazy(self):
+        # the first entry is available before the whole file is read
+        open(self.bibtex, 'w').write('\n'.join(f'@misc{{k{i},\n title = {{t{i}}}\n}}\n' for i in range(1000)))
+        entries = iter_entries(self.bibtex, chunk_size=100)
+        self.assertEqual(next(entries).key, 'k0')
+
+    def test_empty(self):
+        open(self.bibtex, 'w').write('')
+        self.assertEqual(list(iter_entries(self.bibtex)), [])
+
+
+class TestSortBlocks(unittest.TestCase):
+
+    def test_same_order_as_middleware(self):
+        library = parse_string(BIB + '\n@preamble{"p"}\n\n@article{Beta,\n title = {b}\n}\n% trailing comment\n')
+        expected = SortBlocksByTypeAndKeyMiddleware().transform(library=library)
+        blocks = sort_blocks(library.blocks)
+        self.assertEqual([type(b) for b in blocks], [type(b) for b in expected.blocks])
+        self.assertEqual([getattr(b, 'key', None) for b in blocks], [getattr(b, 'key', None) for b in expected.blocks])
+        # blocks are not copied
+        self.assertTrue(all(any(b is b0 for b0 in library.blocks) for b in blocks))
+
+
+def _blocks_signature(library):
+    return [(type(b).__name__, getattr(b, 'key', None), b.start_line,
+             [(f.key, f.value, f.start_line) for f in getattr(b, 'fields', ())]) for b in library.blocks]
+
+
+class TestParallelParse(unittest.TestCase):
+
+    def test_split_chunks(self):
+        text = BIB.replace('% {unbalanced comment\n', '') * 5
+        for n in [1, 2, 3, 8, 100]:
+            chunks = _split_chunks(text, n)
+            self.assertLessEqual(len(chunks), n)
+            self.assertEqual(''.join(text[start:end] for start, end in chunks), text)
+            for start, end in chunks:
+                # cut between top-level blocks only
+                self.assertTrue(text[start] == '@' or start == 0)
+                self.assertEqual(text.count('{', start, end), text.count('}', start, end))
+
+    def test_split_chunks_unbalanced_comment(self):
+        # braces in comments make the cuts conservative, never wrong
+        chunks = _split_chunks(BIB * 5, 4)
+        self.assertEqual(''.join((BIB * 5)[start:end] for start, end in chunks), BIB * 5)
+        self.assertTrue(all((BIB * 5)[start] == '@' or start == 0 for start, _ in chunks))
+
+    def test_same_as_serial(self):
+        text = BIB + ''.join(f'@misc{{k{i},\n title = {{t{i}}}\n}}\n\n' for i in range(20)) + '@misc{Alpha,\n title = {dup}\n}\n'
+        expected = parse_string(text)
+        for jobs in [1, 2, 4]:
+            library = parse_string_parallel(text, jobs)
+            self.assertEqual(_blocks_signature(library), _blocks_signature(expected), jobs)
+            self.assertEqual(library.entries[0]['journal'], 'bar')
+            self.assertEqual(len(library.failed_blocks), len(expected.failed_blocks))
+
+    def test_without_strings(self):
+        text = ''.join(f'@misc{{k{i},\n title = {{t{i}}}\n}}\n\n' for i in range(20))
+        self.assertEqual(_blocks_signature(parse_string_parallel(text, 3)), _blocks_signature(parse_string(text)))
+
+    def test_small_input_is_parsed_serially(self):
+        with mock.patch('papers.entries.parse_string_parallel') as parallel:
+            parse_string(BIB, jobs=4)
+            parallel.assert_not_called()
+
+
+CANONICAL = """@article{Doe2000,
+ abstract = {multi
+line {nested {braces}} and esc\\{aped},
+ author = {Doë, Jöhn},
+ title = {First title},
+ year = {2000}
+}
+
+@misc{Zeta,
+ note = {}
+}
+"""
+
+
+def _full_signature(library):
+    def signature(block):
+        if block is None:
+            return None
+        state = {k: v for k, v in block.__dict__.items() if k not in ('_error', '_previous_block', '_ignore_error_block')}
+        state['_fields'] = [f.__dict__ for f in getattr(block, 'fields', ())]
+        return type(block).__name__, state, signature(getattr(block, 'ignore_error_block', None))
+    return [signature(b) for b in library.blocks]
+
+
+class TestCanonicalReader(unittest.TestCase):
+
+    def assertSameAsBibtexparser(self, text):
+        self.assertEqual(_full_signature(parse_string(text)), _full_signature(bibtexparser.parse_string(text)))
+
+    def test_canonical_text_is_read_natively(self):
+        self.assertEqual(format_library(parse_string(CANONICAL)), CANONICAL)
+        with mock.patch('bibtexparser.parse_string') as parse:
+            library = parse_string(CANONICAL)
+            parse.assert_not_called()
+        self.assertEqual([e.key for e in library.entries], ['Doe2000', 'Zeta'])
+        self.assertEqual(library.entries[0]['abstract'], 'multi\nline {nested {braces}} and esc\\{aped')
+        self.assertSameAsBibtexparser(CANONICAL)
+
+    def test_fallback(self):
+        for other in [
+                '% a comment\n',
+                '@misc{Other,\n month = feb,\n title = "quoted"\n}\n',
+                '@misc(Other,\n title = {paren}\n)\n',
+                '@misc{Other,\n title = {unbalanced\n}\n',
+                '@misc{Other,\n title = {a},\n title = {b}\n}\n',
+                '@misc{Zeta,\n note = {duplicate key}\n}\n',
+                '@preamble{"p"}\n',
+                ]:
+            self.assertSameAsBibtexparser(CANONICAL + '\n' + other + '\n' + CANONICAL.replace('Doe2000', 'Doe2001'))
+
+    def test_string_definitions(self):
+        # later @string blocks apply to earlier entries: always the full parser
+        text = CANONICAL.replace('{First title}', 'foo') + '\n@string{foo = {bar}}\n'
+        self.assertSameAsBibtexparser(text)
+        self.assertEqual(parse_string(text).entries[0]['title'], 'bar')
+
+
+GOLDEN_DIR = os.path.join(os.path.dirname(__file__), 'golden')
+
+
+class TestFormatLibrary(unittest.TestCase):
+
+    def setUp(self):
+        self.library = parse_string(open(os.path.join(GOLDEN_DIR, 'library.bib')).read())
+        self.expected = open(os.path.join(GOLDEN_DIR, 'library.formatted.bib')).read()
+
+    def test_golden(self):
+        # library.formatted.bib was written by bibtexparser (the previous format_library)
+        self.assertEqual(format_library(self.library), self.expected)
+
+    def test_write_library(self):
+        out = io.StringIO()
+        write_library(self.library, out)
+        self.assertEqual(out.getvalue(), self.expected)
+        self.assertEqual(format_library(self.library.blocks), self.expected)
+
+    def test_library_not_modified(self):
+        entry = self.library.entries_dict['Doe2000']
+        order = [f.key for f in entry.fields]
+        self.assertNotEqual(order, sorted(order))
+        format_library(self.library)
+        self.assertEqual([f.key for f in entry.fields], order)
+        self.assertEqual(entry['title'], 'A quoted {T}itle, with comma')
+
+    def test_unenclosed_values(self):
+        entry = self.library.entries_dict['Alpha1999']
+        entry['note'] = 'a, b'
+        entry.fields_dict['note'].enclosing = 'no-enclosing'
+        self.assertIn(' note = {a, b},\n', format_library(self.library))
+
+    def test_failed_block_without_raw(self):
+        from bibtexparser.model import DuplicateBlockKeyBlock
+        block = DuplicateBlockKeyBlock(key='Doe2000', previous_block=None, duplicate_block=None, start_line=None, raw=None)
+        with self.assertRaises(ValueError):
+            write_library(self.library.blocks + [block], io.StringIO())
+
+
+class TestCompactEntry(unittest.TestCase):
+
+    def setUp(self):
+        self.entry = parse_string(BIB).entries[0]
+        self.compact = CompactEntry.from_entry(self.entry)
+
+    def test_access(self):
+        e, c = self.entry, self.compact
+        self.assertEqual(c.items(), e.items())
+        self.assertEqual(list(c), list(e))
+        self.assertEqual(len(c), len(e.fields))
+        for k in ['ID', 'ENTRYTYPE', 'author', 'journal', 'missing']:
+            self.assertEqual(get_entry_val(c, k, 'default'), get_entry_val(e, k, 'default'))
+            self.assertEqual(k in c, k in e)
+        self.assertEqual(c['abstract'], e['abstract'])
+        with self.assertRaises(KeyError):
+            c['missing']
+
+    def test_field_names_shared(self):
+        other = CompactEntry.from_entry(parse_string(BIB).entries[0])
+        self.assertIs(other._index, self.compact._index)
+
+    def test_set_and_delete(self):
+        c = self.compact
+        c['year'] = '2001'
+        c['doi'] = '10.1000/xyz'
+        del c['abstract']
+        c['ID'] = 'Doe2001'
+        self.assertEqual(c.items()[1:], [('ID', 'Doe2001'), ('author', 'Doe, John'), ('journal', 'bar'),
+                                         ('year', '2001'), ('doi', '10.1000/xyz')])
+        # the entry it was made from is left alone
+        self.assertEqual(self.entry['year'], '2000')
+
+    def test_to_entry_formats_as_entry(self):
+        self.assertEqual(format_library([self.compact.to_entry()]), format_library([self.entry]))
+        self.entry.fields[0].enclosing = 'no-enclosing'
+        compact = CompactEntry.from_entry(self.entry)
+        self.assertEqual(format_library([compact.to_entry()]), format_library([self.entry]))
+        compact['author'] = 'Doe, Jane'
+        self.assertIsNone(compact.to_entry().fields[0].enclosing)
+
+
+class TestEntryFingerprint(unittest.TestCase):
+
+    def setUp(self):
+        self.d = {'ENTRYTYPE': 'article', 'ID': 'Doe2000', 'author': 'Doe, John', 'title': 'Ünïcode', 'year': '2000'}
+        self.entry = entry_from_dict(self.d)
+
+    def test_equal_content(self):
+        other = entry_from_dict(dict(reversed(list(self.d.items()))))
+        self.assertEqual(entry_fingerprint(other), entry_fingerprint(self.entry))
+        self.assertEqual(entry_fingerprint(self.d), entry_fingerprint(self.entry))
+        self.assertTrue(entry_content_equal(self.d, self.entry))
+
+    def test_invalidated_on_change(self):
+        before = entry_fingerprint(self.entry)
+        for change in [lambda e: e.__setitem__('title', 'other'), lambda e: e.__delitem__('year'),
+                       lambda e: setattr(e, 'key', 'Doe2001'), lambda e: setattr(e, 'entry_type', 'book')]:
+            e = entry_from_dict(self.d)
+            self.assertEqual(entry_fingerprint(e), before)
+            change(e)
+            self.assertNotEqual(entry_fingerprint(e), before)
+            self.assertFalse(entry_content_equal(e, self.entry))
+
+    def test_entries_unchanged(self):
+        # the cache is not stored on the entries, which bibtexparser compares by __dict__
+        other = entry_from_dict(self.d)
+        entry_fingerprint(self.entry)
+        self.assertEqual(self.entry, other)
+        self.assertEqual(pickle.loads(pickle.dumps(self.entry)).__dict__.keys(), other.__dict__.keys())
+
+    def test_skip_keys(self):
+        other = entry_from_dict(dict(self.d, ID='Other'))
+        self.assertFalse(entry_content_equal(other, self.entry))
+        self.assertTrue(entry_content_equal(other, self.entry, skip_keys=('ID',)))
+        self.assertEqual(entry_fingerprint(other, ('ID',)), entry_fingerprint(self.entry, ('ID',)))
+
+    def test_stable_across_runs(self):
+        # a digest of the content, independent of the hash seed
+        entry = pickle.loads(pickle.dumps(self.entry))
+        code = 'import pickle, sys; from papers.entries import entry_fingerprint; print(entry_fingerprint(pickle.loads(sys.stdin.buffer.read())))'
+        for seed in ['1', '2']:
+            out = subprocess.run([sys.executable, '-c', code], input=pickle.dumps(self.d), capture_output=True,
+                                 env=dict(os.environ, PYTHONHASHSEED=seed), check=True).stdout.decode().strip()
+            self.assertEqual(out, entry_fingerprint(entry))
@@ -190,3 +190,172 @@ class TestCollectPdfFiles(unittest.TestCase):
             found = _collect_pdf_files([d], recursive=True)
             names = sorted(Path(f).name for f in found)
             self.assertEqual(names, ["a.pdf", "b.PDF", "c.pdf"])
+
+
+class TestPdfReader(unittest.TestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        import os, tempfile
+        import fitz
+        cls._tmp = tempfile.TemporaryDirectory()
+        cls.pdf = os.path.join(cls._tmp.name, "paper.pdf")
+        doc = fitz.open()
+        for i in range(6):
+            page = doc.new_page()
+            text = f"page{i+1} " + " ".join(["word"] * 79)
+            if i == 0:
+                text = "doi:10.5194/bg-8-515-2011 " + text
+            page.insert_textbox(fitz.Rect(50, 50, 550, 800), text)
+        doc.save(cls.pdf)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls._tmp.cleanup()
+
+    def test_document_opened_once(self):
+        from unittest import mock
+        import fitz
+        from papers.extract import extract_pdf_doi
+        with mock.patch('fitz.open', side_effect=fitz.open) as opened:
+            self.assertEqual(extract_pdf_doi(self.pdf), '10.5194/bg-8-515-2011')
+        self.assertEqual(opened.call_count, 1)
+
+    def test_head_stops_at_minwords(self):
+        from papers.extract import PdfReader
+        with PdfReader(self.pdf) as reader:
+            pages = []
+            reader.pages = lambda maxpages, pages_=reader.pages: (pages.append(p) or p for p in pages_(maxpages))
+            txt = reader.head(maxpages=10, minwords=200)
+        self.assertEqual(len(pages), 3)  # 80 words each
+        self.assertIn('page3', txt)
+        self.assertNotIn('page4', txt)
+
+    def test_pdfhead_as_per_page_reads(self):
+        from papers.extract import pdfhead, readpdf
+        expected = ''.join(readpdf(self.pdf, first=i, last=i) for i in range(1, 4))
+        self.assertEqual(pdfhead(self.pdf, minwords=200), expected)
+        self.assertEqual(len(pdfhead(self.pdf, minwords=10000).split()), 6 * 80 + 1)
+        self.assertEqual(readpdf(self.pdf, first=5), readpdf(self.pdf, first=5, last=6))
+
+    def test_image_pages_bounded(self):
+        from unittest import mock
+        from papers.extract import PdfReader
+        with mock.patch('papers.ocr.tesseract') as ocr:
+            with PdfReader(self.pdf, image=True) as reader:
+                self.assertEqual(len(list(reader.pages())), 6)
+                self.assertEqual(len(list(reader.pages(maxpages=3))), 3)
+        ocr.assert_not_called()  # the pages have a text layer
+
+    def test_not_a_file(self):
+        from papers.extract import PdfReader
+        with self.assertRaises(ValueError):
+            PdfReader(self.pdf + '.missing')
+
+
+class TestMetadataDoiFastPath(unittest.TestCase):
+
+    def setUp(self):
+        import tempfile
+        self._tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def make_pdf(self, metadata=None, xmp=None, **save):
+        import os
+        import fitz
+        doc = fitz.open()
+        doc.new_page()
+        if metadata:
+            doc.set_metadata(metadata)
+        if xmp:
+            doc.set_xml_metadata(xmp)
+        pdf = os.path.join(self._tmp.name, f'{len(os.listdir(self._tmp.name))}.pdf')
+        doc.save(pdf, **save)
+        return pdf
+
+    def assertSameAsFitz(self, pdf, doi):
+        from papers.extract import parse_doi_from_pdf_metadata_mmap, parse_doi_from_pdf_metadata_fitz
+        self.assertEqual(parse_doi_from_pdf_metadata_mmap(pdf), doi)
+        self.assertEqual(parse_doi_from_pdf_metadata_fitz(pdf), doi)
+
+    def test_xmp(self):
+        xmp = '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF><rdf:Description>' \
+              '<crossmark:DOI>10.5194/bg-8-515-2011</crossmark:DOI></rdf:Description></rdf:RDF></x:xmpmeta>'
+        self.assertSameAsFitz(self.make_pdf(xmp=xmp), '10.5194/bg-8-515-2011')
+
+    def test_info(self):
+        self.assertSameAsFitz(self.make_pdf({'subject': 'doi:10.1029/2019GL082487'}), '10.1029/2019GL082487')
+        # escaped parentheses, and UTF-16 hex string
+        self.assertSameAsFitz(self.make_pdf({'title': 'Ocean (2019) 10.1029/2019GL082487 ü€'}), '10.1029/2019GL082487')
+
+    def make_objstm_pdf(self, document_doi='none', page_doi='none'):
+        "catalog and page in an object stream, with an XMP packet each (MuPDF keeps the catalog out)"
+        import os
+        import struct
+        xmp = '<x:xmpmeta xmlns:x="adobe:ns:meta/"><prism:doi>{}</prism:doi></x:xmpmeta>'.format
+        objects = [b'<</Type/Catalog/Pages 2 0 R/Metadata 5 0 R>>', b'<</Type/Pages/Count 1/Kids[3 0 R]>>',
+                   b'<</Type/Page/Parent 2 0 R/MediaBox[0 0 595 842]/Metadata 4 0 R>>']
+        header = b' '.join(b'%d %d' % (n + 1, sum(len(o) + 1 for o in objects[:n])) for n in range(3)) + b'\n'
+        out = bytearray(b'%PDF-1.7\n')
+        offsets = {}
+
+        def add(num, dictionary, stream):
+            offsets[num] = len(out)
+            out.extend(b'%d 0 obj\n<<%s/Length %d>>\nstream\n%s\nendstream\nendobj\n' % (num, dictionary, len(stream), stream))
+
+        add(4, b'/Type/Metadata/Subtype/XML', xmp(page_doi).encode())
+        add(5, b'/Type/Metadata/Subtype/XML', xmp(document_doi).encode())
+        add(6, b'/Type/ObjStm/N 3/First %d' % len(header), header + b'\n'.join(objects) + b'\n')
+        offsets[7] = len(out)
+        rows = [struct.pack('>BIH', 0, 0, 65535)] + [struct.pack('>BIH', 2, 6, i) for i in range(3)] \
+            + [struct.pack('>BIH', 1, offsets[n], 0) for n in (4, 5, 6, 7)]
+        add(7, b'/Type/XRef/Size 8/W[1 4 2]/Root 1 0 R', b''.join(rows))
+        out.extend(b'startxref\n%d\n%%%%EOF\n' % offsets[7])
+        pdf = os.path.join(self._tmp.name, f'{len(os.listdir(self._tmp.name))}.pdf')
+        open(pdf, 'wb').write(out)
+        return pdf
+
+    def test_cross_reference_stream(self):
+        xmp = '<x:xmpmeta xmlns:x="adobe:ns:meta/"><prism:doi>10.1000/objstm</prism:doi></x:xmpmeta>'
+        self.assertSameAsFitz(self.make_pdf(xmp=xmp, use_objstms=1, garbage=1), '10.1000/objstm')
+        self.assertSameAsFitz(self.make_pdf({'subject': 'doi:10.1000/info'}, use_objstms=1, garbage=1), '10.1000/info')
+
+    def test_catalog_in_object_stream(self):
+        from papers.extract import parse_doi_from_pdf_metadata_mmap, parse_doi_from_pdf_metadata
+        pdf = self.make_objstm_pdf(document_doi='10.1000/document')
+        self.assertIsNone(parse_doi_from_pdf_metadata_mmap(pdf))  # left to fitz
+        self.assertEqual(parse_doi_from_pdf_metadata(pdf), '10.1000/document')
+        # the XMP packet of a page (or of an image, a form) is not the document's
+        self.assertSameAsFitz(self.make_objstm_pdf(page_doi='10.1000/figure'), None)
+
+    def test_last_info(self):
+        import fitz
+        pdf = self.make_pdf({'subject': 'doi:10.1000/first'})
+        doc = fitz.open(pdf)
+        doc.set_metadata({'subject': 'doi:10.1000/second'})
+        doc.saveIncr()
+        self.assertSameAsFitz(pdf, '10.1000/second')
+
+    def test_no_doi(self):
+        import os
+        self.assertSameAsFitz(self.make_pdf({'title': 'no doi'}), None)
+        self.assertSameAsFitz(os.path.join(os.path.dirname(__file__), 'downloadedpapers', 'bg-8-515-2011.pdf'), None)
+
+    def test_encrypted_left_to_fitz(self):
+        import fitz
+        from papers.extract import parse_doi_from_pdf_metadata_mmap, parse_doi_from_pdf_metadata
+        pdf = self.make_pdf({'subject': 'doi:10.1000/xyz'}, encryption=fitz.PDF_ENCRYPT_AES_256, owner_pw='owner', user_pw='')
+        self.assertIsNone(parse_doi_from_pdf_metadata_mmap(pdf))
+        self.assertEqual(parse_doi_from_pdf_metadata(pdf), '10.1000/xyz')
+
+    def test_document_not_opened(self):
+        from unittest import mock
+        import fitz
+        from papers.extract import PdfReader
+        pdf = self.make_pdf({'keywords': 'doi:10.1000/xyz'})
+        with mock.patch('fitz.open', side_effect=fitz.open) as opened:
+            with PdfReader(pdf) as reader:
+                self.assertEqual(reader.metadata_doi(), '10.1000/xyz')
+        self.assertEqual(opened.call_count, 0)
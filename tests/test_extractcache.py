@@ -0,0 +1,135 @@
+"""Unit tests for papers.extractcache (persistent cache of the text and DOI extracted from PDFs)"""
+import json
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import fitz
+
+import papers.config as pconfig
+import papers.extractcache as extractcache
+from papers.extract import pdfhead, extract_pdf_doi, parse_doi_from_pdf_metadata_mmap
+from tests.common import speedy_paperscmd
+
+
+class TestExtractionCache(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.pdf = self.make_pdf('paper.pdf', 'doi:10.5194/bg-8-515-2011 ' + 'ocean ice ' * 150)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def make_pdf(self, name, text):
+        doc = fitz.open()
+        doc.new_page().insert_textbox(fitz.Rect(50, 50, 550, 800), text)
+        file = os.path.join(self._tmp.name, name)
+        doc.save(file)
+        return file
+
+    def test_pdfhead_read_once(self):
+        first = pdfhead(self.pdf)
+        with mock.patch('fitz.open', side_effect=fitz.open) as opened:
+            self.assertEqual(pdfhead(self.pdf), first)
+            self.assertEqual(opened.call_count, 0)
+            pdfhead(self.pdf, minwords=10)  # other settings
+            self.assertEqual(opened.call_count, 1)
+
+    def test_copy_and_modified_file(self):
+        txt = pdfhead(self.pdf)
+        copy = os.path.join(self._tmp.name, 'copy.pdf')
+        shutil.copy(self.pdf, copy)
+        with mock.patch('fitz.open', side_effect=fitz.open) as opened:
+            self.assertEqual(pdfhead(copy), txt)
+        self.assertEqual(opened.call_count, 0)
+        other = self.make_pdf('paper.pdf', 'doi:10.1029/2019GL082487 ' + 'ocean ice ' * 150)
+        self.assertIn('2019GL082487', pdfhead(other))
+
+    def test_extract_pdf_doi(self):
+        self.assertEqual(extract_pdf_doi(self.pdf), '10.5194/bg-8-515-2011')
+        with mock.patch('fitz.open', side_effect=fitz.open) as opened:
+            self.assertEqual(extract_pdf_doi(self.pdf), '10.5194/bg-8-515-2011')
+        self.assertEqual(opened.call_count, 0)
+
+    def test_metadata_doi_not_hashed(self):
+        doc = fitz.open(self.pdf)
+        doc.set_metadata({'subject': 'doi:10.1029/2019GL082487'})
+        doc.saveIncr()
+        with mock.patch('papers.checksums.checksum') as hashed:
+            self.assertEqual(extract_pdf_doi(self.pdf), '10.1029/2019GL082487')
+        hashed.assert_not_called()
+
+    def test_metadata_scanned_once(self):
+        with mock.patch('papers.extract.parse_doi_from_pdf_metadata_mmap', wraps=parse_doi_from_pdf_metadata_mmap) as scanned:
+            self.assertEqual(extract_pdf_doi(self.pdf), '10.5194/bg-8-515-2011')
+        self.assertEqual(scanned.call_count, 1)
+
+    def test_no_doi_cached(self):
+        nodoi = self.make_pdf('nodoi.pdf', 'ocean ice ' * 150)
+        for i in range(2):
+            with self.assertRaises(ValueError):
+                extract_pdf_doi(nodoi)
+        self.assertIsNone(extractcache.get(nodoi, extractcache.settings_key('doi', 10, 200, False)))
+
+    def test_persisted(self):
+        txt = pdfhead(self.pdf)
+        extractcache.flush()
+        data = json.load(open(extractcache.cache_file()))
+        self.assertEqual(data['version'], extractcache.VERSION)
+        self.assertEqual(list(data['records'].values()), [{'head:10:200:0': txt}])
+
+    def test_version_change(self):
+        pdfhead(self.pdf)
+        extractcache.flush()
+        with mock.patch.object(extractcache, 'VERSION', extractcache.VERSION + 1):
+            self.assertEqual(extractcache._cache.load(extractcache.cache_file()), {})
+
+    def test_hits_not_persisted(self):
+        pdfhead(self.pdf)
+        extractcache.flush()
+        written = os.stat(extractcache.cache_file())
+        extractcache._cache.reset()  # as a new process
+        pdfhead(self.pdf)
+        extractcache.flush()
+        self.assertEqual(os.stat(extractcache.cache_file()).st_ino, written.st_ino)  # not replaced
+
+    def test_dry_run_not_persisted(self):
+        pdfhead(self.pdf)
+        with mock.patch.object(pconfig, 'DRYRUN', True):
+            extractcache.flush()
+        self.assertFalse(os.path.exists(extractcache.cache_file()))
+
+    def test_least_recently_used_evicted(self):
+        files = [self.make_pdf(f'{i}.pdf', f'paper {i} ' + 'ocean ice ' * 150) for i in range(4)]
+        for file in files:
+            pdfhead(file)
+        pdfhead(files[0])  # used again
+        # records of ~1600 bytes
+        with mock.patch.object(extractcache, 'CACHE_MAX_BYTES', 4000):
+            extractcache.flush()
+        records = json.load(open(extractcache.cache_file()))['records']
+        self.assertEqual(len(records), 2)
+        self.assertTrue(all('paper 0 ' in r['head:10:200:0'] or 'paper 3 ' in r['head:10:200:0'] for r in records.values()))
+
+    def test_prune_and_stats(self):
+        for i in range(3):
+            pdfhead(self.make_pdf(f'{i}.pdf', f'paper {i} ' + 'ocean ice ' * 150), image=False)
+        stats = extractcache.stats()
+        self.assertEqual(stats['files'], 3)
+        self.assertEqual(stats['settings'], {'10:200:0': 3})
+        self.assertEqual(extractcache.prune(2000), 2)
+        self.assertEqual(extractcache.stats()['files'], 1)
+        self.assertEqual(extractcache.prune(0), 1)
+        self.assertEqual(json.load(open(extractcache.cache_file()))['records'], {})
+
+    def test_cache_command(self):
+        pdfhead(self.pdf)
+        out = speedy_paperscmd('cache', sp_cmd='check_output')
+        self.assertIn('1 PDF files', out)
+        self.assertIn('1 read with maxpages=10 minwords=200', out)
+        out = speedy_paperscmd('cache clear', sp_cmd='check_output')
+        self.assertIn('removed 1 PDF files', out)
+        self.assertEqual(extractcache.stats()['files'], 0)
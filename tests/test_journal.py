@@ -0,0 +1,92 @@
+"""Unit tests for papers.journal (changes made to a Biblio by a command)"""
+import os
+import tempfile
+import unittest
+
+from papers.bib import Biblio
+from papers.journal import Journal
+
+
+BIB = """@article{Doe2000,
+ author = {Doe, John},
+ file = {:/some/doe2000.pdf:pdf},
+ title = {First title},
+ year = {2000}
+}
+
+@article{Smith2010,
+ author = {Smith, Jane},
+ title = {Second title},
+ year = {2010}
+}
+
+@misc{Zeta,
+ title = {Last}
+}
+"""
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.biblio = Biblio.loads(BIB, '')
+        self.journal = Journal(self.biblio)
+        self.doe, self.smith, self.zeta = (self.biblio.db.entries_dict[k] for k in ['Doe2000', 'Smith2010', 'Zeta'])
+
+    def test_no_change(self):
+        self.assertEqual(self.journal.records(), [])
+        self.assertEqual(self.journal.summary(), '')
+        self.assertTrue(all(a is b for a, b in zip(self.journal.entries_before(), self.biblio.entries)))
+
+    def test_records(self):
+        self.doe['title'] = 'New title'
+        self.biblio.db.remove(self.smith)
+        self.zeta.key = 'Omega'
+        new = Biblio.loads('@misc{New,\n title = {new}\n}\n', '').entries[0]
+        self.biblio.db.add(new)
+        records = {(action, (before or after).key): (before, after) for action, before, after in self.journal.records()}
+        self.assertEqual(set(records), {('modify', 'Doe2000'), ('remove', 'Smith2010'), ('rename', 'Zeta'), ('add', 'New')})
+        before, after = records['modify', 'Doe2000']
+        self.assertEqual(before['title'], 'First title')
+        self.assertIs(after, self.doe)
+        self.assertEqual(records['rename', 'Zeta'][1].key, 'Omega')
+        self.assertEqual(self.journal.summary(), 'Added: New\nRemoved: Smith2010\nRenamed: Zeta -> Omega\nModified: Doe2000')
+
+    def test_entries_before(self):
+        self.doe['title'] = 'New title'
+        del self.smith['year']
+        self.zeta.key = 'Omega'
+        before = {e.key: e for e in self.journal.entries_before()}
+        self.assertEqual(sorted(before), ['Doe2000', 'Smith2010', 'Zeta'])
+        self.assertEqual(before['Doe2000']['title'], 'First title')
+        self.assertEqual(before['Smith2010']['year'], '2010')
+        self.assertIsNot(before['Doe2000'], self.doe)
+
+    def test_undo(self):
+        text = self.biblio.format()
+        filesdir = self.biblio.filesdir
+        self.doe['title'] = 'New title'
+        self.biblio.set_files(self.doe, ['/elsewhere/doe.pdf'])
+        self.biblio.db.remove(self.smith)
+        self.zeta.key = 'Omega'
+        self.biblio.db.add(Biblio.loads('@misc{New,\n title = {new}\n}\n', '').entries[0])
+        self.biblio.filesdir = '/tmp/other'
+        self.journal.undo()
+        self.assertEqual(self.biblio.format(), text)
+        self.assertEqual(self.biblio.filesdir, filesdir)
+        self.assertIs(self.biblio.db.entries_dict['Doe2000'], self.doe)
+        self.assertEqual(self.journal.records(), [])
+
+    def test_undo_after_save(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            bibtex = os.path.join(tmp, 'papers.bib')
+            open(bibtex, 'w').write(BIB)
+            biblio = Biblio.load(bibtex, '')
+            journal = Journal(biblio)
+            biblio.entries[0]['title'] = 'Changed'
+            biblio.save(os.path.join(tmp, 'other.bib'))
+            journal.undo()
+            # tracking of the loaded file is back: nothing to save
+            self.assertEqual(biblio.changes(), ([], [], []))
+            biblio.save(bibtex)
+            self.assertEqual(open(bibtex).read(), BIB)
@@ -0,0 +1,106 @@
+"""Unit tests for papers.keyindex (key -> byte range index next to the bibtex)"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from papers.config import Config
+from papers.bib import Biblio, stream_biblio
+from papers.keyindex import index_file, read_index, read_indexed_entries
+
+
+BIB = """@string{jgr = {Journal of Geophysical Research}}
+
+@article{Doe2000,
+ author = {Doë, Jöhn},
+ journal = jgr,
+ title = {Ünïcode title},
+ year = {2000}
+}
+
+@article{Smith2010,
+ author = {Smith, Jane},
+ title = {Second title},
+ year = {2010}
+}
+
+@misc{Zeta,
+ title = {Last}
+}
+"""
+
+
+class TestKeyIndex(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.bibtex = os.path.join(self._tmp.name, 'papers.bib')
+        open(self.bibtex, 'w').write(BIB)
+        self.biblio = Biblio.load(self.bibtex, '')
+        self.biblio.save(self.bibtex)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def test_index_written_on_save(self):
+        self.assertTrue(os.path.exists(index_file(self.bibtex)))
+        index = read_index(self.bibtex)
+        self.assertEqual(list(index['entries']), ['Doe2000', 'Smith2010', 'Zeta'])
+
+    def test_byte_ranges(self):
+        index = read_index(self.bibtex)
+        data = open(self.bibtex, 'rb').read()
+        for key, (start, end) in index['entries'].items():
+            block = data[start:end].decode(index['encoding'])
+            self.assertTrue(block.startswith('@'), block)
+            self.assertIn('{'+key+',', block)
+            self.assertTrue(block.endswith('}\n'), block)
+
+    def test_read_indexed_entries(self):
+        index = read_index(self.bibtex)
+        entries = read_indexed_entries(self.bibtex, index, ['Zeta', 'Doe2000'])
+        self.assertEqual([e.key for e in entries], ['Doe2000', 'Zeta'])
+        self.assertEqual(entries[0]['title'], 'Ünïcode title')
+        # @string references are resolved
+        self.assertEqual(entries[0]['journal'], 'Journal of Geophysical Research')
+
+    def test_stale_index(self):
+        open(self.bibtex, 'a').write('\n@misc{New,\n title = {new}\n}\n')
+        self.assertIsNone(read_index(self.bibtex))
+
+    def test_index_updated_by_incremental_save(self):
+        biblio = Biblio.load(self.bibtex, '')
+        biblio.db.remove(biblio.db.entries_dict['Smith2010'])
+        biblio.db.entries_dict['Doe2000']['title'] = 'A longer title than before'
+        biblio.save(self.bibtex)
+        index = read_index(self.bibtex)
+        self.assertEqual(list(index['entries']), ['Doe2000', 'Zeta'])
+        entries = read_indexed_entries(self.bibtex, index, ['Zeta', 'Doe2000'])
+        self.assertEqual(entries[0]['title'], 'A longer title than before')
+        self.assertEqual(entries[1]['title'], 'Last')
+
+    def test_mismatch_returns_none(self):
+        index = read_index(self.bibtex)
+        index['entries']['Zeta'] = index['entries']['Smith2010']
+        self.assertIsNone(read_indexed_entries(self.bibtex, index, ['Zeta']))
+
+    def test_stream_biblio_uses_index(self):
+        config = Config(bibtex=self.bibtex, filesdir=self._tmp.name, absolute_paths=True)
+        with mock.patch('papers.bib.iter_entries') as iter_entries:
+            biblio, entries = stream_biblio(config, key_filter=lambda k: k.lower() == 'smith2010')
+            self.assertEqual([e.key for e in entries], ['Smith2010'])
+            iter_entries.assert_not_called()
+
+    def test_stream_biblio_falls_back_without_index(self):
+        os.remove(index_file(self.bibtex))
+        config = Config(bibtex=self.bibtex, filesdir=self._tmp.name, absolute_paths=True)
+        biblio, entries = stream_biblio(config, key_filter=lambda k: k == 'Smith2010')
+        # all entries: the caller filters
+        self.assertEqual([e.key for e in entries], ['Doe2000', 'Smith2010', 'Zeta'])
+
+    def test_stream_biblio_compact(self):
+        config = Config(bibtex=self.bibtex, filesdir=self._tmp.name, absolute_paths=True)
+        biblio, entries = stream_biblio(config, compact=True)
+        entries = list(entries)
+        self.assertEqual([type(e).__name__ for e in entries], ['CompactEntry']*3)
+        self.assertEqual([e['title'] for e in entries], ['Ünïcode title', 'Second title', 'Last'])
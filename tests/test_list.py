@@ -182,6 +182,12 @@ class ListDuplicatesTest(LocalInstallTest):
         self.assertIn('Entry1', out)
         self.assertIn('Entry2', out)
 
+    def test_list_duplicates_compact(self):
+        out = self.papers('list --plain --duplicates --compact', sp_cmd='check_output')
+        self.assertEqual(out, self.papers('list --plain --duplicates', sp_cmd='check_output'))
+        self.assertIn('Entry1', out)
+        self.assertIn('Entry2', out)
+
 
 class ListReviewRequiredTest(LocalInstallTest):
     """papers list --review-required lists suspicious entries (invalid doi, missing fields, etc.)"""
@@ -286,3 +292,51 @@ class ViewerPassthroughNoInstallTest(BaseTest):
         with patch('papers.__main__.view_pdf') as viewer:
             self.papers(f'{f}')
             viewer.assert_called_once_with(f)
+
+
+class StreamingListTest(ListTest):
+    initial_content = bibtex + """
+
+@article{Smith_2020,
+ author = {J. Smith},
+ title = {Another title},
+ year = {2020}
+}
+
+@misc{Zeta_1999,
+ title = {Last one},
+ year = {1999}
+}"""
+
+    def test_list_all_same_as_full_format(self):
+        # read-only listing prints entries as they are parsed, with the same output
+        out = self.papers('list --plain', sp_cmd='check_output')
+        self.assertMultiLineEqual(out, self.initial_content)
+
+    def test_list_filtered_stream(self):
+        out = self.papers('list --plain --year 20', sp_cmd='check_output')
+        self.assertMultiLineEqual(out, self.initial_content.split('\n\n@misc')[0])
+        out = self.papers('list --key-only --year 20', sp_cmd='check_output')
+        self.assertEqual(out, "Perrette_2011\nSmith_2020")
+
+    def test_read_only_list_does_not_load_library(self):
+        from unittest.mock import patch
+        with patch('papers.__main__.get_biblio') as get_biblio:
+            out = self.papers('list --key-only', sp_cmd='check_output')
+            get_biblio.assert_not_called()
+        self.assertEqual(out, "Perrette_2011\nSmith_2020\nZeta_1999")
+
+    def test_open_stops_at_key(self):
+        # the library is read only until the requested key is found
+        from unittest.mock import patch
+        from papers.entries import iter_entries
+        read = []
+        def recording_iter_entries(path):
+            for e in iter_entries(path):
+                read.append(e.key)
+                yield e
+        with patch('papers.bib.iter_entries', recording_iter_entries), \
+                patch('papers.__main__.view_entry_files') as view:
+            self.papers('open perrette_2011')
+            self.assertEqual(view.call_count, 1)
+        self.assertEqual(read, ['Perrette_2011'])
@@ -0,0 +1,110 @@
+"""Unit tests for papers.ocr (OCR of the pages without a text layer; tesseract is mocked)"""
+import os
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+import fitz
+
+from papers import ocr
+from papers.extract import PdfReader, readpdf_image
+
+
+def _fake_tesseract(images, lang='eng', threads=None):
+    # enough words for a page, and the width of the page in points to tell the pages apart
+    return [' '.join(['scanned'] * 150 + [f'width{round(width * 72 / dpi)}']) for width, height, samples, dpi in images]
+
+
+class TestMultipageTiff(unittest.TestCase):
+
+    def test_read_back(self):
+        images = [(3, 2, bytes(range(6)), 72), (5, 1, b'\xff\x80\xff\x80\xff', 72)]
+        doc = fitz.open(stream=ocr.multipage_tiff(images), filetype='tiff')
+        self.assertEqual(len(doc), 2)
+        for page, (width, height, samples, dpi) in zip(doc, images):
+            pixmap = page.get_pixmap(colorspace=fitz.csGRAY)
+            self.assertEqual((pixmap.width, pixmap.height), (width, height))
+            self.assertEqual(pixmap.samples, samples)
+
+    def test_tesseract_pages(self):
+        run = mock.Mock(return_value=mock.Mock(stdout=b'first page\n\x0csecond page\n\x0c'))
+        with mock.patch('papers.ocr.sp.run', run):
+            texts = ocr.tesseract([(1, 1, b'\0', 72), (1, 1, b'\0', 72)], threads=1)
+        self.assertEqual(texts, ['first page\n', 'second page\n'])
+        self.assertEqual(run.call_args.args[0][:3], ['tesseract', 'stdin', 'stdout'])
+        self.assertEqual(run.call_args.kwargs['env']['OMP_THREAD_LIMIT'], '1')
+        self.assertTrue(run.call_args.kwargs['input'].startswith(b'II*\0'))
+
+
+class TestPageTexts(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.batches = []
+        self.lock = threading.Lock()
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def tesseract(self, images, *args):
+        with self.lock:
+            self.batches.append([round(width * 72 / dpi) for width, height, samples, dpi in images])
+        return _fake_tesseract(images)
+
+    def make_pdf(self, text_pages, count=8):
+        "pages of width 100+i, blank (scanned) except text_pages"
+        doc = fitz.open()
+        for i in range(count):
+            page = doc.new_page(width=100 + i, height=200)
+            if i in text_pages:
+                page.insert_textbox(fitz.Rect(5, 5, 95, 195), ' '.join(['text'] * 20), fontsize=4)
+        file = os.path.join(self._tmp.name, 'scan.pdf')
+        doc.save(file)
+        return file
+
+    def test_only_pages_without_text_layer(self):
+        pdf = self.make_pdf(text_pages=[1, 4])
+        with mock.patch('papers.ocr.tesseract', self.tesseract), fitz.open(pdf) as doc:
+            texts = list(ocr.page_texts(doc, jobs=2, batch_size=2))
+        self.assertEqual(len(texts), 8)
+        for i, txt in enumerate(texts):
+            self.assertIn('text' if i in (1, 4) else f'width{100+i}', txt)
+        self.assertEqual(sorted(w for batch in self.batches for w in batch), [100, 102, 103, 105, 106, 107])
+        self.assertEqual(self.batches[0], [100])  # first page alone
+        self.assertTrue(all(len(batch) <= 2 for batch in self.batches))
+
+    def test_head_stops_early(self):
+        pdf = self.make_pdf(text_pages=[], count=10)
+        with mock.patch('papers.ocr.tesseract', self.tesseract), mock.patch.object(ocr, 'OCR_JOBS', 4):
+            with PdfReader(pdf, image=True) as reader:
+                txt = reader.head(maxpages=10, minwords=200)
+        self.assertIn('width101', txt)
+        self.assertNotIn('width102', txt)
+        # the second page is enough: no batch OCRed ahead
+        self.assertEqual(self.batches, [[100], [101, 102, 103, 104]])
+
+    def test_batches_ahead(self):
+        pdf = self.make_pdf(text_pages=[], count=13)
+        render = mock.Mock(side_effect=ocr.render_page)
+        with mock.patch('papers.ocr.tesseract', self.tesseract), mock.patch('papers.ocr.render_page', render), \
+                fitz.open(pdf) as doc:
+            texts = ocr.page_texts(doc, jobs=2, batch_size=4)
+            self.assertIn('width100', next(texts))
+            self.assertIn('width101', next(texts))
+            self.assertEqual(render.call_count, 5)
+            self.assertIn('width102', next(texts))  # one batch ahead, while the consumer reads
+            self.assertEqual(render.call_count, 9)
+            self.assertIn('width103', next(texts))  # as many batches as jobs
+            self.assertEqual(render.call_count, 9)
+            texts.close()
+
+    def test_readpdf_image_range(self):
+        pdf = self.make_pdf(text_pages=[3])
+        with mock.patch('papers.ocr.tesseract', self.tesseract):
+            txt = readpdf_image(pdf, first=3, last=5)
+        self.assertIn('width102', txt)
+        self.assertIn('text', txt)
+        self.assertIn('width104', txt)
+        self.assertNotIn('width101', txt)
+        self.assertNotIn('width105', txt)
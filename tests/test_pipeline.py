@@ -0,0 +1,121 @@
+"""Unit tests for papers.pipeline (staged, parallel extraction of PDF metadata)"""
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+import fitz
+
+import papers.config
+from papers.bib import Biblio
+from papers.pipeline import extract_pdfs_metadata
+from tests.common import speedy_paperscmd
+
+
+def _fake_bibtex(doi):
+    return '@article{{key, doi = {{{}}}, title = {{Paper {}}}, author = {{Doe, J.}}, year = {{2011}}}}'.format(doi, doi.split('-')[1])
+
+
+def _head_or_hang(pdf, *args):
+    # runs in the worker processes, hence defined at module level
+    if 'stuck' in os.path.basename(pdf):
+        time.sleep(60)
+    if 'slow' in os.path.basename(pdf):
+        time.sleep(2)
+    return 'doi:10.5194/bg-{}-515-2011'.format(os.path.basename(pdf).split('.')[0])
+
+
+class PipelineTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.files = []
+        for i in range(6):
+            self.files.append(self.make_pdf(f'{i}.pdf', f'doi:10.5194/bg-{i}-515-2011 ' + 'ocean ice ' * 120))
+        self.broken = os.path.join(self._tmp.name, 'broken.pdf')
+        open(self.broken, 'w').write('not a pdf')
+        patcher = mock.patch('papers.extract.fetch_bibtex_by_doi', side_effect=_fake_bibtex)
+        self.fetch = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def make_pdf(self, name, text):
+        doc = fitz.open()
+        doc.new_page().insert_textbox(fitz.Rect(50, 50, 550, 800), text)
+        file = os.path.join(self._tmp.name, name)
+        doc.save(file)
+        return file
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+
+class TestExtractPdfsMetadata(PipelineTestCase):
+
+    def test_sequential(self):
+        files = self.files[:2] + [self.broken] + self.files[2:]
+        results = list(extract_pdfs_metadata(files))
+        self.assertEqual([pdf for pdf, bibtex, error in results], files)
+        self.assertIsNotNone(results[2][2])
+        self.assertIsNone(results[2][1])
+        self.assertIn('bg-1-515-2011', results[1][1])
+
+    def test_parallel_as_sequential(self):
+        files = self.files[:2] + [self.broken] + self.files[2:]
+        expected = [(pdf, bibtex, type(error)) for pdf, bibtex, error in extract_pdfs_metadata(files)]
+        results = [(pdf, bibtex, type(error)) for pdf, bibtex, error in extract_pdfs_metadata(files, jobs=2, queue_size=3)]
+        self.assertEqual(results, expected)
+
+    def test_timeout(self):
+        stuck = os.path.join(self._tmp.name, 'stuck.pdf')
+        files = self.files[:2] + [stuck] + self.files[2:4]
+        start = time.time()
+        with mock.patch('papers.pipeline.readpdf_head', _head_or_hang):
+            results = list(extract_pdfs_metadata(files, jobs=2, timeout=3))
+        self.assertLess(time.time() - start, 30)
+        self.assertEqual([pdf for pdf, bibtex, error in results], files)
+        self.assertIsInstance(results[2][2], TimeoutError)
+        for pdf, bibtex, error in results[:2] + results[3:]:
+            self.assertIsNone(error)
+            self.assertIn(os.path.basename(pdf).split('.')[0] + '-515', bibtex)
+
+
+    def test_timeout_from_start(self):
+        # read at the same time as a slow file: its time runs before the slow file is yielded
+        slow, stuck = os.path.join(self._tmp.name, 'slow.pdf'), os.path.join(self._tmp.name, 'stuck.pdf')
+        with mock.patch('papers.pipeline.readpdf_head', _head_or_hang):
+            results = extract_pdfs_metadata([slow, stuck], jobs=2, timeout=4)
+            self.assertIsNone(next(results)[2])
+            start = time.time()
+            pdf, bibtex, error = next(results)
+        self.assertIsInstance(error, TimeoutError)
+        self.assertLess(time.time() - start, 3)
+
+    def test_timeout_shared_by_text_and_query(self):
+        slow = os.path.join(self._tmp.name, 'slow.pdf')
+
+        def slow_fetch(doi):
+            time.sleep(3)
+            return _fake_bibtex(doi)
+        with mock.patch('papers.pipeline.readpdf_head', _head_or_hang), mock.patch('papers.extract.fetch_bibtex_by_doi', slow_fetch):
+            [(pdf, bibtex, error)] = extract_pdfs_metadata([slow], jobs=2, timeout=4)
+        self.assertIsInstance(error, TimeoutError)
+
+
+class TestScanDirParallel(PipelineTestCase):
+
+    def test_scan_dir_order(self):
+        keys = []
+        for jobs in [1, 2]:
+            biblio = Biblio()
+            entries = biblio.scan_dir(self._tmp.name, jobs=jobs, check_duplicate=False)
+            keys.append([e['ID'] for e in entries])
+            self.assertEqual(len(biblio.entries), len(self.files))  # broken.pdf skipped
+        self.assertEqual(keys[0], keys[1])
+
+    def test_extract_command(self):
+        with mock.patch.object(papers.config, 'JOBS', 1):  # set by -j
+            out = speedy_paperscmd(f'extract {self.files[0]} {self.broken} {self.files[1]} -j 2', sp_cmd='check_output')
+        self.assertEqual([line for line in out.splitlines() if line.startswith('%')],
+                         ['% ' + self.files[0], '% ' + self.broken, '% ' + self.files[1]])
+        self.assertIn('bg-1-515-2011', out)
@@ -0,0 +1,245 @@
+"""Unit tests for papers.snapshot (persistent parsed-library cache)"""
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+import papers.config as pconfig
+import papers.snapshot as snapshot
+from papers.bib import Biblio
+from papers.keyindex import index_file
+from papers.entries import format_library, format_block, entry_from_dict, parse_string
+
+
+BIB = """@article{Doe2000,
+ author = {Doe, John},
+ title = {First title},
+ year = {2000}
+}
+
+@article{Smith2010,
+ author = {Smith, Jane},
+ month = feb,
+ title = {Second title},
+ year = {2010}
+}
+"""
+
+
+class BibtexTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.bibtex = os.path.join(self._tmp.name, 'papers.bib')
+        open(self.bibtex, 'w').write(BIB)
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+
+class TestSnapshot(BibtexTestCase):
+
+    def test_load_writes_then_reuses_snapshot(self):
+        lib = snapshot.load_library(self.bibtex)['library']
+        self.assertTrue(os.path.exists(snapshot.snapshot_file(self.bibtex)))
+        with mock.patch('papers.snapshot.parse_string') as parse:
+            lib2 = snapshot.load_library(self.bibtex)['library']
+            parse.assert_not_called()
+        self.assertEqual(format_library(lib2), format_library(lib))
+        self.assertEqual([e.key for e in lib2.entries], ['Doe2000', 'Smith2010'])
+        with mock.patch('papers.snapshot.parse_string') as parse:
+            biblio = Biblio.load(self.bibtex, '')
+            parse.assert_not_called()
+        self.assertEqual(biblio.format(), format_library(lib))
+
+    def test_modified_file_invalidates_snapshot(self):
+        snapshot.load_library(self.bibtex)
+        # same size and (possibly) same mtime tick: the content hash decides
+        open(self.bibtex, 'w').write(BIB.replace('First', 'FiRST'))
+        self.assertIsNone(snapshot.read_snapshot(self.bibtex, open(self.bibtex).read()))
+        lib = snapshot.load_library(self.bibtex)['library']
+        self.assertEqual(lib.entries[0]['title'], 'FiRST title')
+
+    def test_touched_file_invalidates_snapshot(self):
+        snapshot.load_library(self.bibtex)
+        st = os.stat(self.bibtex)
+        os.utime(self.bibtex, ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        self.assertIsNone(snapshot.read_snapshot(self.bibtex, BIB))
+
+    def test_corrupt_snapshot_is_ignored(self):
+        snapshot.load_library(self.bibtex)
+        open(snapshot.snapshot_file(self.bibtex), 'wb').write(b'corrupt')
+        lib = snapshot.load_library(self.bibtex)['library']
+        self.assertEqual(len(lib.entries), 2)
+
+    def test_other_papers_version_invalidates_snapshot(self):
+        biblio = Biblio.load(self.bibtex, '')
+        biblio.duplicate_index()
+        biblio.save(self.bibtex)
+        self.assertIsNotNone(Biblio.load(self.bibtex, '')._duplicate_index)
+        with mock.patch('papers.__version__', 'other'):
+            self.assertIsNone(snapshot.read_snapshot(self.bibtex, open(self.bibtex).read()))
+            self.assertIsNone(Biblio.load(self.bibtex, '')._duplicate_index)
+
+    def test_dryrun_does_not_write(self):
+        pconfig.DRYRUN = True
+        try:
+            snapshot.load_library(self.bibtex)
+        finally:
+            pconfig.DRYRUN = False
+        self.assertFalse(os.path.exists(snapshot.snapshot_file(self.bibtex)))
+
+    def test_prune(self):
+        for i in range(snapshot.SNAPSHOT_MAX_FILES + 3):
+            bib = os.path.join(self._tmp.name, f'lib{i}.bib')
+            open(bib, 'w').write(BIB)
+            snapshot.load_library(bib)
+        files = os.listdir(os.path.join(pconfig.CACHE_DIR, 'snapshots'))
+        self.assertEqual(len(files), snapshot.SNAPSHOT_MAX_FILES)
+
+    def test_biblio_save_refreshes_snapshot(self):
+        biblio = Biblio.load(self.bibtex, '')
+        biblio.entries[0]['title'] = 'Changed title'
+        biblio.save(self.bibtex)
+        payload = snapshot.read_snapshot(self.bibtex, open(self.bibtex).read())
+        self.assertIsNotNone(payload)
+        with mock.patch('papers.snapshot.parse_string') as parse:
+            biblio2 = Biblio.load(self.bibtex, '')
+            parse.assert_not_called()
+        self.assertEqual(biblio2.entries[0]['title'], 'Changed title')
+        self.assertEqual(biblio2.format(), open(self.bibtex).read())
+
+    def assertLoadedAsParsed(self, biblio):
+        parsed = parse_string(open(self.bibtex).read()).blocks
+        self.assertEqual(biblio.db.blocks, parsed)
+        # the snapshot gives what a parse gives
+        self.assertIsNotNone(snapshot.read_snapshot(self.bibtex, open(self.bibtex).read()))
+        self.assertEqual(Biblio.load(self.bibtex, '').db.blocks, parsed)
+
+    def test_saved_library_is_as_parsed(self):
+        biblio = Biblio.load(self.bibtex, '')
+        biblio.entries[0]['title'] = 'Changed title'
+        # int value, fields in another order than written
+        biblio.db.add(entry_from_dict({'ENTRYTYPE': 'article', 'ID': 'New2010', 'year': 2010, 'author': 'New, N'}))
+        biblio.save(self.bibtex)
+        self.assertLoadedAsParsed(biblio)
+
+
+RICH_BIB = """@string{foo = {bar}}
+
+@preamble{"hello"}
+
+% a comment on top of Beta
+@article{Beta2001,
+ author = {Beta, B},
+ month = feb,
+ title = {Beta title},
+ year = {2001}
+}
+
+@article{Alpha2000,
+ author = {Alpha, A},
+ title = {Alpha title with {braces}},
+ year = {2000}
+}
+
+@book{Gamma2002,
+ title = {Gamma}
+}
+"""
+
+
+class TestIncrementalSave(BibtexTestCase):
+
+    def setUp(self):
+        super().setUp()
+        open(self.bibtex, 'w').write(RICH_BIB)
+        # canonical form, with the layout stored in the snapshot
+        Biblio.load(self.bibtex, '').save(self.bibtex)
+        self.biblio = Biblio.load(self.bibtex, '')
+
+    def assertSavedAsFullRewrite(self, biblio):
+        text = open(self.bibtex).read()
+        # format() does not reuse anything from the file
+        self.assertEqual(text, biblio.format())
+        self.assertEqual(text, Biblio.loads(text, '').format())
+
+    def test_no_change(self):
+        self.assertEqual(self.biblio.changes(), ([], [], []))
+        before = open(self.bibtex).read()
+        with mock.patch('papers.bib.format_block') as format_block:
+            self.biblio.save(self.bibtex)
+            format_block.assert_not_called()
+        self.assertEqual(open(self.bibtex).read(), before)
+
+    def test_changes(self):
+        alpha, beta, gamma = (self.biblio.db.entries_dict[k] for k in ['Alpha2000', 'Beta2001', 'Gamma2002'])
+        alpha['title'] = 'New title'
+        self.biblio.db.remove(gamma)
+        new = Biblio.loads('@misc{Zeta,\n title = {z}\n}\n', '').entries[0]
+        self.biblio.db.add(new)
+        self.assertEqual(self.biblio.changes(), ([new], [gamma], [alpha]))
+
+    def test_only_changed_entries_are_formatted(self):
+        alpha = self.biblio.db.entries_dict['Alpha2000']
+        alpha['journal'] = 'Some journal'
+        with mock.patch('papers.bib.format_block', wraps=format_block) as mocked:
+            self.biblio.save(self.bibtex)
+            self.assertEqual(mocked.call_count, 1)
+        self.assertIn(' journal = {Some journal},\n', open(self.bibtex).read())
+        self.assertSavedAsFullRewrite(self.biblio)
+
+    def test_add_remove_rename(self):
+        db = self.biblio.db
+        db.remove(db.entries_dict['Gamma2002'])
+        db.add(Biblio.loads('@misc{Aaa,\n title = {first}\n}\n', '').entries)
+        db.add(Biblio.loads('@misc{Zzz,\n title = {last}\n}\n', '').entries)
+        # a new key moves the entry (and the comment on top of it)
+        db.entries_dict['Beta2001'].key = 'AlphaBeta'
+        self.biblio.save(self.bibtex)
+        self.assertSavedAsFullRewrite(self.biblio)
+        text = open(self.bibtex).read()
+        self.assertLess(text.index('@misc{Aaa'), text.index('% a comment on top of Beta'))
+        self.assertLess(text.index('@article{Alpha2000'), text.index('@article{AlphaBeta'))
+        self.assertTrue(text.endswith('@misc{Zzz,\n title = {last}\n}\n'))
+        # and again from the new layout
+        biblio = Biblio.load(self.bibtex, '')
+        biblio.db.remove(biblio.db.entries_dict['Aaa'])
+        biblio.save(self.bibtex)
+        self.assertSavedAsFullRewrite(biblio)
+
+    def test_remove_all(self):
+        self.biblio.entries = []
+        self.biblio.save(self.bibtex)
+        self.assertSavedAsFullRewrite(self.biblio)
+
+    def test_file_changed_on_disk_since_load(self):
+        open(self.bibtex, 'a').write('\n@misc{Other,\n title = {x}\n}\n')
+        self.biblio.db.entries_dict['Alpha2000']['title'] = 'New'
+        self.biblio.save(self.bibtex)
+        self.assertSavedAsFullRewrite(self.biblio)
+        self.assertNotIn('Other', open(self.bibtex).read())
+
+    def test_saved_library_is_as_parsed(self):
+        self.biblio.db.entries_dict['Beta2001']['title'] = 'New title'
+        self.biblio.db.add(entry_from_dict({'ENTRYTYPE': 'misc', 'ID': 'Aaa', 'year': 1999}))
+        self.biblio.save(self.bibtex)
+        TestSnapshot.assertLoadedAsParsed(self, self.biblio)
+
+    def test_save_copy_without_cache(self):
+        other = os.path.join(self._tmp.name, 'other.bib')
+        self.biblio.save(other, cache=False)
+        self.assertEqual(open(other).read(), open(self.bibtex).read())
+        self.assertFalse(os.path.exists(snapshot.snapshot_file(other)))
+        self.assertFalse(os.path.exists(index_file(other)))
+        # still incremental for the library's own file
+        with mock.patch('papers.bib.format_block') as format_block:
+            self.biblio.save(self.bibtex)
+            format_block.assert_not_called()
+
+    def test_save_to_another_file(self):
+        other = os.path.join(self._tmp.name, 'other.bib')
+        with mock.patch('papers.bib.format_block', wraps=format_block) as mocked:
+            self.biblio.save(other)
+            self.assertEqual(mocked.call_count, len(self.biblio.db.blocks))
+        self.assertEqual(open(other).read(), open(self.bibtex).read())
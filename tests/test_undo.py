@@ -8,6 +8,8 @@ import subprocess as sp
 from papers.config import Config
 from papers.config import CONFIG_FILE, CONFIG_FILE_LOCAL
 from papers.bib import Biblio
+from papers.keyindex import index_file
+from papers.snapshot import snapshot_file
 # from pathlib import Path
 
 from tests.common import paperscmd, prepare_paper, run, PAPERSCMD, BaseTest, LocalGitInstallTest, LocalGitLFSInstallTest, GlobalGitInstallTest, GlobalGitLFSInstallTest
@@ -190,6 +192,15 @@ class TestUndoGitLocal(LocalGitLFSInstallTest):
     def _format_file(self, name):
         return name
 
+    def test_clean_copy_not_cached(self):
+        self.papers(f'add {self.anotherbib}')
+        backupfile_clean = str(self.config.backupfile_clean)
+        self.assertTrue(os.path.exists(backupfile_clean))
+        self.assertFalse(os.path.exists(index_file(backupfile_clean)))
+        self.assertFalse(os.path.exists(snapshot_file(backupfile_clean)))
+        # the library itself is still cached
+        self.assertTrue(os.path.exists(index_file(self._path(self.mybib))))
+
     def test_undo_files_rename(self):
         biblio = Biblio.load(self._path(self.mybib), '')
         self.assertEqual(len(biblio.entries), 0)